@@ -1,12 +1,23 @@
 import flet as ft
+import multiprocessing
 import os
 import base64
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional
+from typing import Any, Callable, Dict, List, Optional, Sequence, Union
 import threading
+import time
 
+from nyamanga.batch import BatchItem, BatchQueue, ItemStatus, localized_output_path
+from nyamanga.cancel import CancelToken, Cancelled
 from nyamanga.config import ApiConfig
-from nyamanga.pipeline import TypesettingPipeline
+from nyamanga.imaging import OUTPUT_FORMATS, OutputOptions, thumbnail_b64
+from nyamanga.pack import ChapterPack, pack_path
+from nyamanga.pipeline import AUTO_MODES, TypesettingPipeline
+from nyamanga.tracing import Tracer
+from nyamanga.translations import TranslationCache
+from nyamanga.triage import TRIAGE_MODES
+from nyamanga.remote import RemotePipeline
 
 # --- Translations ---
 TRANSLATIONS = {
@@ -38,6 +49,7 @@ TRANSLATIONS = {
         "theme_switch": "深色模式",
         "processing": "处理中...",
         "complete": "完成!",
+        "reused": "（复用相似页面的结果：{source}）",
         "error": "错误: ",
         "save_success": "设置已保存!",
         "select_img_first": "请先选择图片",
@@ -48,6 +60,49 @@ TRANSLATIONS = {
         "output_folder": "保存文件夹",
         "select_output_folder": "选择保存位置",
         "saved_to": "已保存至: ",
+        "queue_group": "批量队列",
+        "enqueue_folder": "加入整个文件夹",
+        "run_queue": "开始队列",
+        "cancel_all": "全部取消",
+        "clear_queue": "清空队列",
+        "workers": "并发数",
+        "pack_output": "打包为章节文件（.nyapack）",
+        "gallery_count": "共 {count} 张",
+        "queue_empty": "队列为空，请先选择文件夹",
+        "queue_finished": "队列已完成 — ",
+        "status_queued": "排队中",
+        "status_running": "处理中",
+        "status_paused": "已暂停",
+        "status_done": "完成",
+        "status_failed": "失败",
+        "status_cancelled": "已取消",
+        "pause": "暂停",
+        "resume": "继续",
+        "cancel": "取消",
+        "retry": "重试",
+        "stop": "停止",
+        "cancelled": "已取消",
+        "job_timeout": "单任务时限（秒，留空不限）",
+        "request_timeout": "单次请求超时上限（秒）",
+        "triage": "页面预检（自动模式）",
+        "triage_off": "关闭",
+        "triage_skip": "跳过无文字页面",
+        "triage_panels": "只发送含文字的分格",
+        "auto_mode": "自动模式流程",
+        "auto_mode_single": "单次图像编辑",
+        "auto_mode_phased": "分步：识别文字、翻译（带缓存）、排版",
+        "skipped": "（未检测到文字，原图输出）",
+        "flagged": "（本地校验未通过，请人工检查）",
+        "verify": "本地校验输出并自动修复失败区域",
+        "trace": "记录时间线（Chrome/Perfetto 追踪）",
+        "export_trace": "导出追踪",
+        "trace_saved": "追踪已导出：",
+        "trace_empty": "还没有记录到追踪事件",
+        "server_url": "任务服务器地址（可选，如 http://127.0.0.1:8765）",
+        "output_format": "输出格式",
+        "keep_format": "保持原格式",
+        "output_quality": "输出质量 (1-100)",
+        "output_max_dim": "输出最长边（像素，留空不缩放）",
     },
     "en": {
         "app_title": "NyaManga UI",
@@ -77,6 +132,7 @@ TRANSLATIONS = {
         "theme_switch": "Dark Mode",
         "processing": "Processing...",
         "complete": "Complete!",
+        "reused": " (reused the result of a similar page: {source})",
         "error": "Error: ",
         "save_success": "Settings saved!",
         "select_img_first": "Please select an image first",
@@ -87,6 +143,49 @@ TRANSLATIONS = {
         "output_folder": "Output Folder",
         "select_output_folder": "Select Output Folder",
         "saved_to": "Saved to: ",
+        "queue_group": "Batch Queue",
+        "enqueue_folder": "Enqueue Folder",
+        "run_queue": "Run Queue",
+        "cancel_all": "Cancel All",
+        "clear_queue": "Clear Queue",
+        "workers": "Workers",
+        "pack_output": "Pack into a chapter file (.nyapack)",
+        "gallery_count": "{count} pages",
+        "queue_empty": "Queue is empty, pick a folder first",
+        "queue_finished": "Queue finished — ",
+        "status_queued": "Queued",
+        "status_running": "Running",
+        "status_paused": "Paused",
+        "status_done": "Done",
+        "status_failed": "Failed",
+        "status_cancelled": "Cancelled",
+        "pause": "Pause",
+        "resume": "Resume",
+        "cancel": "Cancel",
+        "retry": "Retry",
+        "stop": "Stop",
+        "cancelled": "Cancelled",
+        "job_timeout": "Job deadline (seconds, empty = none)",
+        "request_timeout": "Max per-request timeout (seconds)",
+        "triage": "Page triage (auto mode)",
+        "triage_off": "Off",
+        "triage_skip": "Skip textless pages",
+        "triage_panels": "Send only panels with text",
+        "auto_mode": "Auto mode pipeline",
+        "auto_mode_single": "Single image edit",
+        "auto_mode_phased": "Phased: extract, translate (cached), typeset",
+        "skipped": " (no text found, page passed through)",
+        "flagged": " (failed the local check, please review)",
+        "verify": "Check outputs locally and repair failing regions",
+        "trace": "Record timeline (Chrome/Perfetto trace)",
+        "export_trace": "Export trace",
+        "trace_saved": "Trace exported: ",
+        "trace_empty": "No trace events recorded yet",
+        "server_url": "Job server URL (optional, e.g. http://127.0.0.1:8765)",
+        "output_format": "Output Format",
+        "keep_format": "Keep original",
+        "output_quality": "Output quality (1-100)",
+        "output_max_dim": "Max output side (pixels, empty = keep)",
     }
 }
 
@@ -97,7 +196,18 @@ class AppState:
         self.base_url = os.environ.get("NYAMANGA_BASE_URL", "https://api.ephone.chat/v1")
         self.chat_model = os.environ.get("NYAMANGA_CHAT_MODEL", "nano-banana-2")
         self.image_model = os.environ.get("NYAMANGA_IMAGE_MODEL", "nano-banana-2")
+        self.server_url = os.environ.get("NYAMANGA_SERVER_URL", "")
+        self.request_timeout = float(os.environ.get("NYAMANGA_TIMEOUT") or ApiConfig.request_timeout)
+        self.triage: Optional[str] = os.environ.get("NYAMANGA_TRIAGE") or None
+        self.auto_mode = os.environ.get("NYAMANGA_AUTO_MODE") or "single"
+        self.verify = os.environ.get("NYAMANGA_VERIFY", "0") not in ("", "0")
+        # Shared by every local pipeline so one timeline covers the session.
+        self.tracer = Tracer(enabled=False)
+        self.translations = TranslationCache(os.environ.get("NYAMANGA_TRANSLATION_CACHE") or None)
         self.pipeline: Optional[TypesettingPipeline] = None
+        self.batch_queue: Optional[BatchQueue] = None
+        self.job_timeout: Optional[float] = None
+        self.output_options = OutputOptions()
         self.ui_lang = "zh"  # Default to Chinese
 
     def get_config(self) -> ApiConfig:
@@ -108,13 +218,181 @@ class AppState:
             base_url=self.base_url,
             chat_model=self.chat_model,
             image_model=self.image_model,
+            request_timeout=self.request_timeout,
+            triage=self.triage,
+            auto_mode=self.auto_mode,
+            verify=self.verify,
         )
 
-    def get_pipeline(self) -> TypesettingPipeline:
-        return TypesettingPipeline(self.get_config())
+    def get_pipeline(self) -> Union[TypesettingPipeline, RemotePipeline]:
+        # A job server holds the API key and quota; talk to it instead.
+        if self.server_url:
+            return RemotePipeline(self.server_url)
+        return TypesettingPipeline(
+            self.get_config(), tracer=self.tracer, translations=self.translations
+        )
 
 app_state = AppState()
 
+
+# 1x1 transparent PNG shown until a thumbnail is ready.
+PLACEHOLDER_B64 = (
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII="
+)
+
+
+class UpdateLoop:
+    """
+    Coalesces UI refreshes requested from worker threads. Queued mutations
+    run on one loop thread at most `max_hz` times a second, followed by a
+    single update of just the touched controls instead of the whole page.
+    Requests with the same `key` replace each other (latest state wins).
+    """
+
+    def __init__(self, page: ft.Page, max_hz: float = 10.0):
+        self.page = page
+        self.interval = 1.0 / max_hz
+        self._lock = threading.Lock()
+        self._pending: Dict[Any, Callable[[], None]] = {}
+        self._controls: Dict[int, ft.Control] = {}
+        self._whole_page = False
+        self._wake = threading.Event()
+        threading.Thread(target=self._run, name="ui-updates", daemon=True).start()
+
+    def request(self, *controls: ft.Control, apply: Optional[Callable[[], None]] = None, key: Any = None):
+        """Schedule `apply` (if any) and an update of `controls` (or the page)."""
+        with self._lock:
+            if apply is not None:
+                self._pending[key if key is not None else object()] = apply
+            if controls:
+                for control in controls:
+                    self._controls[id(control)] = control
+            else:
+                self._whole_page = True
+        self._wake.set()
+
+    def _run(self):
+        last = 0.0
+        while True:
+            self._wake.wait()
+            delay = last + self.interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            with self._lock:
+                self._wake.clear()
+                pending, self._pending = self._pending, {}
+                controls, self._controls = list(self._controls.values()), {}
+                whole_page, self._whole_page = self._whole_page, False
+            for apply in pending.values():
+                try:
+                    apply()
+                except Exception as ex:
+                    print(f"UI update failed: {ex}")
+            try:
+                if whole_page:
+                    self.page.update()
+                else:
+                    mounted = [control for control in controls if control.page]
+                    if mounted:
+                        self.page.update(*mounted)
+            except Exception as ex:
+                print(f"UI update failed: {ex}")
+            last = time.monotonic()
+
+
+class Thumbnails:
+    """Small previews built off the UI thread and cached by key."""
+
+    def __init__(self, ui: UpdateLoop, size: int = 160, workers: int = 2):
+        self.ui = ui
+        self.size = size
+        self._cache: Dict[Any, str] = {}
+        self._waiting: Dict[Any, List[ft.Image]] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbs")
+
+    def attach(self, image: ft.Image, key: Any, load: Callable[[], bytes]):
+        """Show the cached preview for `key` or build it from `load()` later."""
+        with self._lock:
+            cached = self._cache.get(key)
+            image.src_base64 = cached or PLACEHOLDER_B64
+            if cached is not None:
+                return
+            waiting = self._waiting.setdefault(key, [])
+            waiting.append(image)
+            if len(waiting) > 1:
+                return
+        self._executor.submit(self._build, key, load)
+
+    def attach_path(self, image: ft.Image, path: Path):
+        self.attach(image, str(path), path.read_bytes)
+
+    def _build(self, key: Any, load: Callable[[], bytes]):
+        try:
+            data = load()
+            try:
+                b64 = thumbnail_b64(data, self.size)
+            except Exception:
+                # No Pillow or an undecodable format: show the full image.
+                b64 = base64.b64encode(data).decode("ascii")
+        except OSError:
+            b64 = PLACEHOLDER_B64
+        with self._lock:
+            self._cache[key] = b64
+            images = self._waiting.pop(key, [])
+
+        def apply():
+            for image in images:
+                image.src_base64 = b64
+
+        self.ui.request(*images, apply=apply)
+
+
+class LazyGrid:
+    """
+    Fills a GridView a page of controls at a time as the user scrolls near
+    its end, so folders with thousands of files build only what is seen.
+    """
+
+    def __init__(
+        self,
+        grid: ft.GridView,
+        build: Callable[[Any], ft.Control],
+        ui: UpdateLoop,
+        page_size: int = 48,
+    ):
+        self.grid = grid
+        self.build = build
+        self.ui = ui
+        self.page_size = page_size
+        self.items: List[Any] = []
+        self.shown = 0
+        grid.on_scroll_interval = 100
+        grid.on_scroll = self._on_scroll
+
+    def reset(self, items: Sequence[Any] = ()):
+        self.items = list(items)
+        self.shown = 0
+        self.grid.controls.clear()
+        self.load_more()
+
+    def extend(self, items: Sequence[Any]):
+        self.items.extend(items)
+        if self.shown < self.page_size:
+            self.load_more()
+
+    def load_more(self):
+        batch = self.items[self.shown : self.shown + self.page_size]
+        self.grid.controls.extend(self.build(item) for item in batch)
+        self.shown += len(batch)
+        self.ui.request(self.grid)
+
+    def _on_scroll(self, e):
+        if self.shown >= len(self.items) or e.max_scroll_extent is None:
+            return
+        if e.pixels >= e.max_scroll_extent - (e.viewport_dimension or 0):
+            self.load_more()
+
 def main(page: ft.Page):
     page.title = TRANSLATIONS[app_state.ui_lang]["app_title"]
     page.theme = ft.Theme(color_scheme_seed="indigo")
@@ -127,9 +405,19 @@ def main(page: ft.Page):
 
     # --- Components ---
 
+    # Worker threads report through this loop instead of calling page.update().
+    ui = UpdateLoop(page)
+    thumbs = Thumbnails(ui)
+    snack = ft.SnackBar(content=ft.Text(""))
+    page.overlay.append(snack)
+
     def show_snack(message: str, color: str = "green"):
-        page.overlay.append(ft.SnackBar(content=ft.Text(message), bgcolor=color, open=True))
-        page.update()
+        def apply():
+            snack.content.value = message
+            snack.bgcolor = color
+            snack.open = True
+
+        ui.request(snack, apply=apply, key="snack")
 
     def show_error(message: str):
         show_snack(f"{T('error')}{message}", "red")
@@ -151,6 +439,20 @@ def main(page: ft.Page):
     base_url_field = ft.TextField(value=app_state.base_url)
     chat_model_field = ft.TextField(value=app_state.chat_model)
     image_model_field = ft.TextField(value=app_state.image_model)
+    job_timeout_field = ft.TextField(value="", keyboard_type=ft.KeyboardType.NUMBER)
+    request_timeout_field = ft.TextField(
+        value=f"{app_state.request_timeout:g}", keyboard_type=ft.KeyboardType.NUMBER
+    )
+    server_url_field = ft.TextField(value=app_state.server_url)
+    triage_field = ft.Dropdown(value=app_state.triage or "off", width=300)
+    auto_mode_field = ft.Dropdown(value=app_state.auto_mode, width=300)
+    verify_switch = ft.Switch(value=app_state.verify)
+    trace_switch = ft.Switch(value=app_state.tracer.enabled)
+    trace_export_btn = ft.OutlinedButton(icon="timeline")
+    trace_picker = ft.FilePicker()
+    output_format_field = ft.Dropdown(value="keep", width=200)
+    output_quality_field = ft.TextField(value="90", width=200, keyboard_type=ft.KeyboardType.NUMBER)
+    output_max_dim_field = ft.TextField(value="", keyboard_type=ft.KeyboardType.NUMBER)
     save_btn = ft.ElevatedButton(on_click=lambda e: save_settings(e))
     lang_switch = ft.Dropdown(
         value=app_state.ui_lang,
@@ -179,6 +481,7 @@ def main(page: ft.Page):
     loc_bubble_hint = ft.TextField(value="")
     loc_extra_prompt = ft.TextField(multiline=True, min_lines=2)
     loc_run_btn = ft.ElevatedButton(icon="play_arrow", style=ft.ButtonStyle(color="white", bgcolor="indigo"))
+    loc_stop_btn = ft.OutlinedButton(icon="stop", visible=False)
     loc_preview_image = ft.Image(src="", visible=False, height=400, fit=ft.ImageFit.CONTAIN)
     loc_result_image = ft.Image(src_base64="", visible=False, height=400, fit=ft.ImageFit.CONTAIN)
     loc_result_text = ft.Text("", selectable=True)
@@ -187,13 +490,37 @@ def main(page: ft.Page):
     loc_dir_picker = ft.FilePicker()
     loc_select_btn = ft.ElevatedButton(icon="upload_file")
     loc_select_folder_btn = ft.ElevatedButton(icon="folder_open")
-    loc_image_dropdown = ft.Dropdown(visible=False, width=400)
+    loc_gallery = ft.GridView(
+        max_extent=110,
+        child_aspect_ratio=0.72,
+        spacing=6,
+        run_spacing=6,
+        height=280,
+        visible=False,
+    )
+    loc_gallery_count = ft.Text("", size=12, color="grey", visible=False)
     loc_manual_btn = ft.IconButton(icon="edit")
     
     loc_output_path_display = ft.Text(value="", italic=True, size=12, color="grey")
     loc_output_dir_picker = ft.FilePicker()
     loc_select_output_btn = ft.ElevatedButton(icon="save_alt")
 
+    # Batch queue
+    loc_workers_field = ft.TextField(value="4", width=120, keyboard_type=ft.KeyboardType.NUMBER)
+    loc_pack_switch = ft.Switch(value=False)
+    loc_enqueue_btn = ft.ElevatedButton(icon="playlist_add")
+    loc_queue_run_btn = ft.ElevatedButton(icon="playlist_play")
+    loc_queue_cancel_btn = ft.OutlinedButton(icon="cancel")
+    loc_queue_clear_btn = ft.OutlinedButton(icon="clear_all")
+    loc_queue_summary = ft.Text("", size=12, color="grey")
+    loc_queue_grid = ft.GridView(
+        max_extent=220,
+        child_aspect_ratio=0.62,
+        spacing=8,
+        run_spacing=8,
+        height=520,
+    )
+
     # Rewrite Fields
     rw_source = ft.TextField(multiline=True, min_lines=3)
     rw_lang = ft.Dropdown(
@@ -233,6 +560,26 @@ def main(page: ft.Page):
         base_url_field.label = T("base_url")
         chat_model_field.label = T("chat_model")
         image_model_field.label = T("image_model")
+        job_timeout_field.label = T("job_timeout")
+        request_timeout_field.label = T("request_timeout")
+        server_url_field.label = T("server_url")
+        triage_field.label = T("triage")
+        triage_field.options = [
+            ft.dropdown.Option(mode, T(f"triage_{mode}")) for mode in ("off",) + TRIAGE_MODES
+        ]
+        auto_mode_field.label = T("auto_mode")
+        auto_mode_field.options = [
+            ft.dropdown.Option(mode, T(f"auto_mode_{mode}")) for mode in AUTO_MODES
+        ]
+        verify_switch.label = T("verify")
+        trace_switch.label = T("trace")
+        trace_export_btn.text = T("export_trace")
+        output_format_field.label = T("output_format")
+        output_format_field.options = [ft.dropdown.Option("keep", T("keep_format"))] + [
+            ft.dropdown.Option(fmt, fmt.upper()) for fmt in OUTPUT_FORMATS
+        ]
+        output_quality_field.label = T("output_quality")
+        output_max_dim_field.label = T("output_max_dim")
         save_btn.text = T("save_config")
         lang_switch.label = T("language_switch")
 
@@ -241,14 +588,24 @@ def main(page: ft.Page):
         loc_image_path_input.label = T("image_path")
         loc_select_btn.text = T("select_image")
         loc_select_folder_btn.text = T("select_folder")
-        loc_image_dropdown.label = T("folder_images")
+        loc_gallery_count.value = gallery_summary()
         loc_target_lang.label = T("target_lang")
         loc_tone.label = T("tone")
         loc_bubble_hint.label = T("bubble_hint")
         loc_extra_prompt.label = T("extra_prompt")
         loc_run_btn.text = T("run_localize")
+        loc_stop_btn.text = T("stop")
         loc_manual_btn.tooltip = T("manual_input")
         loc_select_output_btn.text = T("select_output_folder")
+        loc_workers_field.label = T("workers")
+        loc_pack_switch.label = T("pack_output")
+        loc_enqueue_btn.text = T("enqueue_folder")
+        loc_queue_run_btn.text = T("run_queue")
+        loc_queue_cancel_btn.text = T("cancel_all")
+        loc_queue_clear_btn.text = T("clear_queue")
+        for item in list(queue_cards):
+            refresh_queue_card(item)
+        refresh_queue_summary()
         if loc_output_folder:
              loc_output_path_display.value = f"{T('output_folder')}: {loc_output_folder}"
         else:
@@ -269,16 +626,73 @@ def main(page: ft.Page):
 
     lang_switch.on_change = on_lang_change
 
+    def on_trace_toggle(e):
+        # Takes effect immediately, for running jobs too; a new recording
+        # starts from an empty timeline.
+        if trace_switch.value and not app_state.tracer.enabled:
+            app_state.tracer.clear()
+        app_state.tracer.enabled = bool(trace_switch.value)
+
+    def on_trace_path_picked(e: ft.FilePickerResultEvent):
+        if not e.path:
+            return
+        try:
+            saved = app_state.tracer.export(Path(e.path))
+        except OSError as exc:
+            show_snack(f"{T('error')}{exc}", "red")
+            return
+        show_snack(f"{T('trace_saved')}{saved}")
+
+    def on_trace_export(e):
+        if not app_state.tracer.count:
+            show_snack(T("trace_empty"), "orange")
+            return
+        trace_picker.save_file(file_name="nyamanga-trace.json", allowed_extensions=["json"])
+
+    trace_switch.on_change = on_trace_toggle
+    trace_picker.on_result = on_trace_path_picked
+    trace_export_btn.on_click = on_trace_export
+    page.overlay.append(trace_picker)
+
     def save_settings(e):
         app_state.api_key = api_key_field.value or ""
         app_state.base_url = base_url_field.value or ""
         app_state.chat_model = chat_model_field.value or ""
         app_state.image_model = image_model_field.value or ""
+        app_state.server_url = (server_url_field.value or "").strip()
+        app_state.triage = None if triage_field.value in (None, "off") else triage_field.value
+        app_state.auto_mode = auto_mode_field.value or "single"
+        app_state.verify = bool(verify_switch.value)
+        try:
+            app_state.job_timeout = float(job_timeout_field.value) if job_timeout_field.value else None
+        except ValueError:
+            app_state.job_timeout = None
+        try:
+            app_state.request_timeout = float(request_timeout_field.value or ApiConfig.request_timeout)
+        except ValueError:
+            app_state.request_timeout = ApiConfig.request_timeout
+        try:
+            app_state.output_options = OutputOptions(
+                format=None if output_format_field.value in (None, "keep") else output_format_field.value,
+                quality=int(output_quality_field.value or 90),
+                max_dimension=int(output_max_dim_field.value) if output_max_dim_field.value else None,
+            )
+        except ValueError:
+            app_state.output_options = OutputOptions()
+        # Pick up the new settings in the batch queue once it is idle.
+        batch = app_state.batch_queue
+        if batch is not None:
+            batch.job_timeout = app_state.job_timeout
+            batch.output_options = app_state.output_options
+        if batch is not None and (app_state.api_key or app_state.server_url) and not batch.busy:
+            batch.pipeline.close()
+            batch.pipeline = app_state.get_pipeline()
         show_snack(T("save_success"))
 
     # Localize Logic
     loc_selected_file: Optional[str] = None
     loc_output_folder: Optional[str] = None
+    loc_cancel_token: Optional[CancelToken] = None
     loc_images = []
 
     def loc_on_output_folder_picked(e: ft.FilePickerResultEvent):
@@ -307,14 +721,47 @@ def main(page: ft.Page):
             print(f"Error loading image: {e}")
             loc_preview_image.visible = False
 
-        if loc_image_dropdown.options:
-            loc_image_dropdown.value = path
+        highlight_gallery_tile(path)
         page.update()
     
     def loc_on_file_picked(e: ft.FilePickerResultEvent):
         if e.files:
             set_selected_image(e.files[0].path)
 
+    gallery_tiles: Dict[str, ft.Container] = {}
+    gallery_selected: Optional[str] = None
+
+    def highlight_gallery_tile(path: str):
+        nonlocal gallery_selected
+        for key, color in ((gallery_selected, None), (path, "indigo")):
+            tile = gallery_tiles.get(key) if key else None
+            if tile is not None:
+                tile.border = ft.border.all(3, color) if color else None
+        gallery_selected = path
+
+    def build_gallery_tile(path: Path) -> ft.Container:
+        image = ft.Image(height=110, fit=ft.ImageFit.CONTAIN)
+        thumbs.attach_path(image, path)
+        tile = ft.Container(
+            content=ft.Column(
+                [image, ft.Text(path.name, size=10, no_wrap=True, tooltip=str(path))],
+                spacing=2,
+            ),
+            padding=4,
+            border_radius=6,
+            border=ft.border.all(3, "indigo") if str(path) == gallery_selected else None,
+            on_click=lambda _: set_selected_image(str(path)),
+        )
+        gallery_tiles[str(path)] = tile
+        return tile
+
+    gallery_pager = LazyGrid(loc_gallery, build_gallery_tile, ui)
+
+    def gallery_summary() -> str:
+        if not gallery_pager.items:
+            return ""
+        return f"{T('folder_images')} · {T('gallery_count').format(count=len(gallery_pager.items))}"
+
     def loc_on_folder_picked(e: ft.FilePickerResultEvent):
         nonlocal loc_images
         if not e.path:
@@ -328,13 +775,13 @@ def main(page: ft.Page):
         if not loc_images:
             show_error("文件夹里没有图片（png/jpg/jpeg/webp）")
             return
-        loc_image_dropdown.options = [ft.dropdown.Option(str(p)) for p in loc_images]
-        loc_image_dropdown.value = str(loc_images[0])
-        loc_image_dropdown.visible = True
+        gallery_tiles.clear()
+        gallery_pager.reset(loc_images)
+        loc_gallery.visible = True
+        loc_gallery_count.value = gallery_summary()
+        loc_gallery_count.visible = True
         set_selected_image(str(loc_images[0]))
 
-    loc_image_dropdown.on_change = lambda e: set_selected_image(e.control.value) if e.control.value else None
-
     loc_file_picker.on_result = loc_on_file_picked
     loc_dir_picker.on_result = loc_on_folder_picked
     # Ensure pickers are registered; overlay has no setter in current Flet.
@@ -385,11 +832,16 @@ def main(page: ft.Page):
             show_error(T("select_img_first"))
             return
 
+        nonlocal loc_cancel_token
+        token = CancelToken.with_timeout(app_state.job_timeout)
+        loc_cancel_token = token
         loc_progress.visible = True
+        loc_stop_btn.visible = True
         loc_result_image.visible = False
         page.update()
 
         def task():
+            pipeline = None
             try:
                 pipeline = app_state.get_pipeline()
                 result = pipeline.localize_panel(
@@ -398,35 +850,249 @@ def main(page: ft.Page):
                     target_language=loc_target_lang.value or "zh",
                     tone=loc_tone.value or "friendly manga voice",
                     bubble_hint=loc_bubble_hint.value if loc_bubble_hint.value else None,
-                    style_hint=loc_extra_prompt.value if loc_extra_prompt.value else None
+                    style_hint=loc_extra_prompt.value if loc_extra_prompt.value else None,
+                    cancel=token,
                 )
                 loc_result_image.src_base64 = result.edited_image_b64
                 loc_result_image.visible = True
                 loc_result_text.value = f"{T('result')}: {result.rewritten_text or '[auto]'}"
+                if getattr(result, "reused_from", None):
+                    loc_result_text.value += T("reused").format(source=result.reused_from)
+                elif getattr(result, "skipped", False):
+                    loc_result_text.value += T("skipped")
+                if getattr(result, "flagged", False):
+                    loc_result_text.value += T("flagged")
                 
                 if loc_output_folder:
                     try:
-                        original_path = Path(current_file)
-                        new_filename = f"{original_path.stem}_localized{original_path.suffix}"
-                        save_path = Path(loc_output_folder) / new_filename
+                        save_path = localized_output_path(Path(current_file), Path(loc_output_folder))
                         
-                        with open(save_path, "wb") as f:
-                            f.write(base64.b64decode(result.edited_image_b64))
+                        save_path = pipeline.save_result(
+                            result, save_path, app_state.output_options
+                        ).result()
                         show_snack(f"{T('complete')} {T('saved_to')}{save_path.name}")
                     except Exception as save_ex:
                         show_error(f"Save failed: {save_ex}")
                 else:
                     show_snack(T("complete"))
+            except Cancelled as ex:
+                if token.cancelled:
+                    show_snack(T("cancelled"), "orange")
+                else:
+                    show_error(str(ex))
             except Exception as ex:
                 show_error(str(ex))
             finally:
-                loc_progress.visible = False
-                page.update()
+                # Each click gets its own pipeline; release its sessions and image pool.
+                if pipeline is not None:
+                    pipeline.close()
+                if loc_cancel_token is token:
+                    loc_progress.visible = False
+                    loc_stop_btn.visible = False
+                ui.request(loc_result_image, loc_result_text, loc_progress, loc_stop_btn)
 
         threading.Thread(target=task).start()
     
     loc_run_btn.on_click = run_localize
 
+    def stop_localize(e):
+        if loc_cancel_token is not None:
+            loc_cancel_token.cancel()
+
+    loc_stop_btn.on_click = stop_localize
+
+    # Batch queue logic
+    queue_cards = {}
+
+    def get_batch_queue() -> BatchQueue:
+        if app_state.batch_queue is None:
+            app_state.batch_queue = BatchQueue(
+                app_state.get_pipeline(),
+                workers=parse_workers(),
+                on_update=on_queue_update,
+                job_timeout=app_state.job_timeout,
+                output_options=app_state.output_options,
+            )
+        return app_state.batch_queue
+
+    def parse_workers() -> int:
+        try:
+            return max(1, int(loc_workers_field.value or "4"))
+        except ValueError:
+            return 4
+
+    def refresh_queue_summary():
+        batch = app_state.batch_queue
+        if batch is None or not batch.items:
+            loc_queue_summary.value = ""
+        else:
+            counts = batch.counts()
+            loc_queue_summary.value = "  ".join(
+                f"{T('status_' + status.value)}: {count}"
+                for status, count in counts.items()
+                if count
+            )
+
+    def refresh_queue_card(item: BatchItem):
+        refs = queue_cards.get(item)
+        if refs is None:
+            return
+        refs["status"].value = T(f"status_{item.status.value}")
+        refs["status"].color = {
+            ItemStatus.DONE: "green",
+            ItemStatus.FAILED: "red",
+            ItemStatus.RUNNING: "indigo",
+        }.get(item.status, "grey")
+        elapsed = item.elapsed
+        refs["time"].value = f"{elapsed:.1f}s" if elapsed is not None else ""
+        if item.error:
+            refs["status"].tooltip = item.error
+        if item.status == ItemStatus.DONE and item.result is not None and not refs.get("result_thumb"):
+            refs["result_thumb"] = True
+            result_b64 = item.result.edited_image_b64
+            thumbs.attach(refs["thumb"], ("result", id(item)), lambda: base64.b64decode(result_b64))
+        is_paused = item.status == ItemStatus.PAUSED
+        refs["pause"].icon = "play_arrow" if is_paused else "pause"
+        refs["pause"].tooltip = T("resume") if is_paused else T("pause")
+        refs["pause"].visible = item.status in (ItemStatus.QUEUED, ItemStatus.PAUSED)
+        refs["cancel"].tooltip = T("cancel")
+        refs["cancel"].visible = item.status in (
+            ItemStatus.QUEUED, ItemStatus.PAUSED, ItemStatus.RUNNING
+        )
+        refs["retry"].tooltip = T("retry")
+        refs["retry"].visible = item.status in (ItemStatus.FAILED, ItemStatus.CANCELLED)
+
+    def on_queue_update(item: BatchItem):
+        # Called from worker threads; coalesced per card by the update loop.
+        refs = queue_cards.get(item)
+        if refs is not None:
+            ui.request(refs["card"], apply=lambda: refresh_queue_card(item), key=("card", item))
+        ui.request(loc_queue_summary, apply=refresh_queue_summary, key="queue_summary")
+        batch = app_state.batch_queue
+        finished = item.status in (ItemStatus.DONE, ItemStatus.FAILED, ItemStatus.CANCELLED)
+        if finished and batch is not None and not batch.busy:
+            # One summary when the queue drains instead of a snack per page.
+            show_queue_finished(batch)
+
+    def show_queue_finished(batch: BatchQueue):
+        counts = batch.counts()
+        message = T("queue_finished") + "  ".join(
+            f"{T('status_' + status.value)}: {counts[status]}"
+            for status in (ItemStatus.DONE, ItemStatus.FAILED, ItemStatus.CANCELLED)
+            if counts[status]
+        )
+        target = batch.pack.path if batch.pack is not None else batch.output_dir
+        if target is not None and counts[ItemStatus.DONE]:
+            message += f"  {T('saved_to')}{target.name}"
+        show_snack(message, "orange" if counts[ItemStatus.FAILED] else "green")
+
+    def toggle_pause(item: BatchItem):
+        batch = get_batch_queue()
+        if item.status == ItemStatus.PAUSED:
+            batch.resume(item)
+        else:
+            batch.pause(item)
+
+    def show_queue_item(item: BatchItem):
+        set_selected_image(str(item.image_path))
+        if item.result is not None:
+            loc_result_image.src_base64 = item.result.edited_image_b64
+            loc_result_image.visible = True
+            loc_result_text.value = f"{T('result')}: {item.result.rewritten_text or '[auto]'}"
+            if item.result.flagged:
+                loc_result_text.value += T("flagged")
+            page.update()
+
+    def build_queue_card(item: BatchItem) -> ft.Card:
+        refs = {
+            "thumb": ft.Image(height=160, fit=ft.ImageFit.CONTAIN),
+            "status": ft.Text(size=12),
+            "time": ft.Text(size=11, color="grey"),
+            "pause": ft.IconButton(icon="pause", icon_size=18, on_click=lambda _: toggle_pause(item)),
+            "cancel": ft.IconButton(
+                icon="close", icon_size=18, on_click=lambda _: get_batch_queue().cancel(item)
+            ),
+            "retry": ft.IconButton(
+                icon="refresh", icon_size=18, on_click=lambda _: get_batch_queue().retry(item)
+            ),
+        }
+        refs["card"] = ft.Card(
+            content=ft.Container(
+                content=ft.Column(
+                    [
+                        refs["thumb"],
+                        ft.Text(item.image_path.name, size=12, no_wrap=True, tooltip=str(item.image_path)),
+                        ft.Row([refs["status"], refs["time"]], spacing=6),
+                        ft.Row([refs["pause"], refs["cancel"], refs["retry"]], spacing=0),
+                    ],
+                    spacing=4,
+                ),
+                padding=8,
+                on_click=lambda _: show_queue_item(item),
+            )
+        )
+        queue_cards[item] = refs
+        thumbs.attach_path(refs["thumb"], item.image_path)
+        refresh_queue_card(item)
+        return refs["card"]
+
+    queue_pager = LazyGrid(loc_queue_grid, build_queue_card, ui)
+
+    def on_enqueue_folder(e):
+        if not loc_images:
+            show_error(T("queue_empty"))
+            return
+        try:
+            batch = get_batch_queue()
+        except Exception as ex:
+            show_error(str(ex))
+            return
+        items = batch.enqueue(
+            loc_images,
+            source_text=None,
+            target_language=loc_target_lang.value or "zh",
+            tone=loc_tone.value or "friendly manga voice",
+            bubble_hint=loc_bubble_hint.value if loc_bubble_hint.value else None,
+            style_hint=loc_extra_prompt.value if loc_extra_prompt.value else None,
+        )
+        queue_pager.extend(items)
+        ui.request(loc_queue_summary, apply=refresh_queue_summary, key="queue_summary")
+
+    def on_run_queue(e):
+        batch = app_state.batch_queue
+        if batch is None or not batch.items:
+            show_error(T("queue_empty"))
+            return
+        batch.set_workers(parse_workers())
+        batch.output_dir = Path(loc_output_folder) if loc_output_folder else None
+        pack = None
+        if loc_pack_switch.value:
+            # One pack per chapter folder; the folder rescan only lists images.
+            chapter = batch.items[0].image_path.parent
+            path = pack_path(batch.output_dir or chapter, chapter.name)
+            pack = batch.pack
+            if pack is None or pack.path != path:
+                pack = ChapterPack(path)
+        # Items already running finish into the pack they started with.
+        batch.set_pack(pack)
+        batch.start()
+
+    def on_cancel_queue(e):
+        if app_state.batch_queue is not None:
+            app_state.batch_queue.cancel_all()
+
+    def on_clear_queue(e):
+        if app_state.batch_queue is not None:
+            app_state.batch_queue.clear()
+        queue_cards.clear()
+        queue_pager.reset()
+        ui.request(loc_queue_summary, apply=refresh_queue_summary, key="queue_summary")
+
+    loc_enqueue_btn.on_click = on_enqueue_folder
+    loc_queue_run_btn.on_click = on_run_queue
+    loc_queue_cancel_btn.on_click = on_cancel_queue
+    loc_queue_clear_btn.on_click = on_clear_queue
+
     # Rewrite Logic
     def run_rewrite(e):
         if not rw_source.value:
@@ -436,6 +1102,7 @@ def main(page: ft.Page):
         page.update()
         
         def task():
+            pipeline = None
             try:
                 pipeline = app_state.get_pipeline()
                 res = pipeline.embedder.rewrite_dialogue(
@@ -447,8 +1114,10 @@ def main(page: ft.Page):
             except Exception as ex:
                 show_error(str(ex))
             finally:
+                if pipeline is not None:
+                    pipeline.close()
                 rw_progress.visible = False
-                page.update()
+                ui.request(rw_result, rw_progress)
         threading.Thread(target=task).start()
 
     rw_run_btn.on_click = run_rewrite
@@ -484,6 +1153,15 @@ def main(page: ft.Page):
                             base_url_field,
                             chat_model_field,
                             image_model_field,
+                            job_timeout_field,
+                            request_timeout_field,
+                            server_url_field,
+                            triage_field,
+                            auto_mode_field,
+                            verify_switch,
+                            ft.Row([trace_switch, trace_export_btn]),
+                            ft.Row([output_format_field, output_quality_field]),
+                            output_max_dim_field,
                             save_btn
                         ])
                     ]),
@@ -507,14 +1185,27 @@ def main(page: ft.Page):
                                 ft.Container(loc_image_path_display, padding=ft.padding.only(left=10), expand=True),
                                 loc_image_path_input
                             ], alignment=ft.MainAxisAlignment.START, vertical_alignment=ft.CrossAxisAlignment.CENTER),
-                            loc_image_dropdown,
+                            loc_gallery_count,
+                            loc_gallery,
                             ft.Row([loc_target_lang, loc_tone]), # Row 1
                             ft.Row([loc_bubble_hint], expand=True), # Row 2 (Full width)
                             loc_extra_prompt,
                             ft.Row([loc_select_output_btn, ft.Container(loc_output_path_display, padding=ft.padding.only(left=10), expand=True)]),
-                            ft.Row([loc_run_btn], alignment=ft.MainAxisAlignment.END),
+                            ft.Row([loc_stop_btn, loc_run_btn], alignment=ft.MainAxisAlignment.END),
                             loc_progress
                         ]),
+                        build_card("queue_group", [
+                            ft.Row([
+                                loc_enqueue_btn,
+                                loc_workers_field,
+                                loc_pack_switch,
+                                loc_queue_run_btn,
+                                loc_queue_cancel_btn,
+                                loc_queue_clear_btn,
+                            ], wrap=True),
+                            loc_queue_summary,
+                            loc_queue_grid,
+                        ]),
                         build_card("output_group", [
                             ft.ResponsiveRow([
                                 ft.Column([ft.Text(T("original")), loc_preview_image], col={"sm": 12, "md": 6}),
@@ -581,4 +1272,6 @@ def main(page: ft.Page):
     )
 
 if __name__ == "__main__":
+    # Image worker processes re-launch the frozen app; let them bootstrap.
+    multiprocessing.freeze_support()
     ft.app(target=main, view=ft.AppView.FLET_APP)
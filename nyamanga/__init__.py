@@ -4,5 +4,5 @@ for manga typesetting pipelines. UI components can import these helpers or
 call the CLI shim for quick experiments.
 """
 
-__all__ = ["config", "client", "embedder", "pipeline"]
+__all__ = ["config", "client", "embedder", "pipeline", "batch"]
 __version__ = "0.1.0"
@@ -0,0 +1,374 @@
+"""
+Queue-based batch runner for localizing many pages at once.
+Items share one pipeline and one executor so a whole chapter can run at the
+configured parallelism; UI layers subscribe to `on_update` to redraw status.
+"""
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+from enum import Enum
+from pathlib import Path
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from .cancel import CancelToken, Cancelled, DeadlineExceeded
+from .imaging import OutputOptions
+from .pack import ChapterPack, PackEntry
+from .pipeline import PanelResult, TypesettingPipeline
+from .scheduler import Budget, Priority
+
+
+class ItemStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    PAUSED = "paused"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+@dataclass(eq=False)
+class BatchItem:
+    image_path: Path
+    options: Dict[str, Any] = field(default_factory=dict)
+    status: ItemStatus = ItemStatus.QUEUED
+    result: Optional[PanelResult] = None
+    output_path: Optional[Path] = None
+    # Set instead of a loose file when the queue writes into a `ChapterPack`.
+    pack_entry: Optional[PackEntry] = None
+    error: Optional[str] = None
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    _future: Optional[Future] = field(default=None, repr=False)
+    _token: Optional[CancelToken] = field(default=None, repr=False)
+
+    @property
+    def elapsed(self) -> Optional[float]:
+        """Seconds spent running, or None if the item never started."""
+        if self.started_at is None:
+            return None
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        return end - self.started_at
+
+
+def localized_output_path(image_path: Path, output_dir: Path) -> Path:
+    """Default `<stem>_localized<suffix>` naming used by the UI and batch runs."""
+    return output_dir / f"{image_path.stem}_localized{image_path.suffix}"
+
+
+def language_output_path(output: Path, language: str) -> Path:
+    """`out.png` -> `out_en.png` for multi-language runs."""
+    return output.with_name(f"{output.stem}_{language}{output.suffix}")
+
+
+class BatchQueue:
+    """
+    Runs `localize_panel` for many images on a shared thread pool.
+    Items can be paused, cancelled or retried individually; every status
+    change is reported through `on_update` (called from worker threads).
+    `job_timeout` gives each item a deadline measured from when it starts;
+    `output_options` controls how results written to `output_dir` are encoded.
+    Items run at batch priority unless enqueued with another `priority`; a
+    `job_budget` template gives every item its own fresh spend cap.
+    With a `pack`, results are appended to that chapter pack instead of being
+    written to `output_dir`; each item writes to the pack that was current
+    when it started (see `set_pack`).
+    """
+
+    def __init__(
+        self,
+        pipeline: TypesettingPipeline,
+        workers: int = 4,
+        output_dir: Optional[Path] = None,
+        on_update: Optional[Callable[[BatchItem], None]] = None,
+        job_timeout: Optional[float] = None,
+        output_options: Optional[OutputOptions] = None,
+        job_budget: Optional[Budget] = None,
+        pack: Optional[ChapterPack] = None,
+    ):
+        self.pipeline = pipeline
+        self.pack = pack
+        self.output_dir = output_dir
+        self.job_timeout = job_timeout
+        self.output_options = output_options
+        self.job_budget = job_budget
+        self.on_update = on_update
+        self.items: List[BatchItem] = []
+        self._lock = threading.Lock()
+        # Items started against each pack whose write hasn't landed yet.
+        self._pack_users: Counter = Counter()
+        self._workers = max(1, workers)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self._workers, thread_name_prefix="nyamanga-batch"
+        )
+
+    @property
+    def workers(self) -> int:
+        return self._workers
+
+    @property
+    def busy(self) -> bool:
+        return any(
+            item.status in (ItemStatus.QUEUED, ItemStatus.RUNNING) and item._future is not None
+            for item in list(self.items)
+        )
+
+    def set_workers(self, workers: int) -> None:
+        """
+        Resize the pool. Running items finish on the old executor; items
+        still waiting for a slot move to the new one.
+        """
+        workers = max(1, workers)
+        with self._lock:
+            if workers == self._workers:
+                return
+            old = self._executor
+            self._workers = workers
+            self._executor = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="nyamanga-batch"
+            )
+            old.shutdown(wait=False, cancel_futures=True)
+            for item in self.items:
+                if item.status == ItemStatus.QUEUED and item._future is not None:
+                    if item._future.cancelled():
+                        item._future = self._executor.submit(self._run, item)
+
+    def set_pack(self, pack: Optional[ChapterPack]) -> None:
+        """
+        Write items started from now on into `pack` (None for loose files).
+        The previous pack is closed once the items already using it finish.
+        """
+        with self._lock:
+            old, self.pack = self.pack, pack
+            idle = old is not None and old is not pack and not self._pack_users[old]
+        if idle:
+            old.close()
+
+    def enqueue(self, image_paths: Iterable[Path], **options: Any) -> List[BatchItem]:
+        """
+        Add images to the queue without starting them.
+        `options` are forwarded to `TypesettingPipeline.localize_panel`.
+        """
+        options.setdefault("priority", Priority.BATCH)
+        added = [BatchItem(image_path=Path(p), options=dict(options)) for p in image_paths]
+        with self._lock:
+            self.items.extend(added)
+        for item in added:
+            self._notify(item)
+        return added
+
+    def start(self) -> None:
+        """Submit every queued item to the executor."""
+        with self._lock:
+            pending = [
+                item
+                for item in self.items
+                if item.status == ItemStatus.QUEUED and item._future is None
+            ]
+            for item in pending:
+                item._future = self._executor.submit(self._run, item)
+
+    def pause(self, item: BatchItem) -> bool:
+        """Hold a queued item back; running items cannot be paused."""
+        with self._lock:
+            if item.status != ItemStatus.QUEUED:
+                return False
+            if item._future is not None and not item._future.cancel():
+                return False
+            item._future = None
+            item.status = ItemStatus.PAUSED
+        self._notify(item)
+        return True
+
+    def resume(self, item: BatchItem) -> bool:
+        with self._lock:
+            if item.status != ItemStatus.PAUSED:
+                return False
+            item.status = ItemStatus.QUEUED
+            item._future = self._executor.submit(self._run, item)
+        self._notify(item)
+        return True
+
+    def cancel(self, item: BatchItem) -> bool:
+        """
+        Cancel a queued/paused item, or abort a running one; its worker slot
+        is released without waiting for the in-flight request.
+        """
+        with self._lock:
+            if item.status not in (ItemStatus.QUEUED, ItemStatus.PAUSED, ItemStatus.RUNNING):
+                return False
+            if item._future is not None:
+                item._future.cancel()
+            if item._token is not None:
+                item._token.cancel()
+            item.status = ItemStatus.CANCELLED
+            if item.finished_at is None and item.started_at is not None:
+                item.finished_at = time.monotonic()
+        self._notify(item)
+        return True
+
+    def cancel_all(self) -> None:
+        for item in list(self.items):
+            self.cancel(item)
+
+    def retry(self, item: BatchItem) -> bool:
+        """Re-queue a failed or cancelled item and submit it right away."""
+        with self._lock:
+            if item.status not in (ItemStatus.FAILED, ItemStatus.CANCELLED):
+                return False
+            if item._future is not None and not item._future.done():
+                return False
+            item.status = ItemStatus.QUEUED
+            item.result = None
+            item.error = None
+            item.started_at = None
+            item.finished_at = None
+            item._future = self._executor.submit(self._run, item)
+        self._notify(item)
+        return True
+
+    def clear(self) -> None:
+        """Cancel everything and drop all items."""
+        self.cancel_all()
+        with self._lock:
+            self.items = []
+
+    def counts(self) -> Dict[ItemStatus, int]:
+        counts = {status: 0 for status in ItemStatus}
+        for item in list(self.items):
+            counts[item.status] += 1
+        return counts
+
+    def shutdown(self, wait: bool = False) -> None:
+        self.cancel_all()
+        self._executor.shutdown(wait=wait)
+
+    def _run(self, item: BatchItem) -> None:
+        with self._lock:
+            if item.status != ItemStatus.QUEUED:
+                return
+            item.status = ItemStatus.RUNNING
+            item.started_at = time.monotonic()
+            item._token = token = CancelToken.with_timeout(self.job_timeout)
+            pack = self.pack
+            if pack is not None:
+                self._pack_users[pack] += 1
+        self._notify(item)
+        packed = None
+        try:
+            packed = self._attempt(item, token, pack)
+        finally:
+            if packed is not None:
+                packed.add_done_callback(lambda _: self._release_pack(pack))
+            elif pack is not None:
+                self._release_pack(pack)
+
+    def _attempt(
+        self, item: BatchItem, token: CancelToken, pack: Optional[ChapterPack] = None
+    ) -> Optional[Future]:
+        """Run one attempt of `item`; returns the pending pack write, if any."""
+        options = dict(item.options)
+        if self.job_budget is not None and "budget" not in options:
+            options["budget"] = replace(self.job_budget, requests=0, tokens=0)
+        try:
+            result = self.pipeline.localize_panel(
+                image_path=item.image_path, cancel=token, **options
+            )
+        except Exception as exc:
+            self._fail(item, token, exc)
+            return None
+        with self._lock:
+            # Cancelled just as the response arrived: don't write it out.
+            cancelled = token.cancelled or item.status != ItemStatus.RUNNING
+        if cancelled:
+            self._fail(item, token, Cancelled("Job was cancelled"))
+            return None
+
+        if pack is not None:
+            language = str(options.get("target_language") or "zh")
+            packed = pack.add_encoded(
+                self.pipeline.images.encode(result.edited_image_b64, self.output_options),
+                item.image_path.name,
+                language,
+                name=localized_output_path(item.image_path, Path()).name,
+                params={"source": str(item.image_path), "text": result.rewritten_text},
+            )
+            packed.add_done_callback(
+                lambda fut: self._on_written(item, result, fut, token, pack.path)
+            )
+            return packed
+        if self.output_dir is None:
+            self._complete(item, token, result, None)
+            return None
+        # Writing happens on the pipeline's image pool; free this worker now.
+        output_path = localized_output_path(item.image_path, self.output_dir)
+        write = self.pipeline.save_result(result, output_path, self.output_options)
+        write.add_done_callback(lambda fut: self._on_written(item, result, fut, token))
+        return None
+
+    def _on_written(
+        self,
+        item: BatchItem,
+        result: PanelResult,
+        write: Future,
+        token: CancelToken,
+        pack_path: Optional[Path] = None,
+    ) -> None:
+        if write.exception() is not None:
+            self._fail(item, token, write.exception())
+        elif isinstance(write.result(), PackEntry):
+            self._complete(item, token, result, pack_path, write.result())
+        else:
+            self._complete(item, token, result, write.result())
+
+    # `token` identifies the attempt reporting back; a write left over from an
+    # earlier, cancelled attempt must not settle a retried item.
+    def _fail(self, item: BatchItem, token: CancelToken, exc: BaseException) -> None:
+        with self._lock:
+            if item.status != ItemStatus.RUNNING or token is not item._token:
+                return
+            # Deadline overruns count as failures so they can be retried.
+            cancelled = isinstance(exc, Cancelled) and not isinstance(exc, DeadlineExceeded)
+            item.status = ItemStatus.CANCELLED if cancelled else ItemStatus.FAILED
+            item.error = str(exc)
+            item.finished_at = time.monotonic()
+        self._notify(item)
+
+    def _complete(
+        self,
+        item: BatchItem,
+        token: CancelToken,
+        result: PanelResult,
+        output_path: Optional[Path],
+        pack_entry: Optional[PackEntry] = None,
+    ) -> None:
+        with self._lock:
+            if item.status != ItemStatus.RUNNING or token is not item._token:
+                # Cancelled while the request was in flight, or a stale
+                # attempt's write; drop the result.
+                return
+            item.status = ItemStatus.DONE
+            item.result = result
+            item.output_path = output_path
+            item.pack_entry = pack_entry
+            item.finished_at = time.monotonic()
+        self._notify(item)
+
+    def _release_pack(self, pack: ChapterPack) -> None:
+        with self._lock:
+            self._pack_users[pack] -= 1
+            idle = not self._pack_users[pack] and pack is not self.pack
+            if idle:
+                del self._pack_users[pack]
+        if idle:
+            pack.close()
+
+    def _notify(self, item: BatchItem) -> None:
+        if self.on_update is None:
+            return
+        try:
+            self.on_update(item)
+        except Exception:
+            # UI callbacks must never take down a worker thread.
+            pass
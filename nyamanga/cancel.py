@@ -0,0 +1,105 @@
+"""
+Cancellation tokens with optional deadlines.
+A token is handed down from the UI/batch layer through the pipeline into
+`NyaMangaClient`, which derives per-request timeouts from the time left and
+stops waiting on in-flight HTTP as soon as the token fires.
+"""
+import threading
+import time
+from typing import Callable, List, Optional
+
+
+class Cancelled(RuntimeError):
+    """Raised when work is abandoned because its token was cancelled."""
+
+
+class DeadlineExceeded(Cancelled):
+    """Raised when a job runs past the deadline attached to its token."""
+
+
+class CancelToken:
+    """
+    Thread-safe cancellation flag with an optional monotonic deadline.
+    `wait` returns early when the token is cancelled, so blocking calls can
+    poll it instead of sleeping blindly.
+    """
+
+    def __init__(self, deadline: Optional[float] = None):
+        self.deadline = deadline
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+
+    @classmethod
+    def with_timeout(cls, seconds: Optional[float]) -> "CancelToken":
+        """Token that expires `seconds` from now (no deadline if None)."""
+        if seconds is None:
+            return cls()
+        return cls(deadline=time.monotonic() + seconds)
+
+    def cancel(self) -> None:
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    @property
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def remaining(self) -> Optional[float]:
+        """Seconds until the deadline (never negative), or None without one."""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def timeout_for(self, default: float) -> float:
+        """Request timeout capped by the time left before the deadline."""
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        return min(default, remaining)
+
+    def raise_if_cancelled(self) -> None:
+        if self._event.is_set():
+            raise Cancelled("Job was cancelled")
+        if self.expired:
+            raise DeadlineExceeded("Job deadline exceeded")
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until cancelled, the deadline passes or `timeout` elapses."""
+        remaining = self.remaining()
+        if remaining is not None:
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        return self._event.wait(timeout)
+
+    def add_callback(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """
+        Run `callback` once on cancellation (immediately if already cancelled).
+        Returns a function that unregisters it.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                registered = True
+            else:
+                registered = False
+        if not registered:
+            callback()
+
+        def remove() -> None:
+            with self._lock:
+                if callback in self._callbacks:
+                    self._callbacks.remove(callback)
+
+        return remove
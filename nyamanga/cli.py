@@ -1,16 +1,170 @@
 import argparse
-import base64
+import dataclasses
+import json
+import os
 from pathlib import Path
 import sys
+from typing import Any, Dict, Iterator, Optional
 
+from .batch import language_output_path
+from .cancel import CancelToken
 from .config import ApiConfig
-from .pipeline import TypesettingPipeline
+from .imaging import OUTPUT_FORMATS, OutputOptions
+from .pack import ChapterPack
+from .pipeline import AUTO_MODES, TypesettingPipeline
+from .planner import Planner
+from .server import serve as serve_jobs
+from .tracing import Tracer
+from .triage import TRIAGE_MODES
+from .worker import JsonLinesWorker
+from .workqueue import QueueWorker, WorkQueue
 
 
-def _decode_to_file(image_b64: str, output: Path) -> Path:
-    output.parent.mkdir(parents=True, exist_ok=True)
-    output.write_bytes(base64.b64decode(image_b64))
-    return output
+def _decode_to_file(
+    pipeline: TypesettingPipeline,
+    image_b64: str,
+    output: Path,
+    options: Optional[OutputOptions] = None,
+) -> Path:
+    return pipeline.images.write(image_b64, output, options).result()
+
+
+def _output_options(args: argparse.Namespace) -> OutputOptions:
+    return OutputOptions(
+        format=args.format,
+        quality=args.quality,
+        compress_level=args.compress_level,
+        max_dimension=args.max_dimension,
+    )
+
+
+def _batch_jobs(args: argparse.Namespace) -> Iterator[Dict[str, Any]]:
+    """Jobs for `queue enqueue`/`plan`, with paths made absolute for other machines' workers."""
+    if args.jobs is not None:
+        source = sys.stdin if str(args.jobs) == "-" else args.jobs.open(encoding="utf-8")
+        try:
+            for line in source:
+                if line.strip():
+                    job = json.loads(line)
+                    if not isinstance(job, dict):
+                        raise ValueError("Each job must be a JSON object")
+                    for key in ("image", "mask", "output"):
+                        if job.get(key):
+                            job[key] = str(Path(job[key]).resolve())
+                    yield job
+        finally:
+            if source is not sys.stdin:
+                source.close()
+    for image in args.images:
+        job: Dict[str, Any] = {
+            "image": str(image.resolve()),
+            "target_language": args.target_language,
+            "tone": args.tone,
+        }
+        if args.text:
+            job["text"] = args.text
+        if args.output_dir is not None:
+            job["output"] = str((args.output_dir / f"{image.stem}_localized.png").resolve())
+        yield job
+
+
+def _plan_command(args: argparse.Namespace, config: ApiConfig, workers: int) -> int:
+    with TypesettingPipeline(config) as pipeline:
+        plan = Planner(pipeline, workers=workers, output_dir=args.output_dir).plan(
+            _batch_jobs(args)
+        )
+    if args.json:
+        print(json.dumps(plan.to_dict(), ensure_ascii=False, indent=2))
+    else:
+        print(plan.summary())
+    return 1 if any(page.error for page in plan.pages) else 0
+
+
+def _pack_command(args: argparse.Namespace) -> int:
+    with ChapterPack(args.pack, readonly=True) as pack:
+        if args.pack_command == "list":
+            entries = pack.entries(args.language)
+            if args.json:
+                print(
+                    json.dumps(
+                        [dataclasses.asdict(entry) for entry in entries],
+                        ensure_ascii=False,
+                        indent=2,
+                    )
+                )
+                return 0
+            for entry in entries:
+                print(
+                    f"{entry.page:<24} {entry.language or '-':<4} {entry.length:>10} B  "
+                    f"{entry.format or '?':<5} {entry.name}"
+                )
+            print(f"{len(entries)} page(s) in {pack.path}", file=sys.stderr)
+            return 0
+
+        if args.pack_command == "export":
+            if args.cbz is not None:
+                print(f"Wrote {pack.export_cbz(args.cbz, args.language)}")
+            else:
+                written = pack.export_files(args.to, args.language)
+                print(f"Wrote {len(written)} file(s) to {args.to}")
+            return 0
+    return 1
+
+
+def _queue_command(
+    args: argparse.Namespace, config: ApiConfig, tracer: Optional[Tracer] = None
+) -> int:
+    if args.queue_command == "enqueue" and args.dry_run:
+        return _plan_command(args, config, workers=4)
+
+    queue = WorkQueue(args.db, lease_seconds=getattr(args, "lease", 120.0))
+    if args.queue_command == "enqueue":
+        ids = queue.enqueue(_batch_jobs(args), max_attempts=args.max_attempts)
+        print(f"Queued {len(ids)} job(s) in {args.db}")
+        return 0
+
+    if args.queue_command == "status":
+        counts = queue.counts()
+        jobs = queue.jobs(status="failed" if args.failed else None, limit=args.limit)
+        if args.json:
+            print(
+                json.dumps(
+                    {"counts": counts, "jobs": [job.to_dict() for job in jobs]},
+                    ensure_ascii=False,
+                    indent=2,
+                )
+            )
+            return 0
+        print("  ".join(f"{status}: {n}" for status, n in counts.items()))
+        for job in jobs:
+            detail = job.error or job.lease_owner or ""
+            print(
+                f"#{job.id:<6} {job.status:<8} attempts {job.attempts}/{job.max_attempts}  "
+                f"{job.payload.get('image') or job.payload.get('text', '')}  {detail}".rstrip()
+            )
+        return 0
+
+    if args.queue_command == "requeue":
+        count = queue.requeue(ids=args.ids or None)
+        print(f"Requeued {count} job(s)")
+        return 0
+
+    if args.queue_command == "work":
+        with TypesettingPipeline(config, tracer=tracer) as pipeline:
+            runner = JsonLinesWorker(
+                pipeline,
+                workers=args.workers,
+                output_dir=args.output_dir,
+                output_options=_output_options(args),
+                default_deadline=args.deadline,
+                pack=ChapterPack(args.pack) if args.pack is not None else None,
+            )
+            worker = QueueWorker(queue, runner, poll_interval=args.poll_interval)
+            failures = worker.run(exit_when_empty=args.exit_when_empty)
+        print(f"Processed {worker.processed} job(s), {failures} failed attempt(s)", file=sys.stderr)
+        return 1 if failures else 0
+
+    return 1
 
 
 def main(argv: list[str] | None = None) -> int:
@@ -46,8 +200,17 @@ def main(argv: list[str] | None = None) -> int:
         "localize", help="Rewrite text and embed it into an image in one call."
     )
     localize.add_argument("image", type=Path, help="Path to the panel image.")
-    localize.add_argument("text", help="Source dialogue to rewrite.")
-    localize.add_argument("--target-language", default="zh", help="Target language.")
+    localize.add_argument(
+        "text",
+        nargs="?",
+        default=None,
+        help="Source dialogue to rewrite; omit it to let auto mode read the page.",
+    )
+    localize.add_argument(
+        "--target-language",
+        default="zh",
+        help="Target language, or a comma-separated list (e.g. zh,en,ko) to fan out.",
+    )
     localize.add_argument("--tone", default="friendly manga voice", help="Tone hint.")
     localize.add_argument(
         "--bubble-hint",
@@ -62,19 +225,284 @@ def main(argv: list[str] | None = None) -> int:
         help="Where to save the edited image.",
     )
 
+    serve = subparsers.add_parser(
+        "serve", help="Run a local job server shared by several translators."
+    )
+    serve.add_argument("--host", default="127.0.0.1", help="Interface to bind.")
+    serve.add_argument("--port", type=int, default=8765, help="Port to listen on.")
+    serve.add_argument(
+        "--workers", type=int, default=4, help="Jobs processed concurrently."
+    )
+    serve.add_argument(
+        "--image-workers",
+        type=int,
+        default=None,
+        help="Processes for image decode/resize/write (default: NYAMANGA_IMAGE_WORKERS or 0).",
+    )
+    serve.add_argument(
+        "--cache-size",
+        type=int,
+        default=256,
+        help="Finished results kept for identical resubmissions (0 disables).",
+    )
+    serve.add_argument(
+        "--upload-root",
+        type=Path,
+        default=None,
+        help="Let jobs send image_path/mask_path inside this directory "
+        "(default: only image_b64/mask_b64 are accepted).",
+    )
+
+    worker = subparsers.add_parser(
+        "worker",
+        help="Read JSON-lines jobs from stdin and stream JSON-lines results to stdout.",
+    )
+    worker.add_argument(
+        "--workers", type=int, default=4, help="Jobs processed concurrently."
+    )
+    worker.add_argument(
+        "--output-dir",
+        type=Path,
+        default=None,
+        help="Where jobs without an explicit output are written (default: next to the image).",
+    )
+
+    plan = subparsers.add_parser(
+        "plan",
+        help="Dry run: estimate requests, upload size and time for a batch without calling the API.",
+    )
+    plan.add_argument("--workers", type=int, default=4, help="Workers the real run would use.")
+    plan.add_argument("--json", action="store_true", help="Print the full plan as JSON.")
+
+    queue = subparsers.add_parser(
+        "queue",
+        help="Durable job queue shared by worker processes on one or more machines.",
+    )
+    queue.add_argument(
+        "--db",
+        type=Path,
+        default=Path(os.environ.get("NYAMANGA_QUEUE_DB", "nyamanga-queue.db")),
+        help="Queue database, on a filesystem every worker can reach "
+        "(default: NYAMANGA_QUEUE_DB or ./nyamanga-queue.db).",
+    )
+    queue_commands = queue.add_subparsers(dest="queue_command", required=True)
+    enqueue = queue_commands.add_parser("enqueue", help="Add localize jobs to the queue.")
+    for sub in (enqueue, plan):
+        sub.add_argument("images", type=Path, nargs="*", help="Pages to localize.")
+        sub.add_argument(
+            "--jobs",
+            type=Path,
+            default=None,
+            help="JSON-lines file of `nyamanga worker` job objects ('-' for stdin).",
+        )
+        sub.add_argument("--text", default=None, help="Source dialogue (omit for auto mode).")
+        sub.add_argument(
+            "--target-language", default="zh", help="Target language or comma-separated list."
+        )
+        sub.add_argument("--tone", default="friendly manga voice", help="Tone hint.")
+        sub.add_argument(
+            "--output-dir", type=Path, default=None, help="Where the pages are written."
+        )
+    enqueue.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Print the plan (as `nyamanga plan`) instead of queueing anything.",
+    )
+    enqueue.add_argument("--json", action="store_true", help="With --dry-run, print JSON.")
+    enqueue.add_argument(
+        "--max-attempts",
+        type=int,
+        default=3,
+        help="Runs (including lease expiries) before a job is marked failed.",
+    )
+    queue_status = queue_commands.add_parser("status", help="Show queue counts and jobs.")
+    queue_status.add_argument("--failed", action="store_true", help="List failed jobs only.")
+    queue_status.add_argument("--limit", type=int, default=50, help="Jobs to list.")
+    queue_status.add_argument("--json", action="store_true", help="Print JSON.")
+    requeue = queue_commands.add_parser(
+        "requeue", help="Put jobs back in the queue (default: every failed job)."
+    )
+    requeue.add_argument("ids", type=int, nargs="*", help="Job ids to requeue.")
+    queue_work = queue_commands.add_parser("work", help="Process queued jobs until stopped.")
+    queue_work.add_argument(
+        "--workers", type=int, default=4, help="Jobs processed concurrently by this process."
+    )
+    queue_work.add_argument(
+        "--output-dir",
+        type=Path,
+        default=None,
+        help="Where jobs without an explicit output are written (default: next to the image).",
+    )
+    queue_work.add_argument(
+        "--lease",
+        type=float,
+        default=120.0,
+        help="Seconds a claimed job stays leased without a heartbeat before "
+        "another worker may take it.",
+    )
+    queue_work.add_argument(
+        "--poll-interval", type=float, default=2.0, help="Seconds between polls when idle."
+    )
+    queue_work.add_argument(
+        "--exit-when-empty",
+        action="store_true",
+        help="Stop once nothing is queued or running instead of waiting for new jobs.",
+    )
+
+    pack = subparsers.add_parser(
+        "pack", help="Inspect or export a packed chapter written with --pack."
+    )
+    pack.add_argument("pack", type=Path, help="The chapter's .nyapack directory.")
+    pack_commands = pack.add_subparsers(dest="pack_command", required=True)
+    pack_list = pack_commands.add_parser("list", help="List the pages in the pack.")
+    pack_list.add_argument("--json", action="store_true", help="Print the index as JSON.")
+    pack_export = pack_commands.add_parser("export", help="Write the pages out again.")
+    target = pack_export.add_mutually_exclusive_group(required=True)
+    target.add_argument("--to", type=Path, help="Directory for loose image files.")
+    target.add_argument("--cbz", type=Path, help="Comic archive to write (one language).")
+    for sub in (pack_list, pack_export):
+        sub.add_argument("--language", default=None, help="Only pages in this language.")
+
+    for sub in (worker, queue_work):
+        sub.add_argument(
+            "--pack",
+            type=Path,
+            default=None,
+            help="Append outputs to this chapter pack (e.g. ch01.nyapack) instead of "
+            "writing loose files; read it back with `nyamanga pack`.",
+        )
+
+    for sub in (embed, localize, worker, queue_work):
+        sub.add_argument(
+            "--format",
+            choices=OUTPUT_FORMATS,
+            default=None,
+            help="Re-encode the output (default: keep the API's format).",
+        )
+        sub.add_argument(
+            "--quality", type=int, default=90, help="Lossy quality for webp/jpeg/avif."
+        )
+        sub.add_argument(
+            "--compress-level",
+            type=int,
+            default=6,
+            help="Compression effort 0-9 (PNG level, WebP method, AVIF speed).",
+        )
+        sub.add_argument(
+            "--max-dimension",
+            type=int,
+            default=None,
+            help="Downscale outputs so the longest side fits this many pixels.",
+        )
+
+    for sub in (localize, worker, serve, queue_work, plan):
+        sub.add_argument(
+            "--triage",
+            choices=TRIAGE_MODES,
+            default=None,
+            help="Check auto-mode pages locally first: 'skip' passes textless pages "
+            "through, 'panels' also sends only the panels that contain text.",
+        )
+        sub.add_argument(
+            "--auto-mode",
+            choices=AUTO_MODES,
+            default=None,
+            help="How pages without --text are localized: 'single' edit call, or "
+            "'phased' (extract text, translate through a cache, then typeset).",
+        )
+
+    for sub in (localize, worker, serve, queue_work):
+        sub.add_argument(
+            "--verify",
+            action="store_true",
+            help="Check each edit locally (size, art outside the text, missed balloons), "
+            "repair failing regions and flag pages that still fail.",
+        )
+
+    for sub in (rewrite, embed, localize, worker, queue_work):
+        sub.add_argument(
+            "--deadline",
+            type=float,
+            default=None,
+            help="Give up after this many seconds (covers every request of the job).",
+        )
+
+    for sub in (rewrite, embed, localize, worker, queue_work):
+        sub.add_argument(
+            "--trace",
+            type=Path,
+            default=None,
+            help="Write a Chrome/Perfetto timeline of the run to this JSON file.",
+        )
+
     args = parser.parse_args(argv)
     if not args.command:
         parser.print_help()
         return 1
 
-    config = ApiConfig.from_env()
+    tracer = Tracer() if getattr(args, "trace", None) else None
+    try:
+        return _run(args, tracer)
+    finally:
+        if tracer is not None:
+            print(f"Trace written to {tracer.export(args.trace)}", file=sys.stderr)
 
-    with TypesettingPipeline(config) as pipeline:
+
+def _run(args: argparse.Namespace, tracer: Optional[Tracer]) -> int:
+    if args.command == "pack":
+        # Reading a pack needs no API access.
+        return _pack_command(args)
+    # Planning and queue bookkeeping never call the API, so they work without a key.
+    offline = args.command == "plan" or (
+        args.command == "queue" and args.queue_command != "work"
+    )
+    config = ApiConfig.from_env(require_key=not offline)
+    if getattr(args, "triage", None):
+        config = dataclasses.replace(config, triage=args.triage)
+    if getattr(args, "auto_mode", None):
+        config = dataclasses.replace(config, auto_mode=args.auto_mode)
+    if getattr(args, "verify", False):
+        config = dataclasses.replace(config, verify=True)
+    if args.command == "serve":
+        if args.image_workers is not None:
+            config = dataclasses.replace(config, image_workers=args.image_workers)
+        serve_jobs(
+            config,
+            host=args.host,
+            port=args.port,
+            workers=args.workers,
+            cache_size=args.cache_size,
+            upload_root=args.upload_root,
+        )
+        return 0
+
+    if args.command == "plan":
+        return _plan_command(args, config, workers=args.workers)
+
+    if args.command == "queue":
+        return _queue_command(args, config, tracer)
+
+    if args.command == "worker":
+        with TypesettingPipeline(config, tracer=tracer) as pipeline:
+            failures = JsonLinesWorker(
+                pipeline,
+                workers=args.workers,
+                output_dir=args.output_dir,
+                output_options=_output_options(args),
+                default_deadline=args.deadline,
+                pack=ChapterPack(args.pack) if args.pack is not None else None,
+            ).run(sys.stdin, sys.stdout)
+        return 1 if failures else 0
+
+    cancel = CancelToken.with_timeout(args.deadline)
+
+    with TypesettingPipeline(config, tracer=tracer) as pipeline:
         if args.command == "rewrite":
             result = pipeline.embedder.rewrite_dialogue(
                 source_text=args.text,
                 target_language=args.target_language,
                 tone=args.tone,
+                cancel=cancel,
             )
             print(result.text)
             return 0
@@ -85,23 +513,66 @@ def main(argv: list[str] | None = None) -> int:
                 text=args.text,
                 bubble_hint=args.bubble_hint,
                 mask_path=args.mask,
+                cancel=cancel,
+            )
+            output = _decode_to_file(
+                pipeline, result.image_b64, args.output, _output_options(args)
             )
-            _decode_to_file(result.image_b64, args.output)
-            print(f"Edited image saved to {args.output}")
+            print(f"Edited image saved to {output}")
             return 0
 
         if args.command == "localize":
+            languages = [lang.strip() for lang in args.target_language.split(",") if lang.strip()]
+            if len(languages) > 1:
+                results = pipeline.localize_panel_multi(
+                    image_path=args.image,
+                    target_languages=languages,
+                    source_text=args.text,
+                    tone=args.tone,
+                    bubble_hint=args.bubble_hint,
+                    mask_path=args.mask,
+                    cancel=cancel,
+                )
+                options = _output_options(args)
+                writes = {
+                    lang: pipeline.save_result(
+                        combined, language_output_path(args.output, lang), options
+                    )
+                    for lang, combined in results.items()
+                }
+                for lang, combined in results.items():
+                    output = writes[lang].result()
+                    print(f"[{lang}] Rewritten text: {combined.rewritten_text}")
+                    print(f"[{lang}] Edited image saved to {output}")
+                    if combined.flagged:
+                        print(
+                            f"[{lang}] Warning: the edit still fails the local check",
+                            file=sys.stderr,
+                        )
+                return 0
+
             combined = pipeline.localize_panel(
                 image_path=args.image,
                 source_text=args.text,
-                target_language=args.target_language,
+                target_language=languages[0] if languages else "zh",
                 tone=args.tone,
                 bubble_hint=args.bubble_hint,
                 mask_path=args.mask,
+                cancel=cancel,
+            )
+            output = _decode_to_file(
+                pipeline, combined.edited_image_b64, args.output, _output_options(args)
             )
-            _decode_to_file(combined.edited_image_b64, args.output)
+            if combined.skipped:
+                print("No text found on the page; it was passed through unchanged.")
+            if combined.flagged:
+                print(
+                    "Warning: the edit still fails the local check "
+                    f"({json.dumps(combined.verification)}); please review it.",
+                    file=sys.stderr,
+                )
             print(f"Rewritten text: {combined.rewritten_text}")
-            print(f"Edited image saved to {args.output}")
+            print(f"Edited image saved to {output}")
             return 0
 
     return 1
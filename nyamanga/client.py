@@ -1,38 +1,172 @@
+from dataclasses import dataclass
 from pathlib import Path
 from typing import Any, Dict, Iterable, List, Optional, Union
 import json
+import socket
+import threading
+import time
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 
+from .cancel import CancelToken, Cancelled, DeadlineExceeded
 from .config import ApiConfig
+from .ratelimit import RateLimiter
+from .resilience import EndpointGuard
+from .tracing import Tracer
 
 
 class ApiError(RuntimeError):
     """Raised when the remote API replies with a non-2xx status."""
 
 
+@dataclass(frozen=True)
+class UploadFile:
+    """In-memory upload so one prepared image can be sent many times."""
+
+    name: str
+    data: bytes
+
+    @classmethod
+    def from_path(cls, path: Union[str, Path]) -> "UploadFile":
+        path = Path(path)
+        return cls(name=path.name, data=path.read_bytes())
+
+
+ImageSource = Union[str, Path, UploadFile]
+
+
+def _as_upload(source: ImageSource) -> UploadFile:
+    if isinstance(source, UploadFile):
+        return source
+    return UploadFile.from_path(source)
+
+
+# The abort handle of the request running on this thread, if any.
+_in_flight = threading.local()
+
+
+class _RequestHandle:
+    """Connections one request has checked out, so another thread can cut them."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._conns: set = set()
+        self.aborted = False
+
+    def checked_out(self, conn: Any) -> bool:
+        with self._lock:
+            if self.aborted:
+                return False
+            self._conns.add(conn)
+            return True
+
+    def returned(self, conn: Any) -> None:
+        with self._lock:
+            self._conns.discard(conn)
+
+    def abort(self) -> None:
+        """Shut down the request's sockets; its thread fails instead of finishing it."""
+        with self._lock:
+            self.aborted = True
+            for conn in self._conns:
+                sock = getattr(conn, "sock", None)
+                if sock is not None:
+                    try:
+                        sock.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass  # already closed
+
+
+class _AbortablePool:
+    """Pool mixin recording which connections the current thread's request holds."""
+
+    def _get_conn(self, timeout: Optional[float] = None) -> Any:
+        conn = super()._get_conn(timeout)  # type: ignore[misc]
+        handle = getattr(_in_flight, "handle", None)
+        if handle is not None:
+            if not handle.checked_out(conn):
+                # urlopen hands the slot back to the pool when this raises.
+                conn.close()
+                raise Cancelled("Job was cancelled")
+            conn._nyamanga_handle = handle
+        return conn
+
+    def _put_conn(self, conn: Any) -> None:
+        handle = getattr(conn, "_nyamanga_handle", None)
+        if handle is not None:
+            handle.returned(conn)
+            conn._nyamanga_handle = None
+        super()._put_conn(conn)  # type: ignore[misc]
+
+
+class _AbortableHTTPPool(_AbortablePool, HTTPConnectionPool):
+    pass
+
+
+class _AbortableHTTPSPool(_AbortablePool, HTTPSConnectionPool):
+    pass
+
+
+class _AbortableAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _AbortableHTTPPool,
+            "https": _AbortableHTTPSPool,
+        }
+
+
 class NyaMangaClient:
     """
     Thin wrapper around the ephone.chat-compatible API.
     Keeps surface area small so UI layers can wrap or replace pieces easily.
     """
 
-    def __init__(self, config: ApiConfig):
+    def __init__(
+        self,
+        config: ApiConfig,
+        rate_limiter: Optional[RateLimiter] = None,
+        tracer: Optional[Tracer] = None,
+    ):
         self.config = config
+        self.tracer = tracer or Tracer(enabled=False)
+        if rate_limiter is None and config.requests_per_minute:
+            rate_limiter = RateLimiter(config.requests_per_minute)
+        self.rate_limiter = rate_limiter
         self._session = requests.Session()
+        adapter = _AbortableAdapter()
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
         self._session.headers.update({"Authorization": f"Bearer {config.api_key}"})
+        self.endpoints: Dict[str, EndpointGuard] = {
+            name: EndpointGuard(
+                name,
+                failure_threshold=config.breaker_threshold,
+                reset_after=config.breaker_reset,
+                adaptive=config.adaptive_timeouts,
+            )
+            for name in ("chat/completions", "images/edits", "images/generations")
+        }
 
     def chat_completion(
         self,
-        messages: List[Dict[str, str]],
+        messages: List[Dict[str, Any]],
         model: Optional[str] = None,
         temperature: Optional[float] = None,
         top_p: Optional[float] = None,
         stream: bool = False,
+        cancel: Optional[CancelToken] = None,
         **extra: Any,
     ) -> Dict[str, Any]:
-        """Call /chat/completions for dialogue rewrite or translation."""
-        url = f"{self.config.base_url.rstrip('/')}/chat/completions"
+        """
+        Call /chat/completions for dialogue rewrite or translation. Replies
+        are always read whole; `stream=True` is rejected.
+        """
+        if stream:
+            raise ValueError("Streaming chat replies are not supported; call with stream=False")
+        endpoint = "chat/completions"
         payload: Dict[str, Any] = {
             "model": model or self.config.chat_model,
             "messages": messages,
@@ -44,28 +178,30 @@ class NyaMangaClient:
             payload["top_p"] = top_p
         payload.update(extra)
 
-        resp = self._session.post(
-            url,
-            json=payload,
-            timeout=self.config.request_timeout,
-            stream=stream,
-        )
+        resp = self._post(endpoint, cancel, json=payload)
         return self._handle_response(resp)
 
     def edit_image(
         self,
-        image_path: Union[str, Path],
+        image_path: ImageSource,
         prompt: str,
-        mask_path: Optional[Union[str, Path]] = None,
+        mask_path: Optional[ImageSource] = None,
         model: Optional[str] = None,
         response_format: str = "b64_json",
+        cancel: Optional[CancelToken] = None,
         **extra: Any,
     ) -> Dict[str, Any]:
-        """Call /images/edits with a single image and optional mask."""
-        url = f"{self.config.base_url.rstrip('/')}/images/edits"
-        files = {"image": open(Path(image_path), "rb")}
+        """
+        Call /images/edits with a single image and optional mask.
+        Paths are read up front; pass `UploadFile`s to reuse prepared bytes.
+        """
+        endpoint = "images/edits"
+        # Read uploads up front so an abandoned request never races file handles.
+        image = _as_upload(image_path)
+        files = {"image": (image.name, image.data)}
         if mask_path:
-            files["mask"] = open(Path(mask_path), "rb")
+            mask = _as_upload(mask_path)
+            files["mask"] = (mask.name, mask.data)
 
         data: Dict[str, Any] = {
             "prompt": prompt,
@@ -74,17 +210,7 @@ class NyaMangaClient:
         }
         data.update(extra)
 
-        try:
-            resp = self._session.post(
-                url,
-                files=files,
-                data=data,
-                timeout=self.config.request_timeout,
-            )
-        finally:
-            for file in files.values():
-                file.close()
-
+        resp = self._post(endpoint, cancel, files=files, data=data)
         return self._handle_response(resp)
 
     def generate_image(
@@ -92,10 +218,11 @@ class NyaMangaClient:
         prompt: str,
         model: Optional[str] = None,
         response_format: str = "b64_json",
+        cancel: Optional[CancelToken] = None,
         **extra: Any,
     ) -> Dict[str, Any]:
         """Call /images/generations for pure synthesis."""
-        url = f"{self.config.base_url.rstrip('/')}/images/generations"
+        endpoint = "images/generations"
         payload: Dict[str, Any] = {
             "prompt": prompt,
             "model": model or self.config.image_model,
@@ -103,11 +230,13 @@ class NyaMangaClient:
         }
         payload.update(extra)
 
-        resp = self._session.post(
-            url, json=payload, timeout=self.config.request_timeout
-        )
+        resp = self._post(endpoint, cancel, json=payload)
         return self._handle_response(resp)
 
+    def endpoint_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Circuit state and observed p95 latency per endpoint."""
+        return {name: guard.stats() for name, guard in self.endpoints.items()}
+
     def close(self) -> None:
         self._session.close()
 
@@ -117,13 +246,132 @@ class NyaMangaClient:
     def __exit__(self, exc_type, exc, tb) -> None:
         self.close()
 
+    def _post(
+        self, endpoint: str, cancel: Optional[CancelToken], **kwargs: Any
+    ) -> requests.Response:
+        """
+        POST to `endpoint` through its circuit breaker, with a timeout learned
+        from the endpoint's recent latency (at most `request_timeout`).
+        Network errors, timeouts and 5xx/429 replies count as failures.
+        """
+        guard = self.endpoints[endpoint]
+        if self.rate_limiter is not None:
+            with self.tracer.span("rate_limit", "client", endpoint=endpoint):
+                self.rate_limiter.acquire(cancel)
+        probe = guard.breaker.before_call(endpoint)
+        timeout = guard.timeout(self.config.request_timeout)
+        url = f"{self.config.base_url.rstrip('/')}/{endpoint}"
+        with self.tracer.span("request", "client", endpoint=endpoint, timeout_s=timeout) as trace:
+            started = time.monotonic()
+            try:
+                resp = self._send(url, timeout, cancel, **kwargs)
+            except requests.RequestException as exc:
+                if isinstance(exc, requests.Timeout):
+                    # Let a slowing endpoint raise its own timeout next time.
+                    guard.latency.record(timeout)
+                guard.breaker.record_failure(probe)
+                raise
+            except BaseException:
+                guard.breaker.release(probe)
+                raise
+            trace["status"] = resp.status_code
+        if resp.status_code >= 500 or resp.status_code == 429:
+            guard.breaker.record_failure(probe)
+        else:
+            guard.latency.record(time.monotonic() - started)
+            guard.breaker.record_success()
+        return resp
+
+    def _fetch(self, url: str, timeout: float, **kwargs: Any) -> requests.Response:
+        """
+        POST and read the whole body, traced as `send` (connect, upload and
+        waiting for the response headers) and `download` (reading the body).
+        """
+        with self.tracer.span("send", "client") as trace:
+            if self.tracer.enabled:
+                trace["bytes_up"] = _body_size(kwargs)
+            resp = self._session.post(url, timeout=timeout, stream=True, **kwargs)
+        with self.tracer.span("download", "client") as trace:
+            trace["bytes_down"] = len(resp.content)
+        return resp
+
+    def _send(
+        self, url: str, timeout: float, cancel: Optional[CancelToken], **kwargs: Any
+    ) -> requests.Response:
+        """
+        POST with `timeout` capped by the token's deadline.
+        With a token, the request runs on a helper thread so cancellation or
+        deadline expiry returns control (and the caller's worker slot)
+        immediately; the abandoned request's connection is shut down, so the
+        upload or download stops too.
+        """
+        if cancel is None:
+            return self._fetch(url, timeout, **kwargs)
+
+        cancel.raise_if_cancelled()
+        timeout = cancel.timeout_for(timeout)
+        done = threading.Event()
+        outcome: Dict[str, Any] = {}
+        lock = threading.Lock()
+        handle = _RequestHandle()
+
+        def send() -> None:
+            _in_flight.handle = handle
+            try:
+                resp = self._fetch(url, timeout, **kwargs)
+            except BaseException as exc:  # handed back to the waiting thread
+                outcome["error"] = exc
+            else:
+                with lock:
+                    if outcome.get("abandoned"):
+                        resp.close()
+                        return
+                    outcome["response"] = resp
+            finally:
+                _in_flight.handle = None
+                done.set()
+
+        threading.Thread(target=send, name="nyamanga-http", daemon=True).start()
+        unregister = cancel.add_callback(done.set)
+        try:
+            finished = done.wait(cancel.remaining())
+        finally:
+            unregister()
+
+        with lock:
+            if "response" in outcome:
+                return outcome["response"]
+            if "error" in outcome:
+                error = outcome["error"]
+                if isinstance(error, requests.Timeout) and cancel.expired:
+                    raise DeadlineExceeded("Job deadline exceeded") from error
+                raise error
+            outcome["abandoned"] = True
+        handle.abort()
+        if not finished or cancel.expired:
+            raise DeadlineExceeded("Job deadline exceeded")
+        raise Cancelled("Job was cancelled")
+
     def _handle_response(self, resp: requests.Response) -> Dict[str, Any]:
         if resp.status_code >= 300:
             raise ApiError(f"{resp.status_code}: {resp.text}")
         if not resp.content:
             return {}
         # Try JSON first, otherwise hand back text blob.
-        try:
-            return resp.json()
-        except json.JSONDecodeError:
-            return {"data": resp.content}
+        with self.tracer.span("parse", "client", bytes=len(resp.content)):
+            try:
+                return resp.json()
+            except json.JSONDecodeError:
+                return {"data": resp.content}
+
+
+def _body_size(kwargs: Dict[str, Any]) -> int:
+    """Approximate upload size of a request's json/data/files arguments."""
+    size = 0
+    if kwargs.get("json") is not None:
+        size += len(json.dumps(kwargs["json"]))
+    for value in (kwargs.get("data") or {}).values():
+        size += len(str(value))
+    for item in (kwargs.get("files") or {}).values():
+        size += len(item[1]) if isinstance(item, tuple) else 0
+    return size
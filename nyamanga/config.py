@@ -13,36 +13,94 @@ class ApiConfig:
     chat_model: str = "nano-banana-2"
     image_model: str = "nano-banana-2"
     request_timeout: float = 120.0
+    requests_per_minute: Optional[float] = None
+    image_workers: int = 0
+    max_upload_dimension: Optional[int] = None
+    max_concurrency: int = 8
+    budget_requests: Optional[int] = None
+    budget_tokens: Optional[int] = None
+    adaptive_timeouts: bool = True
+    breaker_threshold: int = 5
+    breaker_reset: float = 30.0
+    dedupe_threshold: Optional[int] = None
+    dedupe_dir: Optional[str] = None
+    triage: Optional[str] = None
+    history_path: Optional[str] = None
+    auto_mode: str = "single"
+    translation_cache: Optional[str] = None
+    verify: bool = False
+    verify_retries: int = 1
 
     @classmethod
-    def from_env(cls) -> "ApiConfig":
+    def from_env(cls, require_key: bool = True) -> "ApiConfig":
         """
-        Load configuration from environment variables.
+        Load configuration from environment variables. With
+        `require_key=False` a missing key is left empty (for commands such as
+        `nyamanga plan` that never call the API).
 
         Supported keys:
         - NYAMANGA_API_KEY or EPHONE_API_KEY (required)
         - NYAMANGA_BASE_URL (optional)
         - NYAMANGA_CHAT_MODEL (optional)
         - NYAMANGA_IMAGE_MODEL (optional)
-        - NYAMANGA_TIMEOUT (optional, seconds)
+        - NYAMANGA_TIMEOUT (optional, seconds; upper bound for adaptive timeouts)
+        - NYAMANGA_RPM (optional, max requests per minute)
+        - NYAMANGA_IMAGE_WORKERS (optional, processes for image work; 0 = in-process)
+        - NYAMANGA_MAX_UPLOAD_DIM (optional, downscale uploads to this many pixels)
+        - NYAMANGA_MAX_CONCURRENCY (optional, simultaneous API calls)
+        - NYAMANGA_BUDGET_REQUESTS / NYAMANGA_BUDGET_TOKENS (optional, global spend caps)
+        - NYAMANGA_ADAPTIVE_TIMEOUTS (optional, 0 to always use NYAMANGA_TIMEOUT)
+        - NYAMANGA_BREAKER_THRESHOLD / NYAMANGA_BREAKER_RESET (optional, consecutive
+          failures before an endpoint fails fast, and seconds before it is probed again)
+        - NYAMANGA_DEDUPE (optional, max hash distance for reusing near-duplicate results)
+        - NYAMANGA_DEDUPE_DIR (optional, persist the near-duplicate index here)
+        - NYAMANGA_TRIAGE (optional, "skip" textless pages or also split into "panels")
+        - NYAMANGA_HISTORY (optional, latency history file for `nyamanga plan`;
+          runs record their latencies there only when it is set)
+        - NYAMANGA_AUTO_MODE (optional, "single" edit call or "phased" extract/translate/typeset)
+        - NYAMANGA_TRANSLATION_CACHE (optional, JSON-lines file persisting phased translations)
+        - NYAMANGA_VERIFY (optional, 1 to check edits locally and repair failing regions)
+        - NYAMANGA_VERIFY_RETRIES (optional, repair rounds before a page is flagged; default 1)
         """
         api_key = (
             os.environ.get("NYAMANGA_API_KEY")
             or os.environ.get("EPHONE_API_KEY")
             or os.environ.get("OPENAI_API_KEY")
         )
-        if not api_key:
+        if not api_key and require_key:
             raise ValueError("Set NYAMANGA_API_KEY/EPHONE_API_KEY/OPENAI_API_KEY")
 
         base_url = os.environ.get("NYAMANGA_BASE_URL", DEFAULT_BASE_URL)
         chat_model = os.environ.get("NYAMANGA_CHAT_MODEL", "nano-banana-2")
         image_model = os.environ.get("NYAMANGA_IMAGE_MODEL", "gpt-image-1")
         timeout_raw: Optional[str] = os.environ.get("NYAMANGA_TIMEOUT")
-        timeout = float(timeout_raw) if timeout_raw else 30.0
+        timeout = float(timeout_raw) if timeout_raw else cls.request_timeout
+        rpm_raw: Optional[str] = os.environ.get("NYAMANGA_RPM")
+        max_dim_raw: Optional[str] = os.environ.get("NYAMANGA_MAX_UPLOAD_DIM")
+        budget_requests_raw: Optional[str] = os.environ.get("NYAMANGA_BUDGET_REQUESTS")
+        budget_tokens_raw: Optional[str] = os.environ.get("NYAMANGA_BUDGET_TOKENS")
+        dedupe_raw: Optional[str] = os.environ.get("NYAMANGA_DEDUPE")
         return cls(
-            api_key=api_key,
+            api_key=api_key or "",
             base_url=base_url,
             chat_model=chat_model,
             image_model=image_model,
             request_timeout=timeout,
+            requests_per_minute=float(rpm_raw) if rpm_raw else None,
+            image_workers=int(os.environ.get("NYAMANGA_IMAGE_WORKERS") or 0),
+            max_upload_dimension=int(max_dim_raw) if max_dim_raw else None,
+            max_concurrency=int(os.environ.get("NYAMANGA_MAX_CONCURRENCY") or 8),
+            budget_requests=int(budget_requests_raw) if budget_requests_raw else None,
+            budget_tokens=int(budget_tokens_raw) if budget_tokens_raw else None,
+            adaptive_timeouts=os.environ.get("NYAMANGA_ADAPTIVE_TIMEOUTS", "1") != "0",
+            breaker_threshold=int(os.environ.get("NYAMANGA_BREAKER_THRESHOLD") or 5),
+            breaker_reset=float(os.environ.get("NYAMANGA_BREAKER_RESET") or 30.0),
+            dedupe_threshold=int(dedupe_raw) if dedupe_raw else None,
+            dedupe_dir=os.environ.get("NYAMANGA_DEDUPE_DIR") or None,
+            triage=os.environ.get("NYAMANGA_TRIAGE") or None,
+            history_path=os.path.expanduser(os.environ.get("NYAMANGA_HISTORY") or "") or None,
+            auto_mode=os.environ.get("NYAMANGA_AUTO_MODE") or "single",
+            translation_cache=os.environ.get("NYAMANGA_TRANSLATION_CACHE") or None,
+            verify=os.environ.get("NYAMANGA_VERIFY", "0") not in ("", "0"),
+            verify_retries=int(os.environ.get("NYAMANGA_VERIFY_RETRIES") or 1),
         )
@@ -3,11 +3,18 @@ Higher-level helpers for manga typesetting flows.
 UI layers can call these functions directly or wrap them inside their own state.
 """
 import base64
-from dataclasses import dataclass
+from collections import deque
+from dataclasses import dataclass, field
+import json
 from pathlib import Path
-from typing import Dict, Optional
+import threading
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
 
-from .client import NyaMangaClient
+from .cancel import CancelToken
+from .client import ImageSource, NyaMangaClient, UploadFile
+from .imaging import OutputOptions, sniff_format, write_output
+from .tracing import Tracer
+from .translations import TranslationCache
 
 
 @dataclass
@@ -21,10 +28,31 @@ class EmbedResult:
     image_b64: str
     raw_response: Dict
 
-    def save(self, path: Path) -> Path:
-        data = base64.b64decode(self.image_b64)
-        path.write_bytes(data)
-        return path
+    def save(self, path: Path, options: Optional[OutputOptions] = None) -> Path:
+        """Write the image; returns the actual path (suffix follows the format)."""
+        return write_output(self.image_b64, path, options)
+
+
+@dataclass
+class TextLine:
+    text: str
+    # Free-form placement ("top-right balloon") and a 0-1000 scaled box.
+    position: str = ""
+    box: Optional[Tuple[int, int, int, int]] = None
+
+
+@dataclass
+class ExtractResult:
+    lines: List[TextLine]
+    raw_response: Dict
+
+
+@dataclass
+class TranslateResult:
+    # Language -> translations in the same order as the source lines.
+    texts: Dict[str, List[str]]
+    raw_responses: List[Dict] = field(default_factory=list)
+    cached: int = 0
 
 
 class MangaEmbedder:
@@ -33,11 +61,17 @@ class MangaEmbedder:
     def __init__(self, client: NyaMangaClient):
         self.client = client
 
+    @property
+    def tracer(self) -> Tracer:
+        tracer = getattr(self.client, "tracer", None)
+        return tracer if tracer is not None else _UNTRACED
+
     def rewrite_dialogue(
         self,
         source_text: str,
         target_language: str = "zh",
         tone: str = "friendly manga voice",
+        cancel: Optional[CancelToken] = None,
     ) -> DialogueRewriteResult:
         """Rewrite or translate dialogue via the chat endpoint."""
         system_prompt = (
@@ -49,44 +83,106 @@ class MangaEmbedder:
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": source_text},
         ]
-        resp = self.client.chat_completion(
-            messages,
-            temperature=0.7,
-            model=self.client.config.chat_model,
-        )
+        with self.tracer.span("rewrite", language=target_language):
+            resp = self.client.chat_completion(
+                messages,
+                temperature=0.7,
+                model=self.client.config.chat_model,
+                cancel=cancel,
+            )
         choice = _first_message_content(resp)
         return DialogueRewriteResult(text=choice, raw_response=resp)
 
+    def rewrite_dialogue_multi(
+        self,
+        source_text: str,
+        target_languages: Sequence[str],
+        tone: str = "friendly manga voice",
+        cancel: Optional[CancelToken] = None,
+    ) -> Dict[str, DialogueRewriteResult]:
+        """
+        Translate one line into several languages with a single chat call.
+        Languages missing from the model's JSON reply fall back to
+        `rewrite_dialogue` so every requested language gets a result.
+        """
+        languages = list(dict.fromkeys(target_languages))
+        if len(languages) == 1:
+            lang = languages[0]
+            return {lang: self.rewrite_dialogue(source_text, lang, tone, cancel=cancel)}
+
+        system_prompt = (
+            "You are a manga typesetting assistant. Translate or rewrite speech "
+            f"into each of these languages: {', '.join(languages)}. Keep natural pacing "
+            f"and concise bubbles. Tone: {tone}. Reply with a JSON object mapping each "
+            "language code to its plain-text translation and nothing else."
+        )
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": source_text},
+        ]
+        with self.tracer.span("rewrite", language=",".join(languages)):
+            resp = self.client.chat_completion(
+                messages,
+                temperature=0.7,
+                model=self.client.config.chat_model,
+                cancel=cancel,
+            )
+        parsed = _parse_json_object(_first_message_content(resp))
+        results: Dict[str, DialogueRewriteResult] = {}
+        for lang in languages:
+            text = parsed.get(lang)
+            if isinstance(text, str) and text.strip():
+                results[lang] = DialogueRewriteResult(text=text.strip(), raw_response=resp)
+            else:
+                results[lang] = self.rewrite_dialogue(source_text, lang, tone, cancel=cancel)
+        return results
+
+    def session(
+        self,
+        target_language: str = "zh",
+        tone: str = "friendly manga voice",
+        glossary: Optional[Dict[str, str]] = None,
+        speakers: Optional[Dict[str, str]] = None,
+        context_lines: int = 6,
+    ) -> "DialogueSession":
+        """Start a `DialogueSession` for rewriting a page or chapter line by line."""
+        return DialogueSession(self, target_language, tone, glossary, speakers, context_lines)
+
     def embed_text(
         self,
-        image_path: Path,
+        image_path: ImageSource,
         text: str,
         bubble_hint: Optional[str] = None,
-        mask_path: Optional[Path] = None,
+        mask_path: Optional[ImageSource] = None,
         style_hint: Optional[str] = None,
+        cancel: Optional[CancelToken] = None,
     ) -> EmbedResult:
         """Send an image edit request that places text into the given panel."""
-        prompt = self._build_prompt(
-            text,
-            bubble_hint,
-            style_hint or "clean manga typesetting, legible, keep art intact",
-        )
-        resp = self.client.edit_image(
-            image_path=image_path,
-            prompt=prompt,
-            mask_path=mask_path,
-            response_format="b64_json",
-        )
+        with self.tracer.span("prompt"):
+            prompt = self._build_prompt(
+                text,
+                bubble_hint,
+                style_hint or "clean manga typesetting, legible, keep art intact",
+            )
+        with self.tracer.span("edit", mode="embed"):
+            resp = self.client.edit_image(
+                image_path=image_path,
+                prompt=prompt,
+                mask_path=mask_path,
+                response_format="b64_json",
+                cancel=cancel,
+            )
         image_b64 = _first_b64_image(resp)
         return EmbedResult(image_b64=image_b64, raw_response=resp)
 
     def auto_localize(
         self,
-        image_path: Path,
+        image_path: ImageSource,
         target_language: str = "zh",
         bubble_hint: Optional[str] = None,
-        mask_path: Optional[Path] = None,
+        mask_path: Optional[ImageSource] = None,
         style_hint: Optional[str] = None,
+        cancel: Optional[CancelToken] = None,
     ) -> EmbedResult:
         """
         Ask the image model to read existing dialogue and replace it with a
@@ -102,14 +198,178 @@ class MangaEmbedder:
             "Preserve art, faces, and backgrounds; avoid redraw artifacts. "
             f"{style_hint or 'Clean, legible, balanced layout.'}"
         )
-        resp = self.client.edit_image(
+        with self.tracer.span("edit", mode="auto", language=target_language):
+            resp = self.client.edit_image(
+                image_path=image_path,
+                prompt=prompt,
+                mask_path=mask_path,
+                response_format="b64_json",
+                cancel=cancel,
+            )
+        image_b64 = _first_b64_image(resp)
+        return EmbedResult(image_b64=image_b64, raw_response=resp)
+
+    def extract_text(
+        self, image_path: ImageSource, cancel: Optional[CancelToken] = None
+    ) -> ExtractResult:
+        """Read the page's lettering (with rough positions) in one vision chat call."""
+        upload = image_path if isinstance(image_path, UploadFile) else UploadFile.from_path(image_path)
+        mime = f"image/{sniff_format(upload.data) or 'png'}"
+        data_url = f"data:{mime};base64,{base64.b64encode(upload.data).decode('ascii')}"
+        system_prompt = (
+            "You are a manga lettering assistant. Extract every speech balloon, caption "
+            "and narration box that contains text, in reading order. Reply with a JSON "
+            'array and nothing else; each item is {"text": original text, "position": '
+            'short placement such as "top-right balloon", "box": [left, top, right, '
+            "bottom] scaled to 0-1000}. Reply [] if there is no text."
+        )
+        messages: List[Dict[str, Any]] = [
+            {"role": "system", "content": system_prompt},
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": "Extract the text from this page."},
+                    {"type": "image_url", "image_url": {"url": data_url}},
+                ],
+            },
+        ]
+        with self.tracer.span("extract"):
+            resp = self.client.chat_completion(
+                messages,
+                temperature=0.0,
+                model=self.client.config.chat_model,
+                cancel=cancel,
+            )
+        lines = []
+        for item in _parse_json_array(_first_message_content(resp)):
+            if isinstance(item, str):
+                item = {"text": item}
+            if not isinstance(item, dict) or not str(item.get("text") or "").strip():
+                continue
+            box = item.get("box")
+            valid_box = (
+                isinstance(box, list)
+                and len(box) == 4
+                and all(isinstance(v, (int, float)) for v in box)
+            )
+            lines.append(
+                TextLine(
+                    text=str(item["text"]).strip(),
+                    position=str(item.get("position") or ""),
+                    box=tuple(int(v) for v in box) if valid_box else None,
+                )
+            )
+        return ExtractResult(lines=lines, raw_response=resp)
+
+    def translate_lines(
+        self,
+        lines: Sequence[str],
+        target_languages: Sequence[str],
+        tone: str = "friendly manga voice",
+        cache: Optional[TranslationCache] = None,
+        cancel: Optional[CancelToken] = None,
+    ) -> TranslateResult:
+        """
+        Translate a page's lines into every language with one chat call.
+        Lines found in `cache` are not sent; lines the model's reply leaves
+        out fall back to `rewrite_dialogue` one by one.
+        """
+        languages = list(dict.fromkeys(target_languages))
+        model = self.client.config.chat_model
+        texts: Dict[str, List[Optional[str]]] = {lang: [None] * len(lines) for lang in languages}
+        cached = 0
+        if cache is not None:
+            for lang in languages:
+                for i, line in enumerate(lines):
+                    texts[lang][i] = cache.get(line, lang, tone, model)
+                    cached += texts[lang][i] is not None
+        missing = list(
+            dict.fromkeys(
+                line for lang in languages for line, t in zip(lines, texts[lang]) if t is None
+            )
+        )
+        responses: List[Dict] = []
+        if missing:
+            missing_langs = [lang for lang in languages if None in texts[lang]]
+            system_prompt = (
+                "You are a manga typesetting assistant. Translate each line of the JSON "
+                f"array into each of these languages: {', '.join(missing_langs)}. Keep natural "
+                f"pacing and concise bubbles. Tone: {tone}. Reply with a JSON object whose "
+                "keys are the language codes and whose values are arrays of translations "
+                "in the same order, and nothing else."
+            )
+            messages = [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": json.dumps(missing, ensure_ascii=False)},
+            ]
+            with self.tracer.span("translate", lines=len(missing), languages=len(missing_langs)):
+                resp = self.client.chat_completion(
+                    messages,
+                    temperature=0.7,
+                    model=model,
+                    cancel=cancel,
+                )
+            responses.append(resp)
+            parsed = _parse_json_object(_first_message_content(resp))
+            for lang in missing_langs:
+                values = parsed.get(lang)
+                found: Dict[str, str] = {}
+                if isinstance(values, list) and len(values) == len(missing):
+                    found = {
+                        src: str(v).strip()
+                        for src, v in zip(missing, values)
+                        if isinstance(v, str) and v.strip()
+                    }
+                for i, line in enumerate(lines):
+                    if texts[lang][i] is not None:
+                        continue
+                    text = found.get(line)
+                    if text is None:
+                        fallback = self.rewrite_dialogue(line, lang, tone, cancel=cancel)
+                        responses.append(fallback.raw_response)
+                        text = found[line] = fallback.text
+                    texts[lang][i] = text
+                    if cache is not None:
+                        cache.put(line, lang, tone, model, text)
+        return TranslateResult(
+            texts={lang: [t or "" for t in values] for lang, values in texts.items()},
+            raw_responses=responses,
+            cached=cached,
+        )
+
+    def embed_lines(
+        self,
+        image_path: ImageSource,
+        lines: Sequence[TextLine],
+        translations: Sequence[str],
+        bubble_hint: Optional[str] = None,
+        mask_path: Optional[ImageSource] = None,
+        style_hint: Optional[str] = None,
+        cancel: Optional[CancelToken] = None,
+    ) -> EmbedResult:
+        """
+        Typeset already translated lines with `embed_text`, telling the model
+        which balloon each one replaces.
+        """
+        numbered = []
+        placements = []
+        for index, (line, text) in enumerate(zip(lines, translations), start=1):
+            numbered.append(f'[{index}] "{text}"')
+            where = line.position or "its balloon"
+            if line.box is not None:
+                where += " (box {}, {}, {}, {} of 1000)".format(*line.box)
+            placements.append(f"[{index}] replaces \"{line.text}\" at {where}")
+        hint = "; ".join(placements)
+        if bubble_hint:
+            hint = f"{bubble_hint}; {hint}"
+        return self.embed_text(
             image_path=image_path,
-            prompt=prompt,
+            text=" ".join(numbered),
+            bubble_hint=f"erase the original lettering and place each line: {hint}",
             mask_path=mask_path,
-            response_format="b64_json",
+            style_hint=style_hint,
+            cancel=cancel,
         )
-        image_b64 = _first_b64_image(resp)
-        return EmbedResult(image_b64=image_b64, raw_response=resp)
 
     def _build_prompt(self, text: str, bubble_hint: Optional[str], style_hint: str) -> str:
         placement = (
@@ -125,6 +385,202 @@ class MangaEmbedder:
         )
 
 
+class DialogueSession:
+    """
+    Rewrites a page's or chapter's dialogue with shared context.
+    The system message holds the fixed instructions, then one list of
+    characters and glossary terms in the order they were first seen. New
+    entries are only ever appended, so each call's system message starts with
+    the previous one byte for byte and providers can cache the prefix. Each user message
+    carries just the last `context_lines` exchanges and the new lines. Terms
+    the model reports (names, catchphrases) join the glossary. Safe to share
+    between threads; concurrent calls see the context as it was when they
+    started.
+    """
+
+    # Longest glossary/context text kept per entry, to keep calls compact.
+    _MAX_SNIPPET = 160
+
+    def __init__(
+        self,
+        embedder: MangaEmbedder,
+        target_language: str = "zh",
+        tone: str = "friendly manga voice",
+        glossary: Optional[Dict[str, str]] = None,
+        speakers: Optional[Dict[str, str]] = None,
+        context_lines: int = 6,
+        max_glossary: int = 200,
+    ):
+        self.embedder = embedder
+        self.target_language = target_language
+        self.tone = tone
+        self.glossary: Dict[str, str] = {}
+        # Speaker name -> short voice note ("" when unknown).
+        self.speakers: Dict[str, str] = {}
+        # Prompt lines for both, in the order they were added.
+        self._entries: List[str] = []
+        self.max_glossary = max_glossary
+        for name, note in (speakers or {}).items():
+            self._add_speaker(name, note)
+        for source, target in (glossary or {}).items():
+            self._add_term(source, target)
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self._history: Deque[Tuple[Optional[str], str, str]] = deque(maxlen=context_lines)
+        self._lock = threading.Lock()
+
+    def rewrite(
+        self,
+        source_text: str,
+        speaker: Optional[str] = None,
+        cancel: Optional[CancelToken] = None,
+    ) -> DialogueRewriteResult:
+        """Rewrite one line in context."""
+        return self.rewrite_lines([source_text], [speaker], cancel=cancel)[0]
+
+    def rewrite_lines(
+        self,
+        lines: Sequence[str],
+        speakers: Optional[Sequence[Optional[str]]] = None,
+        cancel: Optional[CancelToken] = None,
+    ) -> List[DialogueRewriteResult]:
+        """
+        Rewrite several lines (e.g. a page's balloons, in reading order) with
+        one chat call. Lines the reply leaves out fall back to
+        `rewrite_dialogue`.
+        """
+        if not lines:
+            return []
+        who = list(speakers) if speakers is not None else [None] * len(lines)
+        with self._lock:
+            for name in who:
+                if name and name not in self.speakers:
+                    self._add_speaker(name)
+            system_prompt = self.system_prompt()
+            context = list(self._history)
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": self._user_message(context, lines, who)},
+        ]
+        with self.embedder.tracer.span(
+            "rewrite", language=self.target_language, lines=len(lines), context=len(context)
+        ):
+            resp = self.embedder.client.chat_completion(
+                messages,
+                temperature=0.7,
+                model=self.embedder.client.config.chat_model,
+                cancel=cancel,
+            )
+        content = _first_message_content(resp)
+        parsed = _parse_json_object(content)
+        texts = parsed.get("lines")
+        if not isinstance(texts, list) and len(lines) == 1 and not parsed and content:
+            texts = [content]  # a plain-text answer to a single line
+        results = []
+        for index, line in enumerate(lines):
+            text = texts[index] if isinstance(texts, list) and index < len(texts) else None
+            if isinstance(text, str) and text.strip():
+                results.append(DialogueRewriteResult(text=text.strip(), raw_response=resp))
+            else:
+                results.append(
+                    self.embedder.rewrite_dialogue(line, self.target_language, self.tone, cancel)
+                )
+        self._remember(resp, parsed.get("terms"), lines, who, results)
+        return results
+
+    def system_prompt(self) -> str:
+        """The shared prefix: instructions, then characters and terms as added."""
+        parts = [
+            "You are a manga typesetting assistant translating a chapter into "
+            f"{self.target_language}, line by line. Keep natural pacing and concise "
+            "bubbles, and stay consistent with earlier lines, each character's voice and "
+            f"the glossary. Tone: {self.tone}. The user message lists recent lines for "
+            "context and then numbered lines to translate. Reply with a JSON object with "
+            '"lines" (the translations, in order) and "terms" (an object mapping new '
+            "names or recurring phrases in the source to the rendering you chose; may be "
+            "empty) and nothing else."
+        ]
+        if self._entries:
+            parts.append(
+                "Characters and glossary, in order of appearance:\n" + "\n".join(self._entries)
+            )
+        return "\n\n".join(parts)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "glossary": len(self.glossary),
+            "speakers": len(self.speakers),
+        }
+
+    def _user_message(
+        self,
+        context: Sequence[Tuple[Optional[str], str, str]],
+        lines: Sequence[str],
+        speakers: Sequence[Optional[str]],
+    ) -> str:
+        parts = []
+        if context:
+            parts.append(
+                "Recent lines:\n"
+                + "\n".join(
+                    f"{name + ': ' if name else ''}{source} => {target}"
+                    for name, source, target in context
+                )
+            )
+        parts.append(
+            "Translate:\n"
+            + "\n".join(
+                f"{index}. {name + ': ' if name else ''}{line}"
+                for index, (line, name) in enumerate(zip(lines, speakers), start=1)
+            )
+        )
+        return "\n\n".join(parts)
+
+    def _remember(
+        self,
+        resp: Dict,
+        terms: Any,
+        lines: Sequence[str],
+        speakers: Sequence[Optional[str]],
+        results: Sequence[DialogueRewriteResult],
+    ) -> None:
+        usage = resp.get("usage") if isinstance(resp.get("usage"), dict) else {}
+        details = usage.get("prompt_tokens_details") or {}
+        limit = self._MAX_SNIPPET
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += int(usage.get("prompt_tokens") or 0)
+            self.cached_tokens += int(details.get("cached_tokens") or 0)
+            if isinstance(terms, dict):
+                for source, target in terms.items():
+                    if len(self.glossary) >= self.max_glossary:
+                        break
+                    if isinstance(target, str):
+                        self._add_term(str(source)[:limit], target[:limit])
+            for line, name, result in zip(lines, speakers, results):
+                self._history.append((name, line[:limit], result.text[:limit]))
+
+    def _add_speaker(self, name: str, note: str = "") -> None:
+        # Entries are never rewritten or reordered; that would break the cached prefix.
+        if name in self.speakers:
+            return
+        self.speakers[name] = note
+        self._entries.append(f"- Character: {name}: {note}" if note else f"- Character: {name}")
+
+    def _add_term(self, source: str, target: str) -> None:
+        if source in self.glossary:
+            return
+        self.glossary[source] = target
+        self._entries.append(f"- Term: {source} => {target}")
+
+
+_UNTRACED = Tracer(enabled=False)
+
+
 def _first_message_content(resp: Dict) -> str:
     """Extract first message content from a chat completion response."""
     choices = resp.get("choices") or []
@@ -134,6 +590,36 @@ def _first_message_content(resp: Dict) -> str:
     return message.get("content", "").strip()
 
 
+def _parse_json_object(content: str) -> Dict:
+    """Parse a JSON object reply, tolerating Markdown code fences."""
+    text = content.strip()
+    if text.startswith("```"):
+        text = text.strip("`")
+        if text.lower().startswith("json"):
+            text = text[4:]
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end <= start:
+        return {}
+    try:
+        data = json.loads(text[start : end + 1])
+    except json.JSONDecodeError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _parse_json_array(content: str) -> List:
+    """Parse a JSON array reply, tolerating Markdown code fences."""
+    text = content.strip()
+    start, end = text.find("["), text.rfind("]")
+    if start == -1 or end <= start:
+        return []
+    try:
+        data = json.loads(text[start : end + 1])
+    except json.JSONDecodeError:
+        return []
+    return data if isinstance(data, list) else []
+
+
 def _first_b64_image(resp: Dict) -> str:
     """Extract base64 image string from an image response."""
     data_list = resp.get("data") or []
@@ -0,0 +1,472 @@
+"""
+CPU-bound image work around the `edit_image` calls.
+Decoding, resizing, re-encoding, mask handling and output writing run on an
+optional process pool so they don't contend for the GIL with network threads.
+Page buffers cross the process boundary through shared memory rather than
+pickled bytes, in both directions: workers read their input through a
+memoryview of the block, and large results (prepared uploads, encoded
+outputs, reassembled pages) come back in a new block the parent unlinks.
+Pillow still reads encoded images through a file object, which takes one copy
+inside the worker. Resizing and re-encoding need Pillow
+(`pip install nyamanga[imaging]`).
+"""
+import base64
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+import io
+import multiprocessing
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import Any, Callable, Iterator, NamedTuple, Optional, Tuple, TypeVar, Union
+
+from .client import ImageSource, UploadFile
+from .tracing import Tracer
+
+T = TypeVar("T")
+
+
+def _require_pil() -> Any:
+    try:
+        from PIL import Image
+    except ImportError as exc:
+        raise ImportError(
+            "Image processing needs Pillow; install it with `pip install nyamanga[imaging]`."
+        ) from exc
+    return Image
+
+
+def prepare_image_bytes(
+    data: bytes,
+    max_dimension: Optional[int] = None,
+    mask: Optional[bytes] = None,
+) -> Tuple[bytes, Optional[bytes], bool]:
+    """
+    Downscale an upload (and its mask) so the longest side fits `max_dimension`.
+    Returns `(image, mask, reencoded)`; untouched inputs are passed through.
+    """
+    if not max_dimension:
+        return data, mask, False
+    Image = _require_pil()
+    with Image.open(io.BytesIO(data)) as img:
+        if max(img.size) <= max_dimension:
+            return data, mask, False
+        scale = max_dimension / max(img.size)
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        resized = img.convert("RGBA" if "A" in img.getbands() else "RGB").resize(
+            size, Image.LANCZOS
+        )
+    out = io.BytesIO()
+    resized.save(out, format="PNG")
+
+    mask_out = None
+    if mask is not None:
+        with Image.open(io.BytesIO(mask)) as mask_img:
+            # Masks are binary; nearest keeps edges crisp.
+            mask_resized = mask_img.resize(size, Image.NEAREST)
+        buf = io.BytesIO()
+        mask_resized.save(buf, format="PNG")
+        mask_out = buf.getvalue()
+    return out.getvalue(), mask_out, True
+
+
+def thumbnail_b64(data: bytes, size: int = 160) -> str:
+    """Small JPEG preview (longest side `size`) as base64, for galleries."""
+    Image = _require_pil()
+    with Image.open(io.BytesIO(data)) as img:
+        img.draft("RGB", (size, size))
+        thumb = img.convert("RGB")
+        thumb.thumbnail((size, size), Image.BILINEAR)
+    buf = io.BytesIO()
+    thumb.save(buf, format="JPEG", quality=80)
+    return base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+OUTPUT_FORMATS = ("png", "webp", "jpeg", "avif")
+_SUFFIXES = {
+    "png": (".png",),
+    "webp": (".webp",),
+    "jpeg": (".jpg", ".jpeg"),
+    "avif": (".avif",),
+    "gif": (".gif",),
+}
+
+
+@dataclass(frozen=True)
+class OutputOptions:
+    """
+    How edited images are written. `format=None` keeps the API's bytes as-is;
+    either way the file suffix follows the real format.
+    `compress_level` is 0-9 (PNG zlib level; mapped to WebP method / AVIF speed).
+    """
+
+    format: Optional[str] = None
+    quality: int = 90
+    compress_level: int = 6
+    max_dimension: Optional[int] = None
+
+    def __post_init__(self) -> None:
+        if self.format is not None and self.format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported output format {self.format!r}; use one of {OUTPUT_FORMATS}")
+
+    @property
+    def reencodes(self) -> bool:
+        return self.format is not None or bool(self.max_dimension)
+
+
+def sniff_format(data: bytes) -> Optional[str]:
+    """Identify common image formats from magic bytes (no Pillow needed)."""
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if data.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    if data[4:12] in (b"ftypavif", b"ftypavis"):
+        return "avif"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    return None
+
+
+def encode_image_bytes(data: bytes, options: OutputOptions) -> Tuple[bytes, Optional[str]]:
+    """Re-encode image bytes per `options`; returns `(bytes, format)`."""
+    if not options.reencodes:
+        return data, sniff_format(data)
+    Image = _require_pil()
+    with Image.open(io.BytesIO(data)) as img:
+        fmt = options.format or (img.format or "png").lower()
+        if fmt not in OUTPUT_FORMATS:
+            fmt = "png"
+        img.load()
+        out_img = img
+        if options.max_dimension and max(img.size) > options.max_dimension:
+            out_img = img.copy()
+            out_img.thumbnail((options.max_dimension, options.max_dimension), Image.LANCZOS)
+
+        level = min(9, max(0, options.compress_level))
+        buf = io.BytesIO()
+        if fmt == "png":
+            out_img.save(buf, format="PNG", compress_level=level, optimize=level >= 9)
+        elif fmt == "jpeg":
+            out_img.convert("RGB").save(
+                buf, format="JPEG", quality=options.quality, optimize=True, progressive=True
+            )
+        elif fmt == "webp":
+            out_img.save(
+                buf,
+                format="WEBP",
+                quality=options.quality,
+                method=round(level * 6 / 9),
+                lossless=options.quality >= 100,
+            )
+        else:
+            from PIL import features
+
+            if not features.check("avif"):
+                raise ValueError("AVIF output needs Pillow >= 11.3 built with libavif.")
+            out_img.save(buf, format="AVIF", quality=options.quality, speed=10 - level)
+    return buf.getvalue(), fmt
+
+
+def output_path_for(path: Path, fmt: Optional[str]) -> Path:
+    """Swap the suffix of `path` to match the format actually written."""
+    suffixes = _SUFFIXES.get(fmt or "")
+    if not suffixes or path.suffix.lower() in suffixes:
+        return path
+    return path.with_suffix(suffixes[0])
+
+
+def write_output(
+    image_b64: Union[str, bytes], path: Path, options: Optional[OutputOptions] = None
+) -> Path:
+    """
+    Decode a base64 image response, encode it per `options` and write it.
+    Returns the path actually written, whose suffix matches the format.
+    """
+    data, fmt = encode_image_bytes(base64.b64decode(image_b64), options or OutputOptions())
+    path = output_path_for(path, fmt)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return path
+
+
+# --- shared-memory plumbing -------------------------------------------------
+
+_Handle = Tuple[str, int]
+# Smaller results are cheaper to pickle than to put in a block of their own.
+_SHARE_RESULTS_FROM = 64 * 1024
+
+
+class _SharedResult(NamedTuple):
+    """A worker's bytes/str result left in a block for the parent to take."""
+
+    handle: _Handle
+    text: bool
+
+
+def _share(data: Union[bytes, memoryview]) -> Tuple[shared_memory.SharedMemory, _Handle]:
+    shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+    shm.buf[: len(data)] = data
+    return shm, (shm.name, len(data))
+
+
+@contextmanager
+def _attached(handle: _Handle) -> Iterator[memoryview]:
+    """A view of a block created by the other side, valid inside the `with`."""
+    name, size = handle
+    shm = shared_memory.SharedMemory(name=name)
+    view = shm.buf[:size]
+    try:
+        yield view
+    finally:
+        view.release()
+        shm.close()
+
+
+def _take_shared(handle: _Handle) -> bytes:
+    """Read a block created by the other side and release it."""
+    name, size = handle
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return bytes(shm.buf[:size])
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _release(shm: shared_memory.SharedMemory) -> None:
+    shm.close()
+    shm.unlink()
+
+
+def _send_back(value: Any) -> Any:
+    """In a worker: move a large bytes/str result into a block; the parent unlinks it."""
+    if not isinstance(value, (bytes, str)) or len(value) < _SHARE_RESULTS_FROM:
+        return value
+    text = isinstance(value, str)
+    shm, handle = _share(value.encode("utf-8") if text else value)
+    shm.close()
+    return _SharedResult(handle, text)
+
+
+def _receive(value: Any) -> Any:
+    """In the parent: undo `_send_back`."""
+    if not isinstance(value, _SharedResult):
+        return value
+    data = _take_shared(value.handle)
+    return data.decode("utf-8") if value.text else data
+
+
+def _prepare_worker(
+    image: _Handle, mask: Optional[_Handle], max_dimension: Optional[int]
+) -> Tuple[Optional[_Handle], Optional[_Handle]]:
+    with _attached(image) as data:
+        if mask is None:
+            out, mask_out, reencoded = prepare_image_bytes(data, max_dimension)
+        else:
+            with _attached(mask) as mask_data:
+                out, mask_out, reencoded = prepare_image_bytes(data, max_dimension, mask_data)
+    if not reencoded:
+        return None, None
+    # The parent unlinks these after copying them out.
+    out_shm, out_handle = _share(out)
+    out_shm.close()
+    mask_handle = None
+    if mask_out is not None:
+        mask_shm, mask_handle = _share(mask_out)
+        mask_shm.close()
+    return out_handle, mask_handle
+
+
+def _analyze_worker(fn: Callable[..., T], image: _Handle, args: Tuple[Any, ...]) -> Any:
+    with _attached(image) as data:
+        return _send_back(fn(data, *args))
+
+
+def _write_worker(image_b64: _Handle, path: str, options: Optional[OutputOptions]) -> str:
+    with _attached(image_b64) as data:
+        return str(write_output(data, Path(path), options))
+
+
+def _encode_worker(
+    image_b64: _Handle, options: Optional[OutputOptions]
+) -> Tuple[Any, Optional[str]]:
+    with _attached(image_b64) as data:
+        encoded, fmt = encode_image_bytes(base64.b64decode(data), options or OutputOptions())
+    return _send_back(encoded), fmt
+
+
+class ImageWorkerPool:
+    """
+    Runs image preparation and output encoding/writing on `workers` processes.
+    `workers=0` keeps everything in-process (useful for frozen desktop builds
+    and small jobs); the API is identical either way. `output` is the default
+    encoding for `write`.
+    """
+
+    def __init__(
+        self,
+        workers: int = 0,
+        max_dimension: Optional[int] = None,
+        output: Optional[OutputOptions] = None,
+        tracer: Optional[Tracer] = None,
+    ):
+        self.workers = max(0, workers)
+        self.max_dimension = max_dimension
+        self.output = output or OutputOptions()
+        self.tracer = tracer or Tracer(enabled=False)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        if self.workers:
+            # Spawn, not fork: the pool starts while HTTP threads hold locks.
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+
+    def prepare(
+        self, image: ImageSource, mask: Optional[ImageSource] = None
+    ) -> Tuple[UploadFile, Optional[UploadFile]]:
+        """
+        Load and preprocess an upload (plus mask) once; blocks until ready.
+        Without `max_dimension` there is nothing to decode or resize, so the
+        files are only read and the pool is not involved.
+        """
+        upload = image if isinstance(image, UploadFile) else UploadFile.from_path(image)
+        mask_upload = None
+        if mask:
+            mask_upload = mask if isinstance(mask, UploadFile) else UploadFile.from_path(mask)
+        if not self.max_dimension:
+            return upload, mask_upload
+
+        with self.tracer.span("prepare", "image", image=upload.name, bytes=len(upload.data)):
+            if self._executor is None:
+                data, mask_data, reencoded = prepare_image_bytes(
+                    upload.data, self.max_dimension, mask_upload.data if mask_upload else None
+                )
+            else:
+                data, mask_data, reencoded = self._prepare_remote(upload, mask_upload)
+        if not reencoded:
+            return upload, mask_upload
+        prepared = UploadFile(name=f"{Path(upload.name).stem}.png", data=data)
+        prepared_mask = None
+        if mask_upload is not None and mask_data is not None:
+            prepared_mask = UploadFile(name=f"{Path(mask_upload.name).stem}.png", data=mask_data)
+        return prepared, prepared_mask
+
+    def write(
+        self, image_b64: str, path: Path, options: Optional[OutputOptions] = None
+    ) -> "Future[Path]":
+        """
+        Decode, encode and write an edited image without blocking the caller.
+        The future resolves to the written path (suffix matches the format).
+        """
+        options = options or self.output
+        if self._executor is None:
+            future: "Future[Path]" = Future()
+            try:
+                with self.tracer.span("save", "image", path=path.name):
+                    future.set_result(write_output(image_b64, path, options))
+            except Exception as exc:
+                future.set_exception(exc)
+            return future
+
+        shm, handle = _share(image_b64.encode("ascii"))
+        submitted = self.tracer.now()
+        inner = self._executor.submit(_write_worker, handle, str(path), options)
+        outer: "Future[Path]" = Future()
+
+        def done(fut: Future) -> None:
+            _release(shm)
+            # Runs on the pool; the span covers queueing plus the write.
+            self.tracer.record_async(
+                "save", "image", submitted, self.tracer.now(), {"path": path.name}
+            )
+            if fut.exception() is not None:
+                outer.set_exception(fut.exception())
+            else:
+                outer.set_result(Path(fut.result()))
+
+        inner.add_done_callback(done)
+        return outer
+
+    def encode(
+        self, image_b64: str, options: Optional[OutputOptions] = None
+    ) -> "Future[Tuple[bytes, Optional[str]]]":
+        """
+        Decode and encode an edited image without writing it; the future
+        resolves to `(bytes, format)`, e.g. for appending to a `ChapterPack`.
+        """
+        options = options or self.output
+        if self._executor is None:
+            future: "Future[Tuple[bytes, Optional[str]]]" = Future()
+            try:
+                with self.tracer.span("encode", "image"):
+                    future.set_result(
+                        encode_image_bytes(base64.b64decode(image_b64), options or OutputOptions())
+                    )
+            except Exception as exc:
+                future.set_exception(exc)
+            return future
+
+        shm, handle = _share(image_b64.encode("ascii"))
+        submitted = self.tracer.now()
+        inner = self._executor.submit(_encode_worker, handle, options)
+        outer: "Future[Tuple[bytes, Optional[str]]]" = Future()
+
+        def done(fut: Future) -> None:
+            _release(shm)
+            self.tracer.record_async("encode", "image", submitted, self.tracer.now())
+            if fut.exception() is not None:
+                outer.set_exception(fut.exception())
+                return
+            encoded, fmt = fut.result()
+            try:
+                outer.set_result((_receive(encoded), fmt))
+            except Exception as exc:
+                outer.set_exception(exc)
+
+        inner.add_done_callback(done)
+        return outer
+
+    def analyze(self, fn: Callable[..., T], data: bytes, *args: Any) -> T:
+        """
+        Run `fn(data, *args)` on the pool and wait for it. `fn` must be a
+        module-level function returning something picklable; on the pool
+        `data` is a read-only memoryview that is only valid during the call.
+        """
+        with self.tracer.span(fn.__name__, "image", bytes=len(data)):
+            if self._executor is None:
+                return fn(data, *args)
+            shm, handle = _share(data)
+            try:
+                return _receive(self._executor.submit(_analyze_worker, fn, handle, args).result())
+            finally:
+                _release(shm)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _prepare_remote(
+        self, upload: UploadFile, mask: Optional[UploadFile]
+    ) -> Tuple[bytes, Optional[bytes], bool]:
+        blocks = []
+        try:
+            shm, handle = _share(upload.data)
+            blocks.append(shm)
+            mask_handle = None
+            if mask is not None:
+                mask_shm, mask_handle = _share(mask.data)
+                blocks.append(mask_shm)
+            out_handle, out_mask_handle = self._executor.submit(
+                _prepare_worker, handle, mask_handle, self.max_dimension
+            ).result()
+        finally:
+            for block in blocks:
+                _release(block)
+        if out_handle is None:
+            return upload.data, mask.data if mask else None, False
+        data = _take_shared(out_handle)
+        mask_data = _take_shared(out_mask_handle) if out_mask_handle else None
+        return data, mask_data, True
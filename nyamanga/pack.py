@@ -0,0 +1,275 @@
+"""
+Packed chapter output (`<chapter>.nyapack`).
+Instead of one loose file per page, results are appended to a single blob
+(`pages.bin`) and described by a JSON-lines index (`index.jsonl`) of
+page -> offset/length/format/params. Writes are sequential appends, a page
+written again simply gets a newer index entry, and readers map the blob
+into memory so any page is reachable without copying. `export_files` and
+`export_cbz` turn a pack back into loose files or a comic archive.
+"""
+from concurrent.futures import Future
+from dataclasses import asdict, dataclass, field
+import json
+import mmap
+import os
+from pathlib import Path
+import re
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+import zipfile
+
+from .imaging import output_path_for
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are only serialized within a process
+    fcntl = None
+
+PACK_SUFFIX = ".nyapack"
+_BLOB = "pages.bin"
+_INDEX = "index.jsonl"
+
+
+@dataclass
+class PackEntry:
+    page: str
+    language: str
+    offset: int
+    length: int
+    # File name the page would have had as a loose output.
+    name: str
+    format: Optional[str] = None
+    params: Dict[str, Any] = field(default_factory=dict)
+    written_at: float = 0.0
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        return self.page, self.language
+
+
+class ChapterPack:
+    """
+    One chapter's outputs in an append-only blob plus index. Safe to share
+    between threads; on POSIX, processes appending to the same pack (e.g.
+    several `queue work` workers) are serialized with a file lock.
+    """
+
+    def __init__(self, path: Union[str, Path], readonly: bool = False):
+        self.path = Path(path)
+        self.readonly = readonly
+        if not readonly:
+            self.path.mkdir(parents=True, exist_ok=True)
+        elif not (self.path / _INDEX).exists():
+            raise FileNotFoundError(f"No pack index at {self.path / _INDEX}")
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple[str, str], PackEntry] = {}
+        self._index_pos = 0
+        self._map: Optional[mmap.mmap] = None
+        self.refresh()
+
+    def __enter__(self) -> "ChapterPack":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def __contains__(self, key: Tuple[str, str]) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __iter__(self) -> Iterator[PackEntry]:
+        return iter(self.entries())
+
+    def entries(self, language: Optional[str] = None) -> List[PackEntry]:
+        """Latest entry per page (and language), in natural page order."""
+        with self._lock:
+            entries = list(self._entries.values())
+        if language is not None:
+            entries = [entry for entry in entries if entry.language == language]
+        return sorted(entries, key=lambda e: (_natural_key(e.page), e.language))
+
+    def languages(self) -> List[str]:
+        with self._lock:
+            return sorted({entry.language for entry in self._entries.values()})
+
+    def get(self, page: str, language: str = "") -> Optional[PackEntry]:
+        with self._lock:
+            return self._entries.get((page, language))
+
+    def add(
+        self,
+        page: str,
+        data: bytes,
+        language: str = "",
+        name: Optional[str] = None,
+        fmt: Optional[str] = None,
+        params: Optional[Dict[str, Any]] = None,
+    ) -> PackEntry:
+        """Append one page's encoded image and index it; returns its entry."""
+        if self.readonly:
+            raise PermissionError(f"{self.path} was opened read-only")
+        with self._lock, (self.path / _INDEX).open("a", encoding="utf-8") as index:
+            if fcntl is not None:
+                fcntl.flock(index.fileno(), fcntl.LOCK_EX)
+            try:
+                with (self.path / _BLOB).open("ab") as blob:
+                    offset = blob.seek(0, os.SEEK_END)
+                    blob.write(data)
+                entry = PackEntry(
+                    page=page,
+                    language=language,
+                    offset=offset,
+                    length=len(data),
+                    name=output_path_for(Path(name or page), fmt).name,
+                    format=fmt,
+                    params=params or {},
+                    written_at=round(time.time(), 3),
+                )
+                # The blob is written first, so an index line never points
+                # past its end; a crash in between only leaves unused bytes.
+                # A line cut short by a crash is ended first so it doesn't
+                # swallow this one.
+                lead = "" if _ends_cleanly(self.path / _INDEX) else "\n"
+                index.write(lead + json.dumps(asdict(entry), ensure_ascii=False) + "\n")
+                index.flush()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(index.fileno(), fcntl.LOCK_UN)
+            self._read_index()
+        return entry
+
+    def add_encoded(
+        self,
+        encoded: "Future[Tuple[bytes, Optional[str]]]",
+        page: str,
+        language: str = "",
+        name: Optional[str] = None,
+        params: Optional[Dict[str, Any]] = None,
+    ) -> "Future[PackEntry]":
+        """
+        Append an image once `encoded` (from `ImageWorkerPool.encode`)
+        resolves, without blocking the caller. The future resolves to its entry.
+        """
+        packed: "Future[PackEntry]" = Future()
+
+        def done(fut: Future) -> None:
+            try:
+                data, fmt = fut.result()
+                entry = self.add(page, data, language, name=name, fmt=fmt, params=params)
+                packed.set_result(entry)
+            except Exception as exc:
+                packed.set_exception(exc)
+
+        encoded.add_done_callback(done)
+        return packed
+
+    def read(self, page: str, language: str = "") -> memoryview:
+        """
+        Zero-copy view of a page's bytes in the memory-mapped blob. Call
+        `refresh` first to see pages other processes added since.
+        """
+        entry = self.get(page, language)
+        if entry is None:
+            raise KeyError(f"{page!r} ({language or 'no language'}) is not in {self.path}")
+        return self.view(entry)
+
+    def view(self, entry: PackEntry) -> memoryview:
+        with self._lock:
+            end = entry.offset + entry.length
+            if self._map is None or len(self._map) < end:
+                # Views of an older mapping stay valid; it is freed with them.
+                self._map = self._mapped()
+            if self._map is None or len(self._map) < end:
+                raise ValueError(f"{self.path / _BLOB} is shorter than its index")
+            return memoryview(self._map)[entry.offset : end]
+
+    def refresh(self) -> None:
+        """Pick up index entries appended since the last read."""
+        with self._lock:
+            self._read_index()
+
+    def export_files(self, directory: Path, language: Optional[str] = None) -> List[Path]:
+        """Write pages out as loose files named as they would have been."""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        written = []
+        for entry in self.entries(language):
+            path = output_path_for(directory / entry.name, entry.format)
+            path.write_bytes(self.view(entry))
+            written.append(path)
+        return written
+
+    def export_cbz(self, path: Path, language: Optional[str] = None) -> Path:
+        """
+        Write one language's pages, in page order, into a CBZ (an uncompressed
+        zip; the images are already compressed).
+        """
+        if language is None:
+            languages = self.languages()
+            if len(languages) > 1:
+                raise ValueError(
+                    f"{self.path} holds several languages ({', '.join(languages)}); pick one"
+                )
+            language = languages[0] if languages else ""
+        entries = self.entries(language)
+        width = max(3, len(str(len(entries))))
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED) as archive:
+            for number, entry in enumerate(entries, start=1):
+                suffix = output_path_for(Path(entry.name), entry.format).suffix
+                archive.writestr(f"{number:0{width}d}{suffix}", self.view(entry))
+        return path
+
+    def close(self) -> None:
+        with self._lock:
+            # Exported views keep the mapping alive until they are released.
+            self._map = None
+
+    def _read_index(self) -> None:
+        index = self.path / _INDEX
+        if not index.exists():
+            return
+        with index.open("rb") as fh:
+            fh.seek(self._index_pos)
+            chunk = fh.read()
+        # Only consume complete lines; a writer may be mid-append.
+        complete = chunk[: chunk.rfind(b"\n") + 1]
+        self._index_pos += len(complete)
+        for line in complete.splitlines():
+            try:
+                entry = PackEntry(**json.loads(line))
+            except (TypeError, ValueError):
+                continue
+            self._entries[entry.key] = entry
+
+    def _mapped(self) -> Optional[mmap.mmap]:
+        blob = self.path / _BLOB
+        if not blob.exists() or blob.stat().st_size == 0:
+            return None
+        with blob.open("rb") as fh:
+            return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def pack_path(directory: Path, chapter: str) -> Path:
+    """`<directory>/<chapter>.nyapack`."""
+    return Path(directory) / f"{chapter}{PACK_SUFFIX}"
+
+
+def _ends_cleanly(index: Path) -> bool:
+    """True if `index` is empty or its last line is complete."""
+    with index.open("rb") as fh:
+        if fh.seek(0, os.SEEK_END) == 0:
+            return True
+        fh.seek(-1, os.SEEK_END)
+        return fh.read(1) == b"\n"
+
+
+def _natural_key(name: str) -> List[Union[int, str]]:
+    """Sort `page2` before `page10`."""
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", name)]
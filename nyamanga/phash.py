@@ -0,0 +1,253 @@
+"""
+Perceptual-hash index for reusing results on near-duplicate panels.
+Recap pages, title cards and re-exports of the same panel at another size or
+JPEG quality hash to (nearly) the same 64-bit DCT hash, so a finished result
+can be served again without an API call. Hashing and the Hamming-distance
+search are vectorized with numpy; both numpy and Pillow come with the
+`imaging` extra (`pip install nyamanga[imaging]`).
+"""
+import base64
+from dataclasses import dataclass
+import hashlib
+import io
+import json
+import os
+from pathlib import Path
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from .imaging import _require_pil
+
+HASH_SIZE = 8
+_SAMPLE_SIZE = 32
+
+
+def _require_numpy() -> Any:
+    try:
+        import numpy
+    except ImportError as exc:
+        raise ImportError(
+            "Near-duplicate detection needs numpy; install it with `pip install nyamanga[imaging]`."
+        ) from exc
+    return numpy
+
+
+_dct_cache: Dict[int, Any] = {}
+
+
+def _dct_matrix(n: int) -> Any:
+    np = _require_numpy()
+    if n not in _dct_cache:
+        k = np.arange(n)[:, None]
+        i = np.arange(n)[None, :]
+        _dct_cache[n] = np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+    return _dct_cache[n]
+
+
+def perceptual_hash(data: bytes) -> Tuple[int, Tuple[int, int]]:
+    """
+    64-bit DCT hash of an encoded image plus its `(width, height)`.
+    Robust to rescaling and recompression, sensitive to changed content.
+    """
+    Image = _require_pil()
+    np = _require_numpy()
+    with Image.open(io.BytesIO(data)) as img:
+        size = img.size
+        # Let JPEG decode at reduced scale; only a 32x32 sample is needed.
+        img.draft("L", (_SAMPLE_SIZE * 4, _SAMPLE_SIZE * 4))
+        sample = img.convert("L").resize((_SAMPLE_SIZE, _SAMPLE_SIZE), Image.LANCZOS)
+    pixels = np.asarray(sample, dtype=np.float64)
+    dct = _dct_matrix(_SAMPLE_SIZE)
+    low = (dct @ pixels @ dct.T)[:HASH_SIZE, :HASH_SIZE].ravel()
+    bits = low > np.median(low[1:])
+    return int(np.packbits(bits).view(">u8")[0]), size
+
+
+def params_key(**params: Any) -> str:
+    """Stable key for the request parameters a reused result must share."""
+    encoded = json.dumps(params, sort_keys=True, ensure_ascii=False, default=_digest)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()[:32]
+
+
+def _digest(value: Any) -> str:
+    data = getattr(value, "data", value)
+    if isinstance(data, (bytes, bytearray)):
+        return hashlib.sha256(data).hexdigest()
+    return str(value)
+
+
+@dataclass
+class IndexEntry:
+    phash: int
+    key: str
+    size: Tuple[int, int]
+    rewritten_text: str
+    source: str
+    image_b64: Optional[str] = None
+    file: Optional[str] = None
+
+
+class PhashIndex:
+    """
+    Finished results keyed by input hash and request parameters.
+    `threshold` is the largest Hamming distance (out of 64 bits) treated as
+    the same panel. With `directory` the index and result images persist
+    across runs. Either way only about the newest `max_entries` results are
+    kept; older ones are dropped in batches (with their files on disk).
+    """
+
+    def __init__(
+        self,
+        threshold: int = 6,
+        directory: Optional[Path] = None,
+        max_entries: int = 512,
+    ):
+        np = _require_numpy()
+        self.threshold = threshold
+        self.directory = Path(directory) if directory else None
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: List[IndexEntry] = []
+        # Grown in chunks; only the first len(self._entries) slots are used.
+        self._hashes = np.zeros(0, dtype=np.uint64)
+        if self.directory is not None:
+            self._load()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def lookup(self, phash: int, key: str) -> Optional[Tuple[IndexEntry, int]]:
+        """Closest entry with the same `key` within `threshold`, and its distance."""
+        np = _require_numpy()
+        with self._lock:
+            if not self._entries:
+                return None
+            hashes = self._hashes[: len(self._entries)]
+            xor = np.bitwise_xor(hashes, np.uint64(phash))
+            distances = np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+            order = np.argsort(distances, kind="stable")
+            for index in order:
+                distance = int(distances[index])
+                if distance > self.threshold:
+                    return None
+                entry = self._entries[index]
+                if entry.key == key:
+                    return entry, distance
+        return None
+
+    def add(
+        self,
+        phash: int,
+        key: str,
+        size: Tuple[int, int],
+        image_b64: str,
+        rewritten_text: str = "",
+        source: str = "",
+    ) -> None:
+        np = _require_numpy()
+        entry = IndexEntry(
+            phash=phash, key=key, size=tuple(size), rewritten_text=rewritten_text, source=source
+        )
+        with self._lock:
+            if self.directory is not None:
+                data = base64.b64decode(image_b64)
+                entry.file = f"{phash:016x}_{hashlib.sha256(data).hexdigest()[:12]}"
+                (self.directory / entry.file).write_bytes(data)
+                with (self.directory / "index.jsonl").open("a", encoding="utf-8") as fh:
+                    fh.write(json.dumps(self._entry_record(entry), ensure_ascii=False) + "\n")
+            else:
+                entry.image_b64 = image_b64
+            self._entries.append(entry)
+            count = len(self._entries)
+            if count > len(self._hashes):
+                grown = np.zeros(max(64, 2 * len(self._hashes)), dtype=np.uint64)
+                grown[: count - 1] = self._hashes[: count - 1]
+                self._hashes = grown
+            self._hashes[count - 1] = np.uint64(phash)
+            # Evicting rewrites the index on disk, so let a few entries pile up first.
+            if count > self.max_entries + max(1, self.max_entries // 8):
+                self._evict()
+
+    def image_b64(self, entry: IndexEntry, size: Optional[Tuple[int, int]] = None) -> str:
+        """
+        The stored result, rescaled by the ratio between `size` (the new
+        input's dimensions) and the size of the input it was produced from.
+        """
+        if entry.image_b64 is not None:
+            data = base64.b64decode(entry.image_b64)
+        else:
+            data = (self.directory / entry.file).read_bytes()
+        if size is None or tuple(size) == tuple(entry.size):
+            return entry.image_b64 or base64.b64encode(data).decode("ascii")
+        Image = _require_pil()
+        with Image.open(io.BytesIO(data)) as img:
+            fmt = img.format or "PNG"
+            target = (
+                max(1, round(img.width * size[0] / entry.size[0])),
+                max(1, round(img.height * size[1] / entry.size[1])),
+            )
+            if target == img.size:
+                return base64.b64encode(data).decode("ascii")
+            resized = img.resize(target, Image.LANCZOS)
+        buf = io.BytesIO()
+        resized.save(buf, format=fmt)
+        return base64.b64encode(buf.getvalue()).decode("ascii")
+
+    def _entry_record(self, entry: IndexEntry) -> Dict[str, Any]:
+        return {
+            "phash": f"{entry.phash:016x}",
+            "key": entry.key,
+            "size": list(entry.size),
+            "rewritten_text": entry.rewritten_text,
+            "source": entry.source,
+            "file": entry.file,
+        }
+
+    def _evict(self) -> None:
+        # Caller holds self._lock (or is still constructing the index).
+        drop = len(self._entries) - self.max_entries
+        if drop <= 0:
+            return
+        dropped = self._entries[:drop]
+        del self._entries[:drop]
+        kept = len(self._entries)
+        self._hashes[:kept] = self._hashes[drop : drop + kept]
+        if self.directory is None:
+            return
+        index_path = self.directory / "index.jsonl"
+        tmp = index_path.with_name(f".index.{os.getpid()}.tmp")
+        with tmp.open("w", encoding="utf-8") as fh:
+            for entry in self._entries:
+                fh.write(json.dumps(self._entry_record(entry), ensure_ascii=False) + "\n")
+        os.replace(tmp, index_path)
+        in_use = {entry.file for entry in self._entries}
+        for entry in dropped:
+            if entry.file not in in_use:
+                (self.directory / entry.file).unlink(missing_ok=True)
+
+    def _load(self) -> None:
+        np = _require_numpy()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        index_path = self.directory / "index.jsonl"
+        if not index_path.exists():
+            return
+        for line in index_path.read_text(encoding="utf-8").splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # tolerate a torn last line
+            if not (self.directory / record["file"]).exists():
+                continue
+            self._entries.append(
+                IndexEntry(
+                    phash=int(record["phash"], 16),
+                    key=record["key"],
+                    size=tuple(record["size"]),
+                    rewritten_text=record.get("rewritten_text", ""),
+                    source=record.get("source", ""),
+                    file=record["file"],
+                )
+            )
+        self._hashes = np.array([e.phash for e in self._entries], dtype=np.uint64)
+        self._evict()
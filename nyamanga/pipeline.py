@@ -1,10 +1,33 @@
+import base64
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
 
-from .client import NyaMangaClient
+from .cancel import CancelToken, Cancelled
+from .client import ImageSource, NyaMangaClient, UploadFile, _as_upload
 from .config import ApiConfig
-from .embedder import DialogueRewriteResult, EmbedResult, MangaEmbedder
+from .embedder import (
+    DialogueRewriteResult,
+    EmbedResult,
+    ExtractResult,
+    MangaEmbedder,
+    TextLine,
+    TranslateResult,
+)
+from .imaging import ImageWorkerPool, OutputOptions
+from .phash import PhashIndex, params_key, perceptual_hash
+from .resilience import LatencyHistory
+from .scheduler import Budget, Priority, ScheduledClient, Scheduler
+from .tracing import Tracer
+from .translations import TranslationCache
+from .triage import TRIAGE_MODES, Box, PageTriage, crop, reassemble, triage_page
+from .verify import Verification, repair, verify_edit
+
+# "single": one image edit reads, translates and typesets. "phased": a vision
+# chat call extracts the lines, a cached chat call translates them and the
+# edit only typesets.
+AUTO_MODES = ("single", "phased")
 
 
 @dataclass
@@ -13,73 +36,711 @@ class PanelResult:
     edited_image_b64: str
     dialogue_response: dict
     image_response: dict
+    # Set when the result was reused from a near-duplicate earlier panel.
+    reused_from: Optional[str] = None
+    # Set when triage found no text and the page was passed through as-is.
+    skipped: bool = False
+    # Local check of the edit (see `nyamanga.verify`); `flagged` when it
+    # still failed after the automatic repairs.
+    verification: Optional[dict] = None
+    flagged: bool = False
 
 
 class TypesettingPipeline:
     """
     Minimal end-to-end pipeline. UI code can call `localize_panel` and then
     decide how to display or post-process the base64 image and rewritten text.
+    Every API call goes through `scheduler`, so interactive jobs overtake
+    batch jobs and spend is tracked against the configured budgets.
+    With a `dedupe` index, panels that look like an earlier one (same
+    parameters) get the earlier result back without any API call.
+    `config.triage` checks auto-mode pages locally first: pages without
+    lettering are passed through, and in "panels" mode only the panels that
+    contain text are sent and then pasted back into the page.
+    `tracer` records a timeline of every phase (see `nyamanga.tracing`).
+    With `config.auto_mode == "phased"`, auto mode extracts and translates
+    text through `translations` first, so repeated lines cost no chat call
+    and retranslation never needs an extra image edit.
+    With `config.verify`, every edit is checked against the upload (size,
+    art outside the text regions, untouched balloons) and repaired locally
+    or region by region before it is returned.
     """
 
-    def __init__(self, config: Optional[ApiConfig] = None, client: Optional[NyaMangaClient] = None):
+    def __init__(
+        self,
+        config: Optional[ApiConfig] = None,
+        client: Optional[NyaMangaClient] = None,
+        images: Optional[ImageWorkerPool] = None,
+        scheduler: Optional[Scheduler] = None,
+        dedupe: Optional[PhashIndex] = None,
+        tracer: Optional[Tracer] = None,
+        translations: Optional[TranslationCache] = None,
+    ):
         self.config = config or ApiConfig.from_env()
-        self.client = client or NyaMangaClient(self.config)
-        self.embedder = MangaEmbedder(self.client)
+        self.tracer = tracer or Tracer(enabled=False)
+        self.client = client or NyaMangaClient(self.config, tracer=self.tracer)
+        self.scheduler = scheduler or Scheduler(
+            self.config.max_concurrency,
+            Budget(max_requests=self.config.budget_requests, max_tokens=self.config.budget_tokens),
+        )
+        self.embedder = MangaEmbedder(ScheduledClient(self.client, self.scheduler))
+        self.images = images or ImageWorkerPool(
+            self.config.image_workers,
+            max_dimension=self.config.max_upload_dimension,
+            tracer=self.tracer,
+        )
+        if dedupe is None and self.config.dedupe_threshold is not None:
+            dedupe = PhashIndex(
+                self.config.dedupe_threshold,
+                Path(self.config.dedupe_dir) if self.config.dedupe_dir else None,
+            )
+        self.dedupe = dedupe
+        if self.config.triage and self.config.triage not in TRIAGE_MODES:
+            raise ValueError(f"Unknown triage mode {self.config.triage!r}; use one of {TRIAGE_MODES}")
+        if self.config.auto_mode not in AUTO_MODES:
+            raise ValueError(
+                f"Unknown auto mode {self.config.auto_mode!r}; use one of {AUTO_MODES}"
+            )
+        self.translations = translations or TranslationCache(self.config.translation_cache)
+
+    def embedder_for(
+        self, priority: Priority = Priority.INTERACTIVE, budget: Optional[Budget] = None
+    ) -> MangaEmbedder:
+        """Embedder whose calls are scheduled at `priority` and charged to `budget`."""
+        if priority == Priority.INTERACTIVE and budget is None:
+            return self.embedder
+        return MangaEmbedder(ScheduledClient(self.client, self.scheduler, priority, budget))
+
+    def save_result(
+        self, result: PanelResult, path: Path, options: Optional[OutputOptions] = None
+    ) -> "Future[Path]":
+        """
+        Encode and write the edited image on the image pool.
+        The future resolves to the written path, whose suffix follows the format.
+        """
+        return self.images.write(result.edited_image_b64, path, options)
 
     def localize_panel(
         self,
-        image_path: Path,
+        image_path: ImageSource,
         source_text: Optional[str] = None,
         target_language: str = "zh",
         tone: str = "friendly manga voice",
         bubble_hint: Optional[str] = None,
-        mask_path: Optional[Path] = None,
+        mask_path: Optional[ImageSource] = None,
         style_hint: Optional[str] = None,
+        cancel: Optional[CancelToken] = None,
+        priority: Priority = Priority.INTERACTIVE,
+        budget: Optional[Budget] = None,
     ) -> PanelResult:
         """
         Translate/rewrite dialogue and send a single edit request to place it.
         If source_text is None, rely on the image model to read/translate and typeset.
         Returns base64 image data so callers can render it on any platform.
+        Pass a `CancelToken` to stop between or during requests; `priority` and
+        `budget` control how the scheduler admits this job's calls.
         """
+        if cancel is not None:
+            cancel.raise_if_cancelled()
+        embedder = self.embedder_for(priority, budget)
+        with self.tracer.span(
+            "localize_panel", image=_source_name(image_path), language=target_language
+        ) as trace:
+            # Read once; skipped pages are passed through at their original size.
+            original = _as_upload(image_path)
+            image, mask = self.images.prepare(original, mask_path)
+            probe = self.dedupe_probe(image)
+            key = self.dedupe_key(mask, source_text, target_language, tone, bubble_hint, style_hint)
+            reused = self._reuse(probe, key)
+            if reused is not None:
+                trace["reused"] = True
+                return reused
+            result = self._localize_prepared(
+                embedder,
+                original=original,
+                image=image,
+                mask=mask,
+                source_text=source_text,
+                target_language=target_language,
+                tone=tone,
+                bubble_hint=bubble_hint,
+                style_hint=style_hint,
+                cancel=cancel,
+                triage=None if source_text else self.triage(image),
+            )
+            trace["skipped"] = result.skipped
+            self._remember(probe, key, result, image)
+            return result
+
+    def _localize_prepared(
+        self,
+        embedder: MangaEmbedder,
+        original: UploadFile,
+        image: UploadFile,
+        mask: Optional[UploadFile],
+        source_text: Optional[str],
+        target_language: str,
+        tone: str,
+        bubble_hint: Optional[str],
+        style_hint: Optional[str],
+        cancel: Optional[CancelToken],
+        triage: Optional[PageTriage] = None,
+    ) -> PanelResult:
+        dialogue: Optional[DialogueRewriteResult] = None
+        extracted: Optional[ExtractResult] = None
+        translated: Optional[TranslateResult] = None
         if source_text:
-            dialogue: DialogueRewriteResult = self.embedder.rewrite_dialogue(
+            dialogue = embedder.rewrite_dialogue(
                 source_text=source_text,
                 target_language=target_language,
                 tone=tone,
+                cancel=cancel,
+            )
+            if cancel is not None:
+                cancel.raise_if_cancelled()
+        elif self.config.auto_mode == "phased":
+            extracted, translated = self._extract_and_translate(
+                embedder, image, [target_language], tone, cancel, triage
+            )
+
+        def attempt() -> PanelResult:
+            if dialogue is not None:
+                return self._embed_dialogue(
+                    embedder, image, mask, dialogue, bubble_hint, style_hint, cancel
+                )
+            if self.config.auto_mode == "phased":
+                return self._phased_result(
+                    embedder, original, image, mask, extracted, translated, target_language,
+                    bubble_hint, style_hint, cancel,
+                )
+            # Auto mode: let image model handle detection + translation
+            return self._auto_localize(
+                embedder, original, image, mask, target_language, bubble_hint, style_hint,
+                cancel, triage,
             )
-            embed: EmbedResult = self.embedder.embed_text(
-                image_path=image_path,
-                text=dialogue.text,
+
+        return self._verified(
+            embedder, image, mask, attempt, target_language, style_hint, cancel,
+            triage, extracted, translated, expect_text=dialogue is None,
+        )
+
+    def _embed_dialogue(
+        self,
+        embedder: MangaEmbedder,
+        image: UploadFile,
+        mask: Optional[UploadFile],
+        dialogue: DialogueRewriteResult,
+        bubble_hint: Optional[str],
+        style_hint: Optional[str],
+        cancel: Optional[CancelToken],
+    ) -> PanelResult:
+        embed: EmbedResult = embedder.embed_text(
+            image_path=image,
+            text=dialogue.text,
+            bubble_hint=bubble_hint,
+            mask_path=mask,
+            style_hint=style_hint,
+            cancel=cancel,
+        )
+        return PanelResult(
+            rewritten_text=dialogue.text,
+            edited_image_b64=embed.image_b64,
+            dialogue_response=dialogue.raw_response,
+            image_response=embed.raw_response,
+        )
+
+    def _auto_localize(
+        self,
+        embedder: MangaEmbedder,
+        original: UploadFile,
+        image: UploadFile,
+        mask: Optional[UploadFile],
+        target_language: str,
+        bubble_hint: Optional[str],
+        style_hint: Optional[str],
+        cancel: Optional[CancelToken],
+        triage: Optional[PageTriage] = None,
+    ) -> PanelResult:
+        if triage is not None and not triage.has_text:
+            return _passthrough(original)
+        if not splits_panels(triage):
+            embed = embedder.auto_localize(
+                image_path=image,
+                target_language=target_language,
                 bubble_hint=bubble_hint,
-                mask_path=mask_path,
+                mask_path=mask,
                 style_hint=style_hint,
+                cancel=cancel,
             )
             return PanelResult(
-                rewritten_text=dialogue.text,
+                rewritten_text="",
                 edited_image_b64=embed.image_b64,
-                dialogue_response=dialogue.raw_response,
+                dialogue_response={},
                 image_response=embed.raw_response,
             )
-        # Auto mode: let image model handle detection + translation
-        embed = self.embedder.auto_localize(
-            image_path=image_path,
-            target_language=target_language,
+
+        panels = triage.text_panels()
+        group = CancelToken(deadline=cancel.deadline if cancel is not None else None)
+        unlink = cancel.add_callback(group.cancel) if cancel is not None else None
+
+        def run(index: int) -> EmbedResult:
+            box = panels[index].box
+            name = Path(image.name).stem
+            try:
+                return embedder.auto_localize(
+                    image_path=UploadFile(f"{name}_panel{index}.png", crop(image.data, box)),
+                    target_language=target_language,
+                    mask_path=(
+                        UploadFile(f"{name}_panel{index}_mask.png", crop(mask.data, box))
+                        if mask is not None
+                        else None
+                    ),
+                    style_hint=style_hint,
+                    cancel=group,
+                )
+            except Exception:
+                group.cancel()
+                raise
+
+        try:
+            with ThreadPoolExecutor(
+                max_workers=min(4, len(panels)), thread_name_prefix="nyamanga-panel"
+            ) as pool:
+                futures = [pool.submit(run, index) for index in range(len(panels))]
+                embeds = []
+                errors = []
+                for future in futures:
+                    try:
+                        embeds.append(future.result())
+                    except Exception as exc:
+                        errors.append(exc)
+            if errors:
+                raise next((e for e in errors if not isinstance(e, Cancelled)), errors[0])
+        finally:
+            if unlink is not None:
+                unlink()
+        patches = [(panel.box, embed.image_b64) for panel, embed in zip(panels, embeds)]
+        return PanelResult(
+            rewritten_text="",
+            edited_image_b64=self.images.analyze(reassemble, image.data, patches),
+            dialogue_response={},
+            image_response={"panels": [embed.raw_response for embed in embeds]},
+        )
+
+    def localize_panel_multi(
+        self,
+        image_path: ImageSource,
+        target_languages: Sequence[str],
+        source_text: Optional[str] = None,
+        tone: str = "friendly manga voice",
+        bubble_hint: Optional[str] = None,
+        mask_path: Optional[ImageSource] = None,
+        style_hint: Optional[str] = None,
+        cancel: Optional[CancelToken] = None,
+        priority: Priority = Priority.INTERACTIVE,
+        budget: Optional[Budget] = None,
+    ) -> Dict[str, PanelResult]:
+        """
+        Localize one panel into several languages.
+        The image (and mask) are read once, all translations come from a single
+        chat call when `source_text` is given, and the per-language edits run
+        concurrently. If any language fails the others are cancelled.
+        """
+        languages = list(dict.fromkeys(target_languages))
+        if not languages:
+            return {}
+        with self.tracer.span(
+            "localize_panel_multi", image=_source_name(image_path), languages=",".join(languages)
+        ):
+            embedder = self.embedder_for(priority, budget)
+            original = _as_upload(image_path)
+            image, mask = self.images.prepare(original, mask_path)
+            probe = self.dedupe_probe(image)
+            keys = {
+                lang: self.dedupe_key(mask, source_text, lang, tone, bubble_hint, style_hint)
+                for lang in languages
+            }
+            reused: Dict[str, PanelResult] = {}
+            for lang in languages:
+                hit = self._reuse(probe, keys[lang])
+                if hit is not None:
+                    reused[lang] = hit
+            languages = [lang for lang in languages if lang not in reused]
+            if not languages:
+                return reused
+
+            triage = None if source_text else self.triage(image)
+            phased = not source_text and self.config.auto_mode == "phased"
+            group = CancelToken(deadline=cancel.deadline if cancel is not None else None)
+            unlink = cancel.add_callback(group.cancel) if cancel is not None else None
+            try:
+                dialogues: Dict[str, DialogueRewriteResult] = {}
+                if source_text:
+                    dialogues = embedder.rewrite_dialogue_multi(
+                        source_text=source_text,
+                        target_languages=languages,
+                        tone=tone,
+                        cancel=group,
+                    )
+                extracted: Optional[ExtractResult] = None
+                translated: Optional[TranslateResult] = None
+                if phased:
+                    # One extraction and one translation call serve every language.
+                    extracted, translated = self._extract_and_translate(
+                        embedder, image, languages, tone, group, triage
+                    )
+
+                def run(lang: str) -> PanelResult:
+                    def attempt() -> PanelResult:
+                        if source_text:
+                            return self._embed_dialogue(
+                                embedder, image, mask, dialogues[lang],
+                                bubble_hint, style_hint, group,
+                            )
+                        if phased:
+                            return self._phased_result(
+                                embedder, original, image, mask, extracted, translated, lang,
+                                bubble_hint, style_hint, group,
+                            )
+                        return self._auto_localize(
+                            embedder, original, image, mask, lang, bubble_hint, style_hint,
+                            group, triage,
+                        )
+
+                    try:
+                        return self._verified(
+                            embedder, image, mask, attempt, lang, style_hint, group,
+                            triage, extracted, translated, expect_text=not source_text,
+                        )
+                    except Exception:
+                        group.cancel()
+                        raise
+
+                with ThreadPoolExecutor(
+                    max_workers=len(languages), thread_name_prefix="nyamanga-lang"
+                ) as pool:
+                    futures = {lang: pool.submit(run, lang) for lang in languages}
+                    results: Dict[str, PanelResult] = {}
+                    errors = []
+                    for lang, future in futures.items():
+                        try:
+                            results[lang] = future.result()
+                        except Exception as exc:
+                            errors.append(exc)
+                if errors:
+                    # Prefer the root failure over the sibling cancellations it caused.
+                    raise next((e for e in errors if not isinstance(e, Cancelled)), errors[0])
+                for lang, result in results.items():
+                    self._remember(probe, keys[lang], result, image)
+                return {
+                    lang: reused.get(lang) or results[lang]
+                    for lang in dict.fromkeys(target_languages)
+                }
+            finally:
+                if unlink is not None:
+                    unlink()
+
+    def _extract_and_translate(
+        self,
+        embedder: MangaEmbedder,
+        image: UploadFile,
+        languages: Sequence[str],
+        tone: str,
+        cancel: Optional[CancelToken],
+        triage: Optional[PageTriage],
+    ) -> Tuple[Optional[ExtractResult], Optional[TranslateResult]]:
+        if triage is not None and not triage.has_text:
+            return None, None
+        extracted = embedder.extract_text(image, cancel=cancel)
+        if not extracted.lines:
+            return extracted, None
+        if cancel is not None:
+            cancel.raise_if_cancelled()
+        translated = embedder.translate_lines(
+            [line.text for line in extracted.lines],
+            languages,
+            tone=tone,
+            cache=self.translations,
+            cancel=cancel,
+        )
+        return extracted, translated
+
+    def _phased_result(
+        self,
+        embedder: MangaEmbedder,
+        original: UploadFile,
+        image: UploadFile,
+        mask: Optional[UploadFile],
+        extracted: Optional[ExtractResult],
+        translated: Optional[TranslateResult],
+        target_language: str,
+        bubble_hint: Optional[str],
+        style_hint: Optional[str],
+        cancel: Optional[CancelToken],
+    ) -> PanelResult:
+        if extracted is None or translated is None:
+            # Triage or the extraction found nothing to letter.
+            result = _passthrough(original)
+            if extracted is not None:
+                result.dialogue_response = {"extract": extracted.raw_response}
+            return result
+        texts = translated.texts[target_language]
+        embed = embedder.embed_lines(
+            image_path=image,
+            lines=extracted.lines,
+            translations=texts,
             bubble_hint=bubble_hint,
-            mask_path=mask_path,
+            mask_path=mask,
             style_hint=style_hint,
+            cancel=cancel,
         )
         return PanelResult(
-            rewritten_text="",
+            rewritten_text="\n".join(texts),
             edited_image_b64=embed.image_b64,
-            dialogue_response={},
+            dialogue_response={
+                "extract": extracted.raw_response,
+                "translate": translated.raw_responses,
+                "cached_lines": translated.cached,
+            },
             image_response=embed.raw_response,
         )
 
+    def _verified(
+        self,
+        embedder: MangaEmbedder,
+        image: UploadFile,
+        mask: Optional[UploadFile],
+        attempt: Callable[[], PanelResult],
+        target_language: str,
+        style_hint: Optional[str],
+        cancel: Optional[CancelToken],
+        triage: Optional[PageTriage],
+        extracted: Optional[ExtractResult],
+        translated: Optional[TranslateResult],
+        expect_text: bool,
+    ) -> PanelResult:
+        """
+        Run `attempt` and, with `config.verify`, check its edit locally.
+        Damaged art is restored from the upload and missed balloons are re-run
+        on their own; only a wrongly shaped result repeats the whole edit.
+        """
+        result = attempt()
+        if not self.config.verify or result.skipped:
+            return result
+        regions, region_scale = self._text_regions(image, triage, extracted)
+        retries = max(0, self.config.verify_retries)
+        for round_ in range(retries + 1):
+            with self.tracer.span("verify", round=round_) as trace:
+                check: Verification = self.images.analyze(
+                    verify_edit,
+                    image.data,
+                    result.edited_image_b64,
+                    regions,
+                    mask.data if mask is not None else None,
+                    expect_text,
+                    region_scale,
+                )
+                trace.update(ok=check.ok, damaged=len(check.damaged), missed=len(check.missed))
+            if check.ok or round_ == retries:
+                break
+            if cancel is not None:
+                cancel.raise_if_cancelled()
+            if not check.size_ok:
+                result = attempt()
+                continue
+            patches = [
+                (
+                    box,
+                    self._rerun_region(
+                        embedder, image, mask, box, check.expected_size, target_language,
+                        style_hint, cancel, extracted, translated,
+                    ),
+                )
+                for box in check.missed
+            ]
+            result.edited_image_b64 = self.images.analyze(
+                repair,
+                image.data,
+                result.edited_image_b64,
+                check.cells,
+                patches,
+                check.regions,
+                mask.data if mask is not None else None,
+            )
+        result.verification = check.to_dict()
+        result.flagged = not check.ok
+        return result
+
+    def _text_regions(
+        self,
+        image: UploadFile,
+        triage: Optional[PageTriage],
+        extracted: Optional[ExtractResult],
+    ) -> Tuple[List[Box], Optional[int]]:
+        """Where lettering may change, and the scale its boxes are in."""
+        if extracted is not None and any(line.box for line in extracted.lines):
+            return [line.box for line in extracted.lines if line.box], 1000
+        if triage is not None:
+            return list(triage.text_regions), None
+        try:
+            return self.images.analyze(triage_page, image.data).text_regions, None
+        except Exception:
+            return [], None
+
+    def _rerun_region(
+        self,
+        embedder: MangaEmbedder,
+        image: UploadFile,
+        mask: Optional[UploadFile],
+        box: Box,
+        page_size: Tuple[int, int],
+        target_language: str,
+        style_hint: Optional[str],
+        cancel: Optional[CancelToken],
+        extracted: Optional[ExtractResult],
+        translated: Optional[TranslateResult],
+    ) -> str:
+        """Localize one region of the page again; returns its base64 image."""
+        name = Path(image.name).stem
+        region = UploadFile(f"{name}_region.png", crop(image.data, box))
+        region_mask = None
+        if mask is not None:
+            region_mask = UploadFile(f"{name}_region_mask.png", crop(mask.data, box))
+        with self.tracer.span("rerun_region", box=str(box)):
+            if extracted is not None and translated is not None:
+                picked = [
+                    (TextLine(line.text, line.position), text)
+                    for line, text in zip(extracted.lines, translated.texts[target_language])
+                    if line.box and _inside(line.box, box, page_size)
+                ]
+                if picked:
+                    return embedder.embed_lines(
+                        image_path=region,
+                        lines=[line for line, _ in picked],
+                        translations=[text for _, text in picked],
+                        mask_path=region_mask,
+                        style_hint=style_hint,
+                        cancel=cancel,
+                    ).image_b64
+            return embedder.auto_localize(
+                image_path=region,
+                target_language=target_language,
+                mask_path=region_mask,
+                style_hint=style_hint,
+                cancel=cancel,
+            ).image_b64
+
+    def triage(self, image: UploadFile) -> Optional[PageTriage]:
+        """Local text/panel check per `config.triage`; None when off or undecodable."""
+        if not self.config.triage:
+            return None
+        try:
+            return self.images.analyze(triage_page, image.data, self.config.triage == "panels")
+        except Exception:
+            # Can't analyze it locally; send the whole page as before.
+            return None
+
+    def dedupe_probe(self, image: UploadFile) -> Optional[Tuple[int, Tuple[int, int]]]:
+        """`(hash, size)` to look the upload up in `dedupe`; None without an index."""
+        if self.dedupe is None:
+            return None
+        try:
+            with self.tracer.span("dedupe_hash", "image"):
+                return perceptual_hash(image.data)
+        except Exception:
+            # Undecodable locally; let the API have a go without reuse.
+            return None
+
+    def dedupe_key(self, mask: Optional[UploadFile], *params: Any) -> str:
+        """Key of the parameters a reusable result must have been made with."""
+        # Phased results differ from single-call ones; older keys stay valid.
+        extra = {"auto_mode": "phased"} if self.config.auto_mode == "phased" else {}
+        return params_key(
+            params=params,
+            mask=mask,
+            chat_model=self.config.chat_model,
+            image_model=self.config.image_model,
+            **extra,
+        )
+
+    def _reuse(
+        self, probe: Optional[Tuple[int, Tuple[int, int]]], key: str
+    ) -> Optional[PanelResult]:
+        if probe is None:
+            return None
+        hit = self.dedupe.lookup(probe[0], key)
+        if hit is None:
+            return None
+        entry, _ = hit
+        return PanelResult(
+            rewritten_text=entry.rewritten_text,
+            edited_image_b64=self.dedupe.image_b64(entry, probe[1]),
+            dialogue_response={},
+            image_response={},
+            reused_from=entry.source or f"{entry.phash:016x}",
+        )
+
+    def _remember(
+        self,
+        probe: Optional[Tuple[int, Tuple[int, int]]],
+        key: str,
+        result: PanelResult,
+        image: UploadFile,
+    ) -> None:
+        if probe is None or not result.edited_image_b64:
+            return
+        if result.skipped or result.flagged:
+            # A passed-through page or an edit that failed its check must not
+            # be handed out again as a finished result for look-alike pages.
+            return
+        self.dedupe.add(
+            probe[0], key, probe[1], result.edited_image_b64, result.rewritten_text, image.name
+        )
+
     def close(self) -> None:
+        if self.config.history_path:
+            try:
+                LatencyHistory(self.config.history_path).record(self.client.endpoints)
+            except OSError:
+                pass  # history only feeds estimates; never fail a run over it
         self.client.close()
+        self.images.close()
 
     def __enter__(self) -> "TypesettingPipeline":
         return self
 
     def __exit__(self, exc_type, exc, tb) -> None:
         self.close()
+
+
+def _inside(scaled: Box, box: Box, page_size: Tuple[int, int]) -> bool:
+    """Whether the centre of a 0-1000 scaled box lies in a page-pixel box."""
+    x = (scaled[0] + scaled[2]) / 2000 * page_size[0]
+    y = (scaled[1] + scaled[3]) / 2000 * page_size[1]
+    return box[0] <= x < box[2] and box[1] <= y < box[3]
+
+
+def _passthrough(original: UploadFile) -> PanelResult:
+    """A skipped page: the upload exactly as read, not the downscaled copy."""
+    return PanelResult(
+        rewritten_text="",
+        edited_image_b64=base64.b64encode(original.data).decode("ascii"),
+        dialogue_response={},
+        image_response={},
+        skipped=True,
+    )
+
+
+def splits_panels(triage: Optional[PageTriage]) -> bool:
+    """Whether auto mode sends text panels separately instead of the whole page."""
+    # Splitting only pays off when it leaves a good part of the page out.
+    return (
+        triage is not None
+        and triage.has_text
+        and len(triage.panels) >= 2
+        and triage.text_coverage() <= 0.75
+    )
+
+
+def _source_name(source: ImageSource) -> str:
+    return source.name if isinstance(source, UploadFile) else Path(source).name
@@ -0,0 +1,329 @@
+"""
+Dry-run planning for batch localization (`nyamanga plan`).
+Walks the same jobs `nyamanga worker`/`queue` would run through the same
+local steps (upload preparation, near-duplicate lookup, triage) without
+calling the API, then estimates requests, upload bytes and wall time from
+the latencies recorded by earlier runs (`LatencyHistory`).
+"""
+from dataclasses import asdict, dataclass, field
+import math
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .batch import language_output_path, localized_output_path
+from .client import UploadFile
+from .pipeline import TypesettingPipeline, splits_panels
+from .resilience import LatencyHistory
+from .triage import crop
+
+CHAT = "chat/completions"
+EDIT = "images/edits"
+# Used until a run has recorded real latencies for an endpoint.
+ASSUMED_LATENCY = {CHAT: 8.0, EDIT: 45.0}
+# Chat payloads carry a system prompt on top of the dialogue.
+_CHAT_OVERHEAD = 400
+
+
+@dataclass
+class PagePlan:
+    id: Any
+    image: Optional[str]
+    languages: List[str]
+    requests: Dict[str, int] = field(default_factory=dict)
+    upload_bytes: int = 0
+    reused: List[str] = field(default_factory=list)
+    skipped: bool = False
+    panels: Optional[int] = None
+    outputs: List[str] = field(default_factory=list)
+    existing_outputs: List[str] = field(default_factory=list)
+    # Seconds from start to finish if nothing else were running.
+    critical_s: float = 0.0
+    error: Optional[str] = None
+
+    @property
+    def needs_api(self) -> bool:
+        return any(self.requests.values())
+
+
+@dataclass
+class BatchPlan:
+    pages: List[PagePlan]
+    workers: int
+    max_concurrency: int
+    requests_per_minute: Optional[float]
+    latency: Dict[str, float]
+    assumed: List[str]
+    budget_requests: Optional[int] = None
+
+    @property
+    def requests(self) -> Dict[str, int]:
+        totals: Dict[str, int] = {}
+        for page in self.pages:
+            for endpoint, count in page.requests.items():
+                totals[endpoint] = totals.get(endpoint, 0) + count
+        return totals
+
+    @property
+    def total_requests(self) -> int:
+        return sum(self.requests.values())
+
+    @property
+    def upload_bytes(self) -> int:
+        return sum(page.upload_bytes for page in self.pages)
+
+    @property
+    def estimated_seconds(self) -> float:
+        """
+        The largest of three bounds: request-seconds spread over the usable
+        slots, the rate limit, and the slowest single page.
+        """
+        work = sum(self.latency[e] * n for e, n in self.requests.items())
+        # Each worker runs one page at a time; a page's edits (languages,
+        # panels) are in flight together.
+        busy = [page for page in self.pages if page.needs_api]
+        per_page = sum(max(1, page.requests.get(EDIT, 0)) for page in busy) / max(1, len(busy))
+        slots = max(1.0, min(self.max_concurrency, self.workers * per_page))
+        bounds = [work / slots, max((p.critical_s for p in self.pages), default=0.0)]
+        if self.requests_per_minute:
+            # The limiter starts with a full bucket of one minute's requests.
+            throttled = max(0, self.total_requests - max(1, int(self.requests_per_minute)))
+            bounds.append(throttled * 60.0 / self.requests_per_minute)
+        return max(bounds)
+
+    def warnings(self) -> List[str]:
+        notes = []
+        errors = [page for page in self.pages if page.error]
+        if errors:
+            notes.append(f"{len(errors)} job(s) would fail before any request: {errors[0].error}")
+        existing = sum(len(page.existing_outputs) for page in self.pages)
+        if existing:
+            notes.append(f"{existing} output file(s) already exist and would be overwritten")
+        if self.budget_requests is not None and self.total_requests > self.budget_requests:
+            notes.append(
+                f"{self.total_requests} requests exceed the request budget "
+                f"({self.budget_requests}); the run would stop early"
+            )
+        if self.assumed:
+            notes.append(
+                "No recorded latencies for " + ", ".join(self.assumed) + "; using rough defaults"
+            )
+        return notes
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "jobs": len(self.pages),
+            "needs_api": sum(1 for page in self.pages if page.needs_api),
+            "reused": sum(len(page.reused) for page in self.pages),
+            "skipped": sum(1 for page in self.pages if page.skipped),
+            "failed": sum(1 for page in self.pages if page.error),
+            "requests": self.requests,
+            "upload_bytes": self.upload_bytes,
+            "estimated_seconds": round(self.estimated_seconds, 1),
+            "workers": self.workers,
+            "max_concurrency": self.max_concurrency,
+            "requests_per_minute": self.requests_per_minute,
+            "latency_s": {e: round(v, 3) for e, v in self.latency.items()},
+            "warnings": self.warnings(),
+            "pages": [asdict(page) for page in self.pages],
+        }
+
+    def summary(self) -> str:
+        data = self.to_dict()
+        requests = ", ".join(f"{n} {e}" for e, n in data["requests"].items()) or "none"
+        lines = [
+            f"Jobs: {data['jobs']}  need API: {data['needs_api']}  "
+            f"reused: {data['reused']}  skipped (no text): {data['skipped']}  "
+            f"failing: {data['failed']}",
+            f"Requests: {requests}",
+            f"Upload: {_human_bytes(data['upload_bytes'])}",
+            f"Estimated time: {_human_duration(data['estimated_seconds'])} with "
+            f"{self.workers} worker(s), {self.max_concurrency} concurrent request(s)"
+            + (f", {self.requests_per_minute:g} rpm" if self.requests_per_minute else ""),
+            "Latency used: "
+            + ", ".join(f"{e} {v:.1f}s" for e, v in self.latency.items()),
+        ]
+        lines.extend(f"Warning: {note}" for note in data["warnings"])
+        return "\n".join(lines)
+
+
+class Planner:
+    """
+    Plans jobs in the `nyamanga worker` format against a pipeline's
+    configuration. Near-duplicates within the planned batch count as reused,
+    as they would in a real run once the first copy has finished.
+    """
+
+    def __init__(
+        self,
+        pipeline: TypesettingPipeline,
+        workers: int = 4,
+        output_dir: Optional[Path] = None,
+        history: Optional[LatencyHistory] = None,
+    ):
+        self.pipeline = pipeline
+        self.workers = max(1, workers)
+        self.output_dir = output_dir
+        if history is None and pipeline.config.history_path:
+            history = LatencyHistory(pipeline.config.history_path)
+        self.history = history
+        self._seen: List[Tuple[int, str]] = []
+
+    def plan(self, jobs: Iterable[Dict[str, Any]]) -> BatchPlan:
+        latency, assumed = self._latency()
+        pages = [self.plan_job(job, index, latency) for index, job in enumerate(jobs, start=1)]
+        config = self.pipeline.config
+        return BatchPlan(
+            pages=pages,
+            workers=self.workers,
+            max_concurrency=self.pipeline.scheduler.max_concurrency,
+            requests_per_minute=config.requests_per_minute,
+            latency=latency,
+            assumed=assumed,
+            budget_requests=config.budget_requests,
+        )
+
+    def plan_job(self, job: Dict[str, Any], index: int, latency: Dict[str, float]) -> PagePlan:
+        languages = job.get("target_language") or "zh"
+        if isinstance(languages, str):
+            languages = [lang.strip() for lang in languages.split(",") if lang.strip()]
+        languages = list(dict.fromkeys(languages))
+        page = PagePlan(id=job.get("id", index), image=job.get("image"), languages=languages)
+        try:
+            self._plan(job, page, latency)
+        except Exception as exc:
+            page.error = f"{type(exc).__name__}: {exc}"
+            page.requests = {}
+            page.upload_bytes = 0
+        return page
+
+    def _plan(self, job: Dict[str, Any], page: PagePlan, latency: Dict[str, float]) -> None:
+        job_type = job.get("type", "localize")
+        text = job.get("text")
+        if job_type == "rewrite":
+            page.requests = {CHAT: 1}
+            page.upload_bytes = len(job["text"].encode("utf-8")) + _CHAT_OVERHEAD
+            page.critical_s = latency[CHAT]
+            return
+        if not job.get("image"):
+            raise ValueError(f"{job_type} jobs need an image path")
+
+        image, mask = self.pipeline.images.prepare(
+            Path(job["image"]), Path(job["mask"]) if job.get("mask") else None
+        )
+        upload = len(image.data) + (len(mask.data) if mask is not None else 0)
+        self._outputs(job, page)
+        if job_type == "embed":
+            page.requests = {EDIT: 1}
+            page.upload_bytes = upload + len(job["text"].encode("utf-8"))
+            page.critical_s = latency[EDIT]
+            return
+
+        pending = self._not_reused(job, page, image, mask)
+        if not pending:
+            return
+        if text:
+            page.requests = {CHAT: 1, EDIT: len(pending)}
+            page.upload_bytes = len(text.encode("utf-8")) + _CHAT_OVERHEAD + upload * len(pending)
+            page.critical_s = latency[CHAT] + latency[EDIT]
+            return
+
+        triage = self.pipeline.triage(image)
+        if triage is not None and not triage.has_text:
+            page.skipped = True
+            return
+        if self.pipeline.config.auto_mode == "phased":
+            # Extraction sends the page base64-encoded; translation is text
+            # only and may be answered from the cache, which is not modelled.
+            page.requests = {CHAT: 2, EDIT: len(pending)}
+            page.upload_bytes = (
+                math.ceil(len(image.data) * 4 / 3) + 2 * _CHAT_OVERHEAD + upload * len(pending)
+            )
+            page.critical_s = 2 * latency[CHAT] + latency[EDIT]
+            return
+        if not splits_panels(triage):
+            page.requests = {EDIT: len(pending)}
+            page.upload_bytes = upload * len(pending)
+            page.critical_s = latency[EDIT]
+            return
+        panels = triage.text_panels()
+        page.panels = len(panels)
+        crops = sum(len(crop(image.data, panel.box)) for panel in panels)
+        if mask is not None:
+            crops += sum(len(crop(mask.data, panel.box)) for panel in panels)
+        page.requests = {EDIT: len(panels) * len(pending)}
+        page.upload_bytes = crops * len(pending)
+        # Panels of one page go out four at a time.
+        page.critical_s = math.ceil(len(panels) / 4) * latency[EDIT]
+
+    def _not_reused(
+        self,
+        job: Dict[str, Any],
+        page: PagePlan,
+        image: UploadFile,
+        mask: Optional[UploadFile],
+    ) -> List[str]:
+        probe = self.pipeline.dedupe_probe(image)
+        if probe is None:
+            return list(page.languages)
+        threshold = self.pipeline.dedupe.threshold
+        pending = []
+        for lang in page.languages:
+            key = self.pipeline.dedupe_key(
+                mask,
+                job.get("text"),
+                lang,
+                job.get("tone") or "friendly manga voice",
+                job.get("bubble_hint"),
+                job.get("style_hint"),
+            )
+            stored = self.pipeline.dedupe.lookup(probe[0], key) is not None
+            planned = any(
+                k == key and bin(h ^ probe[0]).count("1") <= threshold for h, k in self._seen
+            )
+            if stored or planned:
+                page.reused.append(lang)
+            else:
+                pending.append(lang)
+                self._seen.append((probe[0], key))
+        return pending
+
+    def _outputs(self, job: Dict[str, Any], page: PagePlan) -> None:
+        image = Path(job["image"])
+        output = Path(job["output"]) if job.get("output") else None
+        if output is None:
+            output = localized_output_path(image, self.output_dir or image.parent)
+        multi = len(page.languages) > 1
+        for lang in page.languages:
+            path = language_output_path(output, lang) if multi else output
+            page.outputs.append(str(path))
+            if path.exists():
+                page.existing_outputs.append(str(path))
+
+    def _latency(self) -> Tuple[Dict[str, float], List[str]]:
+        latency = {}
+        assumed = []
+        for endpoint, default in ASSUMED_LATENCY.items():
+            observed = self.history.quantile(endpoint) if self.history is not None else None
+            if observed is None:
+                assumed.append(endpoint)
+            latency[endpoint] = observed if observed is not None else default
+        return latency, assumed
+
+
+def _human_bytes(size: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def _human_duration(seconds: float) -> str:
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours:
+        return f"{hours}h {minutes:02d}m"
+    if minutes:
+        return f"{minutes}m {secs:02d}s"
+    return f"{secs}s"
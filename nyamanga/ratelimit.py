@@ -0,0 +1,53 @@
+"""
+Token-bucket rate limiting shared by every request a client sends.
+One limiter per provider quota: the job server hands a single client (and so
+a single limiter) to all of its workers.
+"""
+import threading
+import time
+from typing import Optional
+
+from .cancel import CancelToken
+
+
+class RateLimiter:
+    """Allow `rate` requests per `per` seconds with bursts up to `burst`."""
+
+    def __init__(self, rate: float, per: float = 60.0, burst: Optional[int] = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.interval = per / rate
+        self.capacity = float(burst if burst is not None else max(1, int(rate)))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        self._tokens = min(self.capacity, self._tokens + elapsed / self.interval)
+        self._updated = now
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def acquire(self, cancel: Optional[CancelToken] = None) -> None:
+        """Block until a request may be sent, honouring cancellation."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) * self.interval
+            if cancel is not None:
+                cancel.raise_if_cancelled()
+                cancel.wait(wait)
+                cancel.raise_if_cancelled()
+            else:
+                time.sleep(wait)
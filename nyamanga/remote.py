@@ -0,0 +1,182 @@
+"""
+Client for a `nyamanga serve` job server.
+`RemotePipeline` mirrors the parts of `TypesettingPipeline` the UI uses, so a
+desktop instance can hand its work to a shared server instead of calling the
+provider directly.
+"""
+import base64
+from concurrent.futures import Future
+from pathlib import Path
+import time
+from typing import Any, Dict, Optional
+
+import requests
+
+from .cancel import CancelToken, Cancelled, DeadlineExceeded
+from .client import ApiError, ImageSource
+from .embedder import DialogueRewriteResult
+from .imaging import ImageWorkerPool, OutputOptions
+from .pipeline import PanelResult
+from .scheduler import Budget, Priority
+
+_TERMINAL = ("done", "failed", "cancelled")
+
+
+class RemoteEmbedder:
+    """Exposes `rewrite_dialogue` like `MangaEmbedder`, backed by server jobs."""
+
+    def __init__(self, pipeline: "RemotePipeline"):
+        self.pipeline = pipeline
+
+    def rewrite_dialogue(
+        self,
+        source_text: str,
+        target_language: str = "zh",
+        tone: str = "friendly manga voice",
+        cancel: Optional[CancelToken] = None,
+    ) -> DialogueRewriteResult:
+        job = self.pipeline.run_job(
+            {
+                "type": "rewrite",
+                "source_text": source_text,
+                "target_language": target_language,
+                "tone": tone,
+            },
+            cancel=cancel,
+        )
+        result = job.get("result") or {}
+        return DialogueRewriteResult(
+            text=result.get("text", ""), raw_response=result.get("raw_response") or {}
+        )
+
+
+class RemotePipeline:
+    """Submit jobs to a job server and poll until they finish."""
+
+    def __init__(
+        self,
+        server_url: str,
+        poll_interval: float = 0.5,
+        request_timeout: float = 30.0,
+        images: Optional[ImageWorkerPool] = None,
+    ):
+        self.server_url = server_url.rstrip("/")
+        self.poll_interval = poll_interval
+        self.request_timeout = request_timeout
+        self._session = requests.Session()
+        self.embedder = RemoteEmbedder(self)
+        self.images = images or ImageWorkerPool()
+
+    def save_result(
+        self, result: PanelResult, path: Path, options: Optional[OutputOptions] = None
+    ) -> "Future[Path]":
+        return self.images.write(result.edited_image_b64, path, options)
+
+    def submit(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        resp = self._session.post(
+            f"{self.server_url}/jobs", json=payload, timeout=self.request_timeout
+        )
+        return self._handle_response(resp)
+
+    def status(self, job_id: str) -> Dict[str, Any]:
+        resp = self._session.get(f"{self.server_url}/jobs/{job_id}", timeout=self.request_timeout)
+        return self._handle_response(resp)
+
+    def cancel_job(self, job_id: str) -> Dict[str, Any]:
+        resp = self._session.delete(
+            f"{self.server_url}/jobs/{job_id}", timeout=self.request_timeout
+        )
+        return self._handle_response(resp)
+
+    def run_job(self, payload: Dict[str, Any], cancel: Optional[CancelToken] = None) -> Dict[str, Any]:
+        """
+        Submit a job and wait for it. Cancelling the token cancels the job on
+        the server too; the token's deadline is forwarded as the job deadline.
+        """
+        if cancel is not None:
+            cancel.raise_if_cancelled()
+            remaining = cancel.remaining()
+            if remaining is not None:
+                payload = dict(payload, deadline=remaining)
+        job = self.submit(payload)
+        delay = min(0.1, self.poll_interval)
+        while job["status"] not in _TERMINAL:
+            if cancel is not None:
+                cancel.wait(delay)
+                if cancel.cancelled or cancel.expired:
+                    self.cancel_job(job["id"])
+                    cancel.raise_if_cancelled()
+            else:
+                time.sleep(delay)
+            delay = min(delay * 2, self.poll_interval)
+            job = self.status(job["id"])
+
+        if job["status"] == "failed":
+            if job.get("error_type") == "DeadlineExceeded":
+                raise DeadlineExceeded(job.get("error") or "Job deadline exceeded")
+            raise ApiError(job.get("error") or "Job failed")
+        if job["status"] == "cancelled":
+            raise Cancelled(job.get("error") or "Job was cancelled")
+        return job
+
+    def localize_panel(
+        self,
+        image_path: ImageSource,
+        source_text: Optional[str] = None,
+        target_language: str = "zh",
+        tone: str = "friendly manga voice",
+        bubble_hint: Optional[str] = None,
+        mask_path: Optional[ImageSource] = None,
+        style_hint: Optional[str] = None,
+        cancel: Optional[CancelToken] = None,
+        priority: Priority = Priority.INTERACTIVE,
+        budget: Optional[Budget] = None,
+    ) -> PanelResult:
+        image, mask = self.images.prepare(image_path, mask_path)
+        payload: Dict[str, Any] = {
+            "type": "localize",
+            "image_b64": base64.b64encode(image.data).decode("ascii"),
+            "image_name": image.name,
+            "source_text": source_text,
+            "target_language": target_language,
+            "tone": tone,
+            "bubble_hint": bubble_hint,
+            "style_hint": style_hint,
+            "priority": priority.name.lower(),
+        }
+        if budget is not None:
+            payload["budget"] = {"max_requests": budget.max_requests, "max_tokens": budget.max_tokens}
+        if mask is not None:
+            payload["mask_b64"] = base64.b64encode(mask.data).decode("ascii")
+            payload["mask_name"] = mask.name
+        job = self.run_job(payload, cancel=cancel)
+        result = job.get("result") or {}
+        return PanelResult(
+            rewritten_text=result.get("rewritten_text", ""),
+            edited_image_b64=result.get("edited_image_b64", ""),
+            dialogue_response=result.get("dialogue_response") or {},
+            image_response=result.get("image_response") or {},
+            reused_from=result.get("reused_from"),
+            skipped=bool(result.get("skipped")),
+            verification=result.get("verification"),
+            flagged=bool(result.get("flagged")),
+        )
+
+    def close(self) -> None:
+        self._session.close()
+        self.images.close()
+
+    def __enter__(self) -> "RemotePipeline":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def _handle_response(self, resp: requests.Response) -> Dict[str, Any]:
+        if resp.status_code >= 300:
+            try:
+                message = resp.json().get("error", resp.text)
+            except ValueError:
+                message = resp.text
+            raise ApiError(f"{resp.status_code}: {message}")
+        return resp.json()
@@ -0,0 +1,223 @@
+"""
+Per-endpoint adaptive timeouts and circuit breaking for `NyaMangaClient`.
+Chat calls and image edits have very different latencies, so each endpoint
+learns its own timeout from recent successful calls, and an endpoint that
+keeps failing is short-circuited instead of tying workers up on a dead
+upstream. After `reset_after` seconds a single probe is let through; its
+outcome closes the circuit again or re-opens it.
+"""
+from collections import deque
+import json
+import math
+import os
+from pathlib import Path
+import threading
+import time
+from typing import Any, Deque, Dict, List, Mapping, Optional, Union
+
+
+class CircuitOpen(RuntimeError):
+    """Raised without sending anything while an endpoint's circuit is open."""
+
+
+class LatencyTracker:
+    """
+    Rolling window of observed latencies. Until `min_samples` calls have been
+    seen the configured default is used; afterwards the timeout is
+    `percentile` latency times `multiplier`, clamped to `[floor, ceiling]`.
+    """
+
+    def __init__(
+        self,
+        window: int = 100,
+        percentile: float = 0.95,
+        multiplier: float = 3.0,
+        min_samples: int = 10,
+        floor: float = 5.0,
+    ):
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.min_samples = min_samples
+        self.floor = floor
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def samples(self) -> List[float]:
+        with self._lock:
+            return list(self._samples)
+
+    def quantile(self) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, math.ceil(self.percentile * len(ordered)) - 1)
+        return ordered[max(0, index)]
+
+    def timeout(self, ceiling: float) -> float:
+        """Timeout for the next call; never above the configured `ceiling`."""
+        observed = self.quantile()
+        if observed is None:
+            return ceiling
+        return min(ceiling, max(self.floor, observed * self.multiplier))
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after `failure_threshold` consecutive failures; open ->
+    half-open after `reset_after` seconds, admitting one probe at a time.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_after: float = 30.0):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_after = reset_after
+        self.failures = 0
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def before_call(self, name: str = "endpoint") -> bool:
+        """
+        Admit a call or raise CircuitOpen; in half-open only one probe runs.
+        Returns True if this call is that probe; pass it back to
+        `record_failure`/`release` when the call ends.
+        """
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            if state == self.CLOSED:
+                return False
+            if state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            if state == self.HALF_OPEN:
+                raise CircuitOpen(
+                    f"{name} is failing ({self.failures} consecutive errors); "
+                    "a probe request is in progress"
+                )
+            retry_in = max(0.0, self._opened_at + self.reset_after - now)
+            raise CircuitOpen(
+                f"{name} is failing ({self.failures} consecutive errors); "
+                f"retrying in {math.ceil(retry_in)}s"
+            )
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self._state = self.CLOSED
+            self._probing = False
+
+    def record_failure(self, probe: bool = False) -> None:
+        with self._lock:
+            self.failures += 1
+            if probe or self.failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+            if probe:
+                self._probing = False
+
+    def release(self, probe: bool = False) -> None:
+        """
+        The admitted call ended without a verdict (e.g. it was cancelled).
+        Only the probe itself frees the half-open slot for another probe.
+        """
+        if probe:
+            with self._lock:
+                self._probing = False
+
+    def _current_state(self, now: float) -> str:
+        # Caller holds self._lock.
+        if self._state == self.OPEN and now - self._opened_at >= self.reset_after:
+            self._state = self.HALF_OPEN
+        return self._state
+
+
+class EndpointGuard:
+    """Latency tracker plus circuit breaker for one API endpoint."""
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        reset_after: float = 30.0,
+        adaptive: bool = True,
+    ):
+        self.name = name
+        self.adaptive = adaptive
+        self.latency = LatencyTracker()
+        self.breaker = CircuitBreaker(failure_threshold, reset_after)
+
+    def timeout(self, ceiling: float) -> float:
+        return self.latency.timeout(ceiling) if self.adaptive else ceiling
+
+    def stats(self) -> Dict[str, Any]:
+        observed = self.latency.quantile()
+        return {
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "p95_s": round(observed, 3) if observed is not None else None,
+        }
+
+
+class LatencyHistory:
+    """
+    Per-endpoint latencies persisted across runs (a small JSON file), so
+    `nyamanga plan` can estimate how long a batch will take before it runs.
+    Each save merges into what is on disk and keeps the newest `keep` samples.
+    """
+
+    def __init__(self, path: Union[str, Path], keep: int = 500):
+        self.path = Path(path)
+        self.keep = keep
+        self.samples: Dict[str, List[float]] = self._read()
+
+    def add(self, endpoint: str, samples: List[float]) -> None:
+        merged = self.samples.setdefault(endpoint, []) + list(samples)
+        self.samples[endpoint] = merged[-self.keep :]
+
+    def record(self, guards: Mapping[str, EndpointGuard]) -> None:
+        """Merge the samples a client observed and write the file."""
+        observed = {name: guard.latency.samples() for name, guard in guards.items()}
+        if not any(observed.values()):
+            return
+        self.samples = self._read()
+        for name, samples in observed.items():
+            if samples:
+                self.add(name, samples)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(self.samples), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+    def quantile(self, endpoint: str, q: float = 0.5) -> Optional[float]:
+        ordered = sorted(self.samples.get(endpoint) or [])
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+    def _read(self) -> Dict[str, List[float]]:
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(data, dict):
+            return {}
+        return {
+            str(name): [float(x) for x in values if isinstance(x, (int, float))]
+            for name, values in data.items()
+            if isinstance(values, list)
+        }
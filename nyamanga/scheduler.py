@@ -0,0 +1,289 @@
+"""
+Priority- and budget-aware admission between the pipeline and the client.
+Every API call takes a slot from a `Scheduler`: interactive calls jump ahead
+of queued batch calls, and batch work is throttled and then refused as the
+global budget (requests and `usage` tokens) runs low.
+"""
+from contextlib import contextmanager
+from dataclasses import dataclass
+from enum import IntEnum
+import heapq
+import itertools
+import threading
+from typing import Any, Dict, Iterator, List, Optional
+
+from .cancel import CancelToken
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    BATCH = 1
+
+
+class BudgetExceeded(RuntimeError):
+    """Raised when a job or the global budget has no requests/tokens left."""
+
+
+@dataclass
+class Budget:
+    """Spend limits; `None` means unlimited. `requests`/`tokens` track usage."""
+
+    max_requests: Optional[int] = None
+    max_tokens: Optional[int] = None
+    requests: int = 0
+    tokens: int = 0
+
+    @property
+    def limited(self) -> bool:
+        return self.max_requests is not None or self.max_tokens is not None
+
+    def remaining_fraction(self) -> float:
+        """Smallest remaining share across the configured limits (1.0 if unlimited)."""
+        fractions = [1.0]
+        if self.max_requests:
+            fractions.append(1 - self.requests / self.max_requests)
+        if self.max_tokens:
+            fractions.append(1 - self.tokens / self.max_tokens)
+        return max(0.0, min(fractions))
+
+    @property
+    def exhausted(self) -> bool:
+        if self.max_requests is not None and self.requests >= self.max_requests:
+            return True
+        return self.max_tokens is not None and self.tokens >= self.max_tokens
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "max_requests": self.max_requests,
+            "max_tokens": self.max_tokens,
+            "requests": self.requests,
+            "tokens": self.tokens,
+        }
+
+
+def usage_tokens(resp: Dict[str, Any]) -> int:
+    """Total tokens reported in an OpenAI-style `usage` block (0 if absent)."""
+    usage = resp.get("usage") if isinstance(resp, dict) else None
+    if not isinstance(usage, dict):
+        return 0
+    total = usage.get("total_tokens")
+    if total is None:
+        total = (usage.get("prompt_tokens") or usage.get("input_tokens") or 0) + (
+            usage.get("completion_tokens") or usage.get("output_tokens") or 0
+        )
+    return int(total or 0)
+
+
+@dataclass(eq=False)
+class _Waiter:
+    priority: Priority
+    seq: int
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class Scheduler:
+    """
+    Hands out up to `max_concurrency` request slots in priority order.
+    Once the global budget's remaining share drops below `throttle_below`,
+    batch work may use proportionally fewer slots; below `pause_below` batch
+    calls fail with BudgetExceeded (interactive work continues until the
+    budget is spent).
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        budget: Optional[Budget] = None,
+        throttle_below: float = 0.5,
+        pause_below: float = 0.1,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.budget = budget or Budget()
+        self.throttle_below = throttle_below
+        self.pause_below = pause_below
+        self._cond = threading.Condition()
+        self._waiting: List[_Waiter] = []
+        self._active = {Priority.INTERACTIVE: 0, Priority.BATCH: 0}
+        self._batch_paused = False
+        self._seq = itertools.count()
+
+    def batch_limit(self) -> int:
+        """Slots batch work may hold right now given the budget and pauses."""
+        if self._batch_paused or self._batch_reserve_reached():
+            return 0
+        if not self.budget.limited:
+            return self.max_concurrency
+        left = self.budget.remaining_fraction()
+        if left >= self.throttle_below:
+            return self.max_concurrency
+        share = (left - self.pause_below) / (self.throttle_below - self.pause_below)
+        return max(1, int(self.max_concurrency * share))
+
+    def pause_batch(self) -> None:
+        """
+        Stop admitting batch calls; running ones finish normally and waiting
+        ones block until `resume_batch` or their cancel token fires.
+        """
+        with self._cond:
+            self._batch_paused = True
+
+    def resume_batch(self) -> None:
+        with self._cond:
+            self._batch_paused = False
+            self._cond.notify_all()
+
+    def set_budget(self, budget: Budget) -> None:
+        with self._cond:
+            self.budget = budget
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(
+        self,
+        priority: Priority = Priority.INTERACTIVE,
+        budget: Optional[Budget] = None,
+        cancel: Optional[CancelToken] = None,
+    ) -> Iterator[None]:
+        """Hold one request slot for the duration of the block."""
+        self.acquire(priority, budget, cancel)
+        try:
+            yield
+        finally:
+            self.release(priority)
+
+    def acquire(
+        self,
+        priority: Priority = Priority.INTERACTIVE,
+        budget: Optional[Budget] = None,
+        cancel: Optional[CancelToken] = None,
+    ) -> None:
+        """
+        Block until a slot is free for `priority`, then charge one request to
+        the global and job budgets. Raises BudgetExceeded or Cancelled.
+        """
+        waiter = _Waiter(priority=priority, seq=next(self._seq))
+        unregister = None
+        if cancel is not None:
+            unregister = cancel.add_callback(self._wake)
+        try:
+            with self._cond:
+                heapq.heappush(self._waiting, waiter)
+                try:
+                    while True:
+                        if budget is not None and budget.exhausted:
+                            raise BudgetExceeded("Job budget exhausted")
+                        if self.budget.exhausted:
+                            raise BudgetExceeded("Global budget exhausted")
+                        if priority == Priority.BATCH and self._batch_reserve_reached():
+                            # Only a budget top-up could admit it; fail rather than hang.
+                            raise BudgetExceeded(
+                                "Global budget is down to the share kept for interactive work"
+                            )
+                        if cancel is not None:
+                            cancel.raise_if_cancelled()
+                        if self._can_admit(waiter):
+                            break
+                        timeout = cancel.remaining() if cancel is not None else None
+                        self._cond.wait(timeout)
+                finally:
+                    self._waiting.remove(waiter)
+                    heapq.heapify(self._waiting)
+                    self._cond.notify_all()
+                self._active[priority] += 1
+                self.budget.requests += 1
+                if budget is not None:
+                    budget.requests += 1
+        finally:
+            if unregister is not None:
+                unregister()
+
+    def release(self, priority: Priority) -> None:
+        with self._cond:
+            self._active[priority] -= 1
+            self._cond.notify_all()
+
+    def record(self, resp: Dict[str, Any], budget: Optional[Budget] = None) -> None:
+        """Charge the `usage` tokens of a response to the budgets."""
+        tokens = usage_tokens(resp)
+        if not tokens:
+            return
+        with self._cond:
+            self.budget.tokens += tokens
+            if budget is not None:
+                budget.tokens += tokens
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "max_concurrency": self.max_concurrency,
+                "active": {p.name.lower(): n for p, n in self._active.items()},
+                "waiting": {
+                    p.name.lower(): sum(1 for w in self._waiting if w.priority == p)
+                    for p in Priority
+                },
+                "batch_limit": self.batch_limit(),
+                "budget": self.budget.to_dict(),
+            }
+
+    def _can_admit(self, waiter: _Waiter) -> bool:
+        # Caller holds self._cond.
+        if sum(self._active.values()) >= self.max_concurrency:
+            return False
+        if waiter.priority == Priority.BATCH and self._active[Priority.BATCH] >= self.batch_limit():
+            return False
+        # Strict queue order: interactive waiters sort ahead of every batch
+        # waiter, so they overtake queued batch calls.
+        return self._waiting[0] is waiter
+
+    def _batch_reserve_reached(self) -> bool:
+        return self.budget.limited and self.budget.remaining_fraction() < self.pause_below
+
+    def _wake(self) -> None:
+        with self._cond:
+            self._cond.notify_all()
+
+
+class ScheduledClient:
+    """
+    Stand-in for `NyaMangaClient` that routes each call through a scheduler
+    slot with a fixed priority and optional per-job budget.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        scheduler: Scheduler,
+        priority: Priority = Priority.INTERACTIVE,
+        budget: Optional[Budget] = None,
+    ):
+        self.client = client
+        self.config = client.config
+        self.scheduler = scheduler
+        self.priority = priority
+        self.budget = budget
+
+    def chat_completion(self, messages: Any, cancel: Optional[CancelToken] = None, **kwargs: Any) -> Dict[str, Any]:
+        return self._call(self.client.chat_completion, cancel, messages, **kwargs)
+
+    def edit_image(self, image_path: Any, prompt: str, cancel: Optional[CancelToken] = None, **kwargs: Any) -> Dict[str, Any]:
+        return self._call(self.client.edit_image, cancel, image_path, prompt, **kwargs)
+
+    def generate_image(self, prompt: str, cancel: Optional[CancelToken] = None, **kwargs: Any) -> Dict[str, Any]:
+        return self._call(self.client.generate_image, cancel, prompt, **kwargs)
+
+    @property
+    def tracer(self) -> Any:
+        return self.client.tracer
+
+    def _call(self, method: Any, cancel: Optional[CancelToken], *args: Any, **kwargs: Any) -> Dict[str, Any]:
+        with self.tracer.span("scheduler_wait", "client", priority=self.priority.name):
+            self.scheduler.acquire(self.priority, self.budget, cancel)
+        try:
+            resp = method(*args, cancel=cancel, **kwargs)
+        finally:
+            self.scheduler.release(self.priority)
+        self.scheduler.record(resp, self.budget)
+        return resp
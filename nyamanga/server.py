@@ -0,0 +1,485 @@
+"""
+Local job server behind `nyamanga serve`.
+Translators submit localize/rewrite jobs over HTTP and poll or stream their
+status; every job runs on one shared worker pool, client session, rate
+limiter and result cache so the provider quota is pooled.
+
+Endpoints (JSON bodies and replies):
+- POST   /jobs              submit a job, replies 202 with the job record
+- GET    /jobs/<id>         job record, including the result once done
+- GET    /jobs/<id>/events  newline-delimited job records until it finishes
+- DELETE /jobs/<id>         cancel a job
+- GET    /health            worker count, job counts, scheduler and endpoint state
+
+Jobs may set `priority` ("interactive" or "batch") and a per-job `budget`
+(`max_requests`/`max_tokens`). Images are sent as `image_b64`/`mask_b64`;
+`image_path`/`mask_path` are refused unless the server was started with an
+`upload_root`, and then only files inside it are read.
+"""
+import base64
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import hashlib
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from math import inf
+from pathlib import Path
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple, Union
+import uuid
+
+from .batch import ItemStatus
+from .cancel import CancelToken
+from .client import UploadFile
+from .config import ApiConfig
+from .pipeline import TypesettingPipeline
+from .scheduler import Budget, Priority
+
+JOB_TYPES = ("localize", "rewrite")
+TERMINAL_STATUSES = (ItemStatus.DONE, ItemStatus.FAILED, ItemStatus.CANCELLED)
+MAX_BODY_BYTES = 64 * 1024 * 1024
+
+_LOCALIZE_FIELDS = ("source_text", "target_language", "tone", "bubble_hint", "style_hint")
+_REWRITE_FIELDS = ("source_text", "target_language", "tone")
+
+
+@dataclass(eq=False)
+class Job:
+    id: str
+    type: str
+    params: Dict[str, Any]
+    image: Optional[UploadFile] = None
+    mask: Optional[UploadFile] = None
+    deadline: Optional[float] = None
+    priority: Priority = Priority.INTERACTIVE
+    budget: Optional[Budget] = None
+    key: str = ""
+    status: ItemStatus = ItemStatus.QUEUED
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    error_type: Optional[str] = None
+    cached: bool = False
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    version: int = 0
+    _token: Optional[CancelToken] = field(default=None, repr=False)
+
+    def to_dict(self, include_result: bool = True) -> Dict[str, Any]:
+        record: Dict[str, Any] = {
+            "id": self.id,
+            "type": self.type,
+            "status": self.status.value,
+            "priority": self.priority.name.lower(),
+            "cached": self.cached,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "error_type": self.error_type,
+        }
+        if self.budget is not None:
+            record["budget"] = self.budget.to_dict()
+        if include_result and self.result is not None:
+            record["result"] = self.result
+        return record
+
+    def cache_key(self) -> str:
+        digest = hashlib.sha256()
+        digest.update(self.type.encode())
+        digest.update(json.dumps(self.params, sort_keys=True).encode())
+        for upload in (self.image, self.mask):
+            digest.update(b"\0")
+            if upload is not None:
+                digest.update(upload.data)
+        return digest.hexdigest()
+
+
+class JobManager:
+    """
+    Owns the job table, the shared worker pool and the result cache.
+    Status changes bump `Job.version` and wake event-stream readers.
+    """
+
+    def __init__(
+        self,
+        pipeline: TypesettingPipeline,
+        workers: int = 4,
+        cache_size: int = 256,
+        max_finished: int = 1000,
+        upload_root: Optional[Union[str, Path]] = None,
+    ):
+        self.pipeline = pipeline
+        self.workers = max(1, workers)
+        self.cache_size = cache_size
+        self.max_finished = max_finished
+        # Only directory `image_path`/`mask_path` may point into; None refuses paths.
+        self.upload_root = Path(upload_root).resolve() if upload_root is not None else None
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._changed = threading.Condition()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="nyamanga-job"
+        )
+
+    def submit(self, payload: Dict[str, Any]) -> Job:
+        """Validate a job payload and queue it; raises ValueError on bad input."""
+        job = _job_from_payload(payload, self.upload_root)
+        job.key = job.cache_key()
+        cached = self._cache_get(job.key)
+        with self._changed:
+            self._jobs[job.id] = job
+            if cached is not None:
+                job.result = cached
+                job.cached = True
+                job.status = ItemStatus.DONE
+                job.finished_at = time.time()
+            self._prune()
+        if cached is None:
+            self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._changed:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is None or job.status in TERMINAL_STATUSES:
+                return False
+            if job._token is not None:
+                job._token.cancel()
+            self._finish(job, ItemStatus.CANCELLED, error="Job was cancelled", error_type="Cancelled")
+        return True
+
+    def wait_for_change(self, job: Job, version: int, timeout: float) -> int:
+        """Block until `job.version` moves past `version` or `timeout` passes."""
+        with self._changed:
+            self._changed.wait_for(lambda: job.version != version, timeout)
+            return job.version
+
+    def counts(self) -> Dict[str, int]:
+        with self._changed:
+            counts = {status.value: 0 for status in ItemStatus}
+            for job in self._jobs.values():
+                counts[job.status.value] += 1
+            return counts
+
+    def shutdown(self) -> None:
+        with self._changed:
+            pending = [job.id for job in self._jobs.values() if job.status not in TERMINAL_STATUSES]
+        for job_id in pending:
+            self.cancel(job_id)
+        self._executor.shutdown(wait=False)
+
+    def _run(self, job: Job) -> None:
+        with self._changed:
+            if job.status != ItemStatus.QUEUED:
+                return
+            job._token = token = CancelToken(deadline=job.deadline)
+            job.status = ItemStatus.RUNNING
+            job.started_at = time.time()
+            self._touch(job)
+
+        try:
+            result = self._execute(job, token)
+        except Exception as exc:
+            with self._changed:
+                if job.status == ItemStatus.RUNNING:
+                    self._finish(job, ItemStatus.FAILED, error=str(exc), error_type=type(exc).__name__)
+            return
+
+        self._cache_put(job.key, result)
+        with self._changed:
+            if job.status == ItemStatus.RUNNING:
+                job.result = result
+                self._finish(job, ItemStatus.DONE)
+
+    def _execute(self, job: Job, token: CancelToken) -> Dict[str, Any]:
+        if job.type == "rewrite":
+            embedder = self.pipeline.embedder_for(job.priority, job.budget)
+            dialogue = embedder.rewrite_dialogue(cancel=token, **job.params)
+            return {"text": dialogue.text, "raw_response": dialogue.raw_response}
+
+        panel = self.pipeline.localize_panel(
+            image_path=job.image,
+            mask_path=job.mask,
+            cancel=token,
+            priority=job.priority,
+            budget=job.budget,
+            **job.params,
+        )
+        return {
+            "rewritten_text": panel.rewritten_text,
+            "edited_image_b64": panel.edited_image_b64,
+            "dialogue_response": panel.dialogue_response,
+            # The image payload is already in edited_image_b64.
+            "image_response": {k: v for k, v in panel.image_response.items() if k != "data"},
+            "reused_from": panel.reused_from,
+            "skipped": panel.skipped,
+            "verification": panel.verification,
+            "flagged": panel.flagged,
+        }
+
+    def _finish(
+        self,
+        job: Job,
+        status: ItemStatus,
+        error: Optional[str] = None,
+        error_type: Optional[str] = None,
+    ) -> None:
+        # Caller holds self._changed.
+        job.status = status
+        job.error = error
+        job.error_type = error_type
+        job.finished_at = time.time()
+        job.image = job.mask = None
+        self._touch(job)
+
+    def _touch(self, job: Job) -> None:
+        job.version += 1
+        self._changed.notify_all()
+
+    def _prune(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in TERMINAL_STATUSES]
+        for job_id in finished[: max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
+    def _cache_get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._changed:
+            if key not in self._cache:
+                return None
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+    def _cache_put(self, key: str, result: Dict[str, Any]) -> None:
+        if self.cache_size <= 0:
+            return
+        with self._changed:
+            self._cache[key] = result
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+
+def _decode_upload(
+    payload: Dict[str, Any], prefix: str, upload_root: Optional[Path] = None
+) -> Optional[UploadFile]:
+    b64 = payload.get(f"{prefix}_b64")
+    if b64:
+        try:
+            data = base64.b64decode(b64, validate=True)
+        except ValueError as exc:
+            raise ValueError(f"{prefix}_b64 is not valid base64") from exc
+        return UploadFile(name=payload.get(f"{prefix}_name") or f"{prefix}.png", data=data)
+    path = payload.get(f"{prefix}_path")
+    if path:
+        if upload_root is None:
+            raise ValueError(f"{prefix}_path is not accepted by this server; send {prefix}_b64")
+        resolved = (upload_root / str(path)).resolve()
+        if not resolved.is_relative_to(upload_root):
+            raise ValueError(f"{prefix}_path must be inside the server's upload root")
+        try:
+            return UploadFile.from_path(resolved)
+        except OSError as exc:
+            raise ValueError(f"Cannot read {prefix}_path: {exc.strerror}") from exc
+    return None
+
+
+def _limit(budget: Dict[str, Any], name: str) -> Optional[int]:
+    value = budget.get(name)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 <= value < inf:
+        raise ValueError(f"budget.{name} must be a non-negative number")
+    return int(value)
+
+
+def _job_from_payload(payload: Dict[str, Any], upload_root: Optional[Path] = None) -> Job:
+    job_type = payload.get("type", "localize")
+    if job_type not in JOB_TYPES:
+        raise ValueError(f"Unknown job type {job_type!r}; expected one of {JOB_TYPES}")
+    fields = _LOCALIZE_FIELDS if job_type == "localize" else _REWRITE_FIELDS
+    params = {name: payload[name] for name in fields if payload.get(name) is not None}
+    for name, value in params.items():
+        if not isinstance(value, str):
+            raise ValueError(f"{name} must be a string")
+
+    deadline = None
+    if payload.get("deadline") is not None:
+        seconds = payload["deadline"]
+        numeric = isinstance(seconds, (int, float)) and not isinstance(seconds, bool)
+        if not numeric or not 0 < seconds < inf:
+            raise ValueError("deadline must be a positive number of seconds")
+        deadline = time.monotonic() + seconds
+
+    priority_name = str(payload.get("priority") or "interactive").upper()
+    if priority_name not in Priority.__members__:
+        raise ValueError(f"Unknown priority {payload.get('priority')!r}")
+    budget = None
+    if payload.get("budget") is not None:
+        if not isinstance(payload["budget"], dict):
+            raise ValueError("budget must be an object with max_requests/max_tokens")
+        budget = Budget(
+            max_requests=_limit(payload["budget"], "max_requests"),
+            max_tokens=_limit(payload["budget"], "max_tokens"),
+        )
+
+    job = Job(
+        id=uuid.uuid4().hex,
+        type=job_type,
+        params=params,
+        deadline=deadline,
+        priority=Priority[priority_name],
+        budget=budget,
+    )
+    if job_type == "rewrite":
+        if not params.get("source_text"):
+            raise ValueError("rewrite jobs need source_text")
+        return job
+    job.image = _decode_upload(payload, "image", upload_root)
+    if job.image is None:
+        raise ValueError("localize jobs need image_b64")
+    job.mask = _decode_upload(payload, "mask", upload_root)
+    return job
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    server_version = "NyaManga"
+    manager: JobManager  # set on the subclass built by make_server
+
+    def do_GET(self) -> None:
+        parts = self._path_parts()
+        if parts == ["health"]:
+            self._send_json(
+                HTTPStatus.OK,
+                {
+                    "status": "ok",
+                    "workers": self.manager.workers,
+                    "jobs": self.manager.counts(),
+                    "scheduler": self.manager.pipeline.scheduler.stats(),
+                    "endpoints": self.manager.pipeline.client.endpoint_stats(),
+                },
+            )
+            return
+        job, rest = self._lookup(parts)
+        if job is None:
+            return
+        if rest == []:
+            self._send_json(HTTPStatus.OK, job.to_dict())
+        elif rest == ["events"]:
+            self._stream_events(job)
+        else:
+            self._send_error(HTTPStatus.NOT_FOUND, "Unknown endpoint")
+
+    def do_POST(self) -> None:
+        if self._path_parts() != ["jobs"]:
+            self._send_error(HTTPStatus.NOT_FOUND, "Unknown endpoint")
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0 or length > MAX_BODY_BYTES:
+            self._send_error(HTTPStatus.BAD_REQUEST, "Missing or oversized request body")
+            return
+        try:
+            payload = json.loads(self.rfile.read(length))
+            if not isinstance(payload, dict):
+                raise ValueError("Job payload must be a JSON object")
+            job = self.manager.submit(payload)
+        except (ValueError, TypeError) as exc:
+            self._send_error(HTTPStatus.BAD_REQUEST, str(exc))
+            return
+        self._send_json(HTTPStatus.ACCEPTED, job.to_dict())
+
+    def do_DELETE(self) -> None:
+        job, rest = self._lookup(self._path_parts())
+        if job is None:
+            return
+        if rest:
+            self._send_error(HTTPStatus.NOT_FOUND, "Unknown endpoint")
+            return
+        self.manager.cancel(job.id)
+        self._send_json(HTTPStatus.OK, job.to_dict(include_result=False))
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # Keep the console quiet; job progress is visible through the API.
+        pass
+
+    def _path_parts(self) -> list:
+        path = self.path.split("?", 1)[0]
+        return [part for part in path.split("/") if part]
+
+    def _lookup(self, parts: list) -> Tuple[Optional[Job], list]:
+        if len(parts) < 2 or parts[0] != "jobs":
+            self._send_error(HTTPStatus.NOT_FOUND, "Unknown endpoint")
+            return None, []
+        job = self.manager.get(parts[1])
+        if job is None:
+            self._send_error(HTTPStatus.NOT_FOUND, f"No job {parts[1]}")
+            return None, []
+        return job, parts[2:]
+
+    def _stream_events(self, job: Job) -> None:
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        version = -1
+        try:
+            while True:
+                if job.version != version:
+                    version = job.version
+                    terminal = job.status in TERMINAL_STATUSES
+                    line = json.dumps(job.to_dict(include_result=terminal)) + "\n"
+                    self.wfile.write(line.encode("utf-8"))
+                    self.wfile.flush()
+                    if terminal:
+                        return
+                self.manager.wait_for_change(job, version, timeout=15.0)
+        except (BrokenPipeError, ConnectionResetError):
+            return
+
+    def _send_json(self, status: HTTPStatus, body: Dict[str, Any]) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status: HTTPStatus, message: str) -> None:
+        self._send_json(status, {"error": message})
+
+
+def make_server(manager: JobManager, host: str = "127.0.0.1", port: int = 8765) -> ThreadingHTTPServer:
+    handler = type("BoundJobRequestHandler", (JobRequestHandler,), {"manager": manager})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def serve(
+    config: ApiConfig,
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    workers: int = 4,
+    cache_size: int = 256,
+    upload_root: Optional[Union[str, Path]] = None,
+) -> None:
+    """Run the job server until interrupted."""
+    with TypesettingPipeline(config) as pipeline:
+        manager = JobManager(
+            pipeline, workers=workers, cache_size=cache_size, upload_root=upload_root
+        )
+        server = make_server(manager, host, port)
+        print(f"NyaManga job server listening on http://{host}:{server.server_port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            manager.shutdown()
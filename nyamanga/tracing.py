@@ -0,0 +1,163 @@
+"""
+Timeline tracing of pipeline runs in Chrome trace-event format.
+Spans are recorded per thread around client phases (rate limit, scheduler
+wait, send, download, parse) and pipeline phases (prepare, triage, rewrite,
+prompt, edit, reassemble, save), so a chapter's run can be opened in
+Perfetto (ui.perfetto.dev) or chrome://tracing to see which stage dominates
+and whether stages overlap. A disabled tracer records nothing.
+"""
+from contextlib import contextmanager
+import itertools
+import json
+import os
+from pathlib import Path
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+
+class Tracer:
+    """
+    Collects complete ("X") events per thread plus async ("b"/"e") events for
+    work handed to other processes. `enabled` can be flipped at runtime; at
+    most `max_events` are kept so a forgotten tracer can't grow unbounded.
+    """
+
+    def __init__(self, enabled: bool = True, max_events: int = 1_000_000):
+        self.enabled = enabled
+        self.max_events = max_events
+        self._origin = time.perf_counter()
+        self._events: List[Dict[str, Any]] = []
+        self._threads: Dict[int, str] = {}
+        self._ids = itertools.count(1)
+        # OS thread idents are reused once a thread exits, so every thread
+        # gets its own lane number instead.
+        self._lanes = itertools.count(1)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    @property
+    def count(self) -> int:
+        """Events recorded so far (not counting thread-name metadata)."""
+        return len(self._events)
+
+    def now(self) -> float:
+        return time.perf_counter()
+
+    @contextmanager
+    def span(self, name: str, cat: str = "pipeline", **args: Any) -> Iterator[Dict[str, Any]]:
+        """
+        Record the enclosed block. The yielded dict becomes the event's args,
+        so the block can add details (bytes, status) as they become known.
+        """
+        if not self.enabled:
+            yield args
+            return
+        start = time.perf_counter()
+        try:
+            yield args
+        except BaseException as exc:
+            args["error"] = type(exc).__name__
+            raise
+        finally:
+            self.record(name, cat, start, time.perf_counter(), args)
+
+    def record(
+        self,
+        name: str,
+        cat: str,
+        start: float,
+        end: float,
+        args: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """Add a complete event on the current thread (`perf_counter` times)."""
+        if not self.enabled:
+            return
+        lane = self._lane()
+        event = {
+            "name": name,
+            "cat": cat,
+            "ph": "X",
+            "ts": self._micros(start),
+            "dur": max(0.0, round((end - start) * 1e6, 1)),
+            "pid": os.getpid(),
+            "tid": lane,
+            "args": _jsonable(args or {}),
+        }
+        self._append([event])
+
+    def record_async(
+        self,
+        name: str,
+        cat: str,
+        start: float,
+        end: float,
+        args: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """Add an async span for work that ran elsewhere (e.g. the image pool)."""
+        if not self.enabled:
+            return
+        common = {"name": name, "cat": cat, "id": next(self._ids), "pid": os.getpid()}
+        begin = {**common, "ph": "b", "ts": self._micros(start), "args": _jsonable(args or {})}
+        finish = {**common, "ph": "e", "ts": self._micros(end)}
+        self._append([begin, finish])
+
+    def events(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            events = list(self._events)
+            threads = dict(self._threads)
+        pid = os.getpid()
+        meta = [
+            {"name": "process_name", "ph": "M", "pid": pid, "args": {"name": "nyamanga"}},
+            *(
+                {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                for tid, name in threads.items()
+            ),
+        ]
+        return meta + events
+
+    def to_chrome(self) -> Dict[str, Any]:
+        return {
+            "traceEvents": self.events(),
+            "displayTimeUnit": "ms",
+            "otherData": {"dropped_events": self.dropped},
+        }
+
+    def export(self, path: Path) -> Path:
+        """Write the trace as Chrome/Perfetto JSON; returns the path."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.to_chrome()), encoding="utf-8")
+        return path
+
+    def clear(self) -> None:
+        with self._lock:
+            self._events.clear()
+            self._origin = time.perf_counter()
+            self.dropped = 0
+
+    def _micros(self, t: float) -> float:
+        return round((t - self._origin) * 1e6, 1)
+
+    def _lane(self) -> int:
+        lane = getattr(self._local, "lane", None)
+        if lane is None:
+            lane = self._local.lane = next(self._lanes)
+            with self._lock:
+                self._threads[lane] = threading.current_thread().name
+        return lane
+
+    def _append(self, events: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            if len(self._events) + len(events) > self.max_events:
+                self.dropped += len(events)
+                return
+            self._events.extend(events)
+
+
+def _jsonable(args: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        key: value if isinstance(value, (str, int, float, bool, type(None))) else str(value)
+        for key, value in args.items()
+    }
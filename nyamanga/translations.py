@@ -0,0 +1,78 @@
+"""
+Translation cache for the phased auto mode.
+Lines are keyed by source text, target language, tone and chat model, so a
+recurring line ("...!", a character's catchphrase, a sound effect) or a
+re-typeset page never needs the chat model again. With a `path` the cache
+persists as an append-only JSON-lines file.
+"""
+from collections import OrderedDict
+import hashlib
+import json
+from pathlib import Path
+import threading
+from typing import Dict, Optional, Union
+
+
+def translation_key(text: str, language: str, tone: str, model: str) -> str:
+    encoded = json.dumps([text.strip(), language, tone, model], ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()[:32]
+
+
+class TranslationCache:
+    """Thread-safe LRU of translated lines, optionally backed by a file."""
+
+    def __init__(self, path: Optional[Union[str, Path]] = None, max_entries: int = 50_000):
+        self.path = Path(path) if path else None
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        if self.path is not None:
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, text: str, language: str, tone: str, model: str) -> Optional[str]:
+        key = translation_key(text, language, tone, model)
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, text: str, language: str, tone: str, model: str, translation: str) -> None:
+        key = translation_key(text, language, tone, model)
+        with self._lock:
+            if self._entries.get(key) == translation:
+                return
+            self._entries[key] = translation
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            if self.path is not None:
+                with self.path.open("a", encoding="utf-8") as fh:
+                    record = {"key": key, "source": text, "language": language, "text": translation}
+                    fh.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def _load(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if not self.path.exists():
+            return
+        for line in self.path.read_text(encoding="utf-8").splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # tolerate a torn last line
+            self._entries[record["key"]] = record["text"]
+            self._entries.move_to_end(record["key"])
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
@@ -0,0 +1,294 @@
+"""
+Fast local page triage before auto-mode localization.
+Looks for lettering (dense dark strokes on a bright bubble background) so
+pages without dialogue can skip the API entirely, and optionally splits a
+page into panels along its gutters so only panels with text are sent.
+The heuristics are deliberately conservative: when unsure, a region counts
+as text. Needs Pillow and numpy (`pip install nyamanga[imaging]`).
+"""
+import base64
+from dataclasses import dataclass, field
+import io
+import math
+from typing import Any, List, Sequence, Tuple
+
+from .imaging import _require_pil
+from .phash import _require_numpy
+
+Box = Tuple[int, int, int, int]  # left, top, right, bottom in page pixels
+
+# "skip": pass textless pages through; "panels": also send only text panels.
+TRIAGE_MODES = ("skip", "panels")
+
+_ANALYSIS_SIZE = 1600
+_CELL = 32
+
+
+@dataclass
+class Panel:
+    box: Box
+    has_text: bool
+
+
+@dataclass
+class PageTriage:
+    size: Tuple[int, int]
+    text_regions: List[Box] = field(default_factory=list)
+    panels: List[Panel] = field(default_factory=list)
+
+    @property
+    def has_text(self) -> bool:
+        return bool(self.text_regions)
+
+    def text_panels(self) -> List[Panel]:
+        return [panel for panel in self.panels if panel.has_text]
+
+    def text_coverage(self) -> float:
+        """Share of the page area covered by panels that contain text."""
+        area = self.size[0] * self.size[1]
+        covered = sum((p.box[2] - p.box[0]) * (p.box[3] - p.box[1]) for p in self.text_panels())
+        return covered / area if area else 1.0
+
+
+def _load_gray(data: bytes) -> Tuple[Any, Tuple[int, int], float]:
+    Image = _require_pil()
+    np = _require_numpy()
+    with Image.open(io.BytesIO(data)) as img:
+        size = img.size
+        scale = min(1.0, _ANALYSIS_SIZE / max(size))
+        img.draft("L", (max(1, int(size[0] * scale)), max(1, int(size[1] * scale))))
+        gray = img.convert("L")
+        if scale < 1.0:
+            gray = gray.resize(
+                (max(1, round(size[0] * scale)), max(1, round(size[1] * scale))), Image.BILINEAR
+            )
+        return np.asarray(gray, dtype=np.uint8), size, scale
+
+
+def _components(binary: Any) -> Any:
+    """
+    8-connected components of a boolean image as an `(n, 5)` array of
+    `left, top, right, bottom, area` (right/bottom exclusive). Horizontal runs
+    are found and linked to the runs they touch in the row above, then merged
+    with a vectorized union-find, so noisy pages cost no Python loop per run.
+    """
+    np = _require_numpy()
+    edges = np.diff(np.pad(binary, ((0, 0), (1, 1))).astype(np.int8), axis=1)
+    starts = np.argwhere(edges == 1)
+    ends = np.argwhere(edges == -1)[:, 1]
+    if not len(starts):
+        return np.zeros((0, 5), dtype=np.int64)
+    rows, cols = starts[:, 0], starts[:, 1]
+    # Runs are ordered by row, then column, and both their starts and ends
+    # increase along a row; these keys keep that order across rows.
+    stride = binary.shape[1] + 2
+    first = np.searchsorted(rows * stride + ends, (rows - 1) * stride + cols, side="left")
+    last = np.searchsorted(rows * stride + cols, (rows - 1) * stride + ends, side="right")
+    # Runs first..last-1 of the row above touch each run (diagonals count).
+    counts = np.maximum(last - first, 0)
+    offsets = np.cumsum(counts) - counts
+    below = np.repeat(np.arange(len(rows)), counts)
+    above = np.repeat(first - offsets, counts) + np.arange(counts.sum())
+    roots = _merge(len(rows), below, above)
+    labels, inverse = np.unique(roots, return_inverse=True)
+    n = len(labels)
+    out = np.empty((n, 5), dtype=np.int64)
+    out[:, 0] = np.full(n, binary.shape[1])
+    out[:, 1] = np.full(n, binary.shape[0])
+    out[:, 2:] = 0
+    np.minimum.at(out[:, 0], inverse, cols)
+    np.minimum.at(out[:, 1], inverse, rows)
+    np.maximum.at(out[:, 2], inverse, ends)
+    np.maximum.at(out[:, 3], inverse, rows + 1)
+    np.add.at(out[:, 4], inverse, ends - cols)
+    return out
+
+
+def _merge(n: int, a: Any, b: Any) -> Any:
+    """Root of each of `n` nodes joined by the edges `a[i]`-`b[i]`."""
+    np = _require_numpy()
+    parent = np.arange(n)
+    while True:
+        pa, pb = parent[a], parent[b]
+        split = pa != pb
+        if not split.any():
+            return parent
+        pa, pb = pa[split], pb[split]
+        # Hook the larger root of every split edge onto the smaller one, then
+        # jump pointers until each node points straight at its root again.
+        np.minimum.at(parent, np.maximum(pa, pb), np.minimum(pa, pb))
+        while True:
+            jumped = parent[parent]
+            if np.array_equal(jumped, parent):
+                break
+            parent = jumped
+
+
+def _text_regions(gray: Any) -> List[Box]:
+    """
+    Boxes (analysis pixels) of glyph clusters: several letter-sized, similarly
+    tall dark components close together on a bright background.
+    """
+    np = _require_numpy()
+    h, w = gray.shape
+    comps = _components(gray < 128)
+    if not len(comps):
+        return []
+    cw = comps[:, 2] - comps[:, 0]
+    ch = comps[:, 3] - comps[:, 1]
+    fill = comps[:, 4] / np.maximum(1, cw * ch)
+    glyph = (ch >= 6) & (ch <= 64) & (cw >= 2) & (cw <= 80) & (cw <= 4 * ch) & (fill > 0.08) & (fill < 0.9)
+    comps, ch = comps[glyph], ch[glyph]
+    if len(comps) < 3:
+        return []
+
+    # Lettering sits in bubbles: the area around a glyph is mostly white.
+    bright = np.pad((gray > 200).astype(np.int32).cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+    pad = ch
+    x0 = np.clip(comps[:, 0] - pad, 0, w)
+    y0 = np.clip(comps[:, 1] - pad, 0, h)
+    x1 = np.clip(comps[:, 2] + pad, 0, w)
+    y1 = np.clip(comps[:, 3] + pad, 0, h)
+    white = bright[y1, x1] - bright[y0, x1] - bright[y1, x0] + bright[y0, x0]
+    surround = white / np.maximum(1, (x1 - x0) * (y1 - y0))
+    comps, ch = comps[surround > 0.6], ch[surround > 0.6]
+    if len(comps) < 3:
+        return []
+
+    # Cluster glyph centres on a coarse grid; a text cell has several
+    # similar-height glyphs in its 3x3 neighbourhood.
+    grid = np.zeros((h // _CELL + 1, w // _CELL + 1), dtype=np.int32)
+    cy = (comps[:, 1] + comps[:, 3]) // 2 // _CELL
+    cx = (comps[:, 0] + comps[:, 2]) // 2 // _CELL
+    np.add.at(grid, (cy, cx), 1)
+    padded = np.pad(grid, 1)
+    rows, cols = grid.shape
+    near = sum(padded[dy : dy + rows, dx : dx + cols] for dy in range(3) for dx in range(3))
+    cells = (grid > 0) & (near >= 4)
+    regions = []
+    for left, top, right, bottom, _ in _components(cells):
+        inside = (cx >= left) & (cx < right) & (cy >= top) & (cy < bottom)
+        heights = ch[inside]
+        # Letters share a size; scattered art fragments rarely do.
+        if len(heights) < 4 or np.percentile(heights, 75) > 2.5 * np.percentile(heights, 25):
+            continue
+        sel = comps[inside]
+        regions.append(
+            (int(sel[:, 0].min()), int(sel[:, 1].min()), int(sel[:, 2].max()), int(sel[:, 3].max()))
+        )
+    return regions
+
+
+def _gutter_runs(profile: Any, min_run: int) -> List[Tuple[int, int]]:
+    """Runs of True in a 1-D boolean profile at least `min_run` long."""
+    np = _require_numpy()
+    edges = np.diff(np.concatenate(([0], profile.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    return [(int(s), int(e)) for s, e in zip(starts, ends) if e - s >= min_run]
+
+
+def _cut(gray: Any, box: Box, axis: int, depth: int, min_size: int) -> List[Box]:
+    """Recursive XY-cut along blank (white) gutters."""
+    np = _require_numpy()
+    left, top, right, bottom = box
+    region = gray[top:bottom, left:right]
+    if depth == 0 or region.size == 0:
+        return [box]
+    # axis 0: horizontal gutters (rows); axis 1: vertical gutters (columns).
+    # Gutters are (almost) entirely blank; rows crossing panel borders aren't.
+    blank = (region > 200).mean(axis=1 - axis) >= 0.995
+    length = region.shape[axis]
+    runs = _gutter_runs(blank, max(3, length // 200))
+    segments = []
+    cursor = 0
+    for start, end in runs:
+        if start - cursor >= min_size:
+            segments.append((cursor, start))
+        cursor = end
+    if length - cursor >= min_size:
+        segments.append((cursor, length))
+    if not segments:
+        return [box]
+    if len(segments) == 1 and segments[0] == (0, length):
+        if depth == 1:
+            return [box]
+        return _cut(gray, box, 1 - axis, depth - 1, min_size)
+    boxes: List[Box] = []
+    for start, end in segments:
+        if axis == 0:
+            sub = (left, top + start, right, top + end)
+        else:
+            sub = (left + start, top, left + end, bottom)
+        boxes.extend(_cut(gray, sub, 1 - axis, depth - 1, min_size))
+    return boxes
+
+
+def triage_page(data: bytes, split_panels: bool = False) -> PageTriage:
+    """
+    Detect lettering on an encoded page and, with `split_panels`, cut it
+    into panels. Boxes are in the page's own pixel coordinates.
+    """
+    gray, size, scale = _load_gray(data)
+
+    def to_page(box: Box, pad: int = 0) -> Box:
+        left, top, right, bottom = box
+        return (
+            max(0, int((left - pad) / scale)),
+            max(0, int((top - pad) / scale)),
+            min(size[0], math.ceil((right + pad) / scale)),
+            min(size[1], math.ceil((bottom + pad) / scale)),
+        )
+
+    regions = _text_regions(gray)
+    triage = PageTriage(size=size, text_regions=[to_page(box) for box in regions])
+    if not split_panels or not regions:
+        triage.panels = [Panel(box=(0, 0, size[0], size[1]), has_text=triage.has_text)]
+        return triage
+
+    h, w = gray.shape
+    min_size = max(24, min(h, w) // 12)
+    boxes = _cut(gray, (0, 0, w, h), 0, 4, min_size)
+    covered = set()
+    for left, top, right, bottom in boxes:
+        hits = {
+            i
+            for i, r in enumerate(regions)
+            if r[0] < right and r[2] > left and r[1] < bottom and r[3] > top
+        }
+        covered |= hits
+        triage.panels.append(Panel(box=to_page((left, top, right, bottom), pad=2), has_text=bool(hits)))
+    if len(covered) < len(regions):
+        # Some lettering fell outside every panel (e.g. across a gutter).
+        triage.panels = [Panel(box=(0, 0, size[0], size[1]), has_text=True)]
+    return triage
+
+
+def crop(data: bytes, box: Box) -> bytes:
+    """PNG bytes of `box` cut out of an encoded image."""
+    Image = _require_pil()
+    with Image.open(io.BytesIO(data)) as img:
+        region = img.crop(box)
+    buf = io.BytesIO()
+    region.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def reassemble(page: bytes, patches: Sequence[Tuple[Box, str]]) -> str:
+    """
+    Paste edited panels (base64) back into the page at their boxes, resizing
+    any the model returned at a different size. Returns a base64 PNG.
+    """
+    Image = _require_pil()
+    with Image.open(io.BytesIO(page)) as img:
+        canvas = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+    for box, image_b64 in patches:
+        with Image.open(io.BytesIO(base64.b64decode(image_b64))) as patch:
+            target = (box[2] - box[0], box[3] - box[1])
+            patch = patch.convert(canvas.mode)
+            if patch.size != target:
+                patch = patch.resize(target, Image.LANCZOS)
+            canvas.paste(patch, box[:2])
+    buf = io.BytesIO()
+    canvas.save(buf, format="PNG")
+    return base64.b64encode(buf.getvalue()).decode("ascii")
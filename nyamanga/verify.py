@@ -0,0 +1,231 @@
+"""
+Local checks of edited pages before they are saved.
+Image models redraw the whole page, so an edit can come back at the wrong
+size, with art changed away from the lettering, or with a balloon left
+untranslated. `verify_edit` compares the result against the upload on a
+coarse grid (numpy, no API calls): cells outside the mask and the text
+regions must stay close to the original, and in auto modes every text region
+must have changed. `repair` then restores the damaged cells (never the text
+regions or the mask) from the original and pastes re-run regions in, so most failures never need a full-page rerun.
+Needs Pillow and numpy (`pip install nyamanga[imaging]`).
+"""
+import base64
+from dataclasses import asdict, dataclass, field
+import io
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .imaging import _require_pil
+from .phash import _require_numpy
+from .triage import Box, _components
+
+_ANALYSIS_SIZE = 512
+_CELL = 16
+# Per-pixel difference (0-255, any channel) that counts as a change; lower
+# differences are resampling and compression noise.
+_PIXEL_DELTA = 48
+# Share of changed pixels that marks a cell as changed.
+_CELL_CHANGED = 0.2
+# Aspect ratio drift tolerated before the result counts as the wrong shape.
+_ASPECT_TOLERANCE = 0.02
+
+
+@dataclass
+class Verification:
+    expected_size: Tuple[int, int]
+    actual_size: Tuple[int, int]
+    # Page-pixel boxes of art that changed outside the mask/text regions.
+    damaged: List[Box] = field(default_factory=list)
+    # Page-pixel boxes (with some margin) of text regions left unchanged.
+    missed: List[Box] = field(default_factory=list)
+    # Share of protected cells that changed.
+    damage_ratio: float = 0.0
+    # Page-pixel boxes (with some margin) where lettering may change.
+    regions: List[Box] = field(default_factory=list)
+    # The individual damaged grid cells, in page pixels; what `repair` restores.
+    cells: List[Box] = field(default_factory=list)
+
+    @property
+    def size_ok(self) -> bool:
+        (ew, eh), (aw, ah) = self.expected_size, self.actual_size
+        return abs(aw / ah - ew / eh) <= _ASPECT_TOLERANCE * (ew / eh)
+
+    @property
+    def ok(self) -> bool:
+        return self.size_ok and not self.damaged and not self.missed
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        del data["cells"]
+        return {**data, "ok": self.ok, "size_ok": self.size_ok}
+
+
+def _load_rgb(data: bytes, size: Tuple[int, int]) -> Any:
+    Image = _require_pil()
+    np = _require_numpy()
+    with Image.open(io.BytesIO(data)) as img:
+        rgb = img.convert("RGB")
+        if rgb.size != size:
+            rgb = rgb.resize(size, Image.BILINEAR)
+        return np.asarray(rgb, dtype=np.int16)
+
+
+def _editable(mask: bytes, size: Tuple[int, int]) -> Any:
+    """Mask pixels the model may change: transparent, or white without alpha."""
+    Image = _require_pil()
+    np = _require_numpy()
+    with Image.open(io.BytesIO(mask)) as img:
+        band = img.getchannel("A") if "A" in img.getbands() else img.convert("L")
+        band = band.resize(size, Image.NEAREST)
+        values = np.asarray(band)
+        return values < 128 if "A" in img.getbands() else values >= 128
+
+
+def _cells(flags: Any) -> Any:
+    """Mean of a boolean image over `_CELL`-sized cells (edges padded)."""
+    np = _require_numpy()
+    h, w = flags.shape
+    padded = np.pad(flags, ((0, -h % _CELL), (0, -w % _CELL)), mode="edge")
+    return padded.reshape(padded.shape[0] // _CELL, _CELL, -1, _CELL).mean(axis=(1, 3))
+
+
+def _grow(box: Box, size: Tuple[int, int]) -> Box:
+    """Pad a lettering box out to roughly its balloon."""
+    left, top, right, bottom = box
+    pad = max((bottom - top) // 2, (right - left) // 4, max(size) // 60)
+    return (
+        max(0, left - pad),
+        max(0, top - pad),
+        min(size[0], right + pad),
+        min(size[1], bottom + pad),
+    )
+
+
+def verify_edit(
+    original: bytes,
+    edited_b64: str,
+    text_regions: Sequence[Box],
+    mask: Optional[bytes] = None,
+    expect_text: bool = False,
+    region_scale: Optional[int] = None,
+) -> Verification:
+    """
+    Compare an edit (base64) with the page it was made from. `text_regions`
+    are where lettering may change, in page pixels or, with `region_scale`,
+    in 0..region_scale units. With `expect_text`, a text region the edit left
+    alone is reported as missed.
+    """
+    Image = _require_pil()
+    np = _require_numpy()
+    edited = base64.b64decode(edited_b64)
+    with Image.open(io.BytesIO(original)) as img:
+        page_size = img.size
+    with Image.open(io.BytesIO(edited)) as img:
+        result = Verification(expected_size=page_size, actual_size=img.size)
+    if not result.size_ok:
+        return result
+
+    if not text_regions and mask is None:
+        # Nothing says where the lettering may go; only the size is checked.
+        return result
+
+    scale = min(1.0, _ANALYSIS_SIZE / max(page_size))
+    size = (max(1, round(page_size[0] * scale)), max(1, round(page_size[1] * scale)))
+    diff = np.abs(_load_rgb(original, size) - _load_rgb(edited, size)).max(axis=2)
+    changed = diff > _PIXEL_DELTA
+
+    if region_scale:
+        text_regions = [
+            (
+                left * page_size[0] // region_scale,
+                top * page_size[1] // region_scale,
+                right * page_size[0] // region_scale,
+                bottom * page_size[1] // region_scale,
+            )
+            for left, top, right, bottom in text_regions
+        ]
+    regions = [_grow(box, page_size) for box in text_regions]
+    result.regions = regions
+    allowed = np.zeros(changed.shape, dtype=bool)
+    for left, top, right, bottom in regions:
+        rows = slice(int(top * scale), int(bottom * scale) + 1)
+        allowed[rows, int(left * scale) : int(right * scale) + 1] = True
+    if mask is not None:
+        allowed |= _editable(mask, size)
+
+    # Cells that are (almost) entirely protected and still changed.
+    protected = _cells(~allowed) >= 0.9
+    damaged = protected & (_cells(changed) > _CELL_CHANGED)
+    if protected.any():
+        result.damage_ratio = round(float(damaged.sum() / protected.sum()), 4)
+
+    def to_page(left: int, top: int, right: int, bottom: int) -> Box:
+        return (
+            int(left * _CELL / scale),
+            int(top * _CELL / scale),
+            min(page_size[0], int(right * _CELL / scale) + 1),
+            min(page_size[1], int(bottom * _CELL / scale) + 1),
+        )
+
+    restore = np.zeros(damaged.shape, dtype=bool)
+    for left, top, right, bottom, area in _components(damaged):
+        if area < 2:
+            continue  # a lone cell is usually noise around strong edges
+        result.damaged.append(to_page(left, top, right, bottom))
+        # The component's box can span a balloon; only its cells are restored.
+        restore[top:bottom, left:right] |= damaged[top:bottom, left:right]
+    result.cells = [to_page(col, row, col + 1, row + 1) for row, col in np.argwhere(restore)]
+
+    if expect_text:
+        for box, grown in zip(text_regions, regions):
+            left, top, right, bottom = (int(v * scale) for v in box)
+            inside = changed[top : bottom + 1, left : right + 1]
+            if inside.size and inside.mean() < 0.02:
+                result.missed.append(grown)
+    return result
+
+
+def repair(
+    original: bytes,
+    edited_b64: str,
+    restore: Sequence[Box],
+    patches: Sequence[Tuple[Box, str]] = (),
+    keep: Sequence[Box] = (),
+    mask: Optional[bytes] = None,
+) -> str:
+    """
+    Copy the `restore` boxes (`Verification.cells`) back from the original
+    page, except where they overlap `keep` (the text regions) or the editable
+    part of `mask`, then paste `patches` (base64 re-runs of single regions)
+    over the edit, which is first scaled to the original's size. Returns a
+    base64 PNG.
+    """
+    Image = _require_pil()
+    from PIL import ImageChops, ImageDraw
+
+    with Image.open(io.BytesIO(original)) as img:
+        source = img.convert("RGB")
+    with Image.open(io.BytesIO(base64.b64decode(edited_b64))) as img:
+        canvas = img.convert("RGB")
+    if canvas.size != source.size:
+        canvas = canvas.resize(source.size, Image.LANCZOS)
+    if restore:
+        stencil = Image.new("L", source.size, 0)
+        draw = ImageDraw.Draw(stencil)
+        for left, top, right, bottom in restore:
+            draw.rectangle((left, top, right - 1, bottom - 1), fill=255)
+        for left, top, right, bottom in keep:
+            draw.rectangle((left, top, right - 1, bottom - 1), fill=0)
+        if mask is not None:
+            editable = Image.fromarray(_editable(mask, source.size)).convert("L")
+            stencil = ImageChops.subtract(stencil, editable)
+        canvas.paste(source, (0, 0), stencil)
+    for box, image_b64 in patches:
+        with Image.open(io.BytesIO(base64.b64decode(image_b64))) as patch:
+            target = (box[2] - box[0], box[3] - box[1])
+            patch = patch.convert("RGB")
+            if patch.size != target:
+                patch = patch.resize(target, Image.LANCZOS)
+            canvas.paste(patch, box[:2])
+    buf = io.BytesIO()
+    canvas.save(buf, format="PNG")
+    return base64.b64encode(buf.getvalue()).decode("ascii")
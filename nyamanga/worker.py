@@ -0,0 +1,264 @@
+"""
+Long-lived JSON-lines worker behind `nyamanga worker`.
+Reads one job object per line from stdin, runs the jobs concurrently on a
+single warm pipeline and writes one result object per line to stdout in
+completion order, so other tools can stream thousands of pages through one
+process.
+
+Job fields: `id`, `type` (localize/embed/rewrite, default localize), `image`,
+`mask`, `text`, `target_language` (string or list; localize jobs fan out over
+several), `tone`, `bubble_hint`, `style_hint`, `output`, `deadline` (seconds),
+`priority` (interactive/batch).
+Rewrite jobs may name a `session` (e.g. the chapter) and a `speaker`: jobs
+with the same session, language and tone share one `DialogueSession`, so
+they are translated with the chapter's recent lines, speakers and glossary.
+Result fields: `id`, `ok`, `outputs` (language -> path), `text`, `timings`,
+`error`. With a `pack`, pages are appended to that `ChapterPack` instead and
+`outputs` maps each language to the page's name inside `pack`.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import json
+import threading
+import time
+from typing import Any, Dict, IO, List, Optional, Tuple
+
+from .batch import language_output_path, localized_output_path
+from .cancel import CancelToken
+from .embedder import DialogueSession, MangaEmbedder
+from .imaging import OutputOptions
+from .pack import ChapterPack
+from .pipeline import TypesettingPipeline
+from .scheduler import Priority
+
+JOB_TYPES = ("localize", "embed", "rewrite")
+
+
+def _priority(job: Dict[str, Any]) -> Priority:
+    name = str(job.get("priority") or "batch")
+    try:
+        return Priority[name.upper()]
+    except KeyError:
+        choices = tuple(p.name.lower() for p in Priority)
+        raise ValueError(f"Unknown priority {name!r}; expected one of {choices}") from None
+
+
+def _languages(job: Dict[str, Any]) -> List[str]:
+    value = job.get("target_language") or "zh"
+    if isinstance(value, str):
+        value = value.split(",")
+    if not isinstance(value, list) or not all(isinstance(lang, str) for lang in value):
+        raise ValueError("target_language must be a string or a list of strings")
+    languages = list(dict.fromkeys(lang.strip() for lang in value if lang.strip()))
+    if not languages:
+        raise ValueError("target_language names no language")
+    return languages
+
+
+class JsonLinesWorker:
+    """
+    Runs JSON-lines jobs with at most `workers` in flight; reading stdin is
+    throttled so a huge job stream is never loaded into memory at once.
+    """
+
+    def __init__(
+        self,
+        pipeline: TypesettingPipeline,
+        workers: int = 4,
+        output_dir: Optional[Path] = None,
+        output_options: Optional[OutputOptions] = None,
+        default_deadline: Optional[float] = None,
+        pack: Optional[ChapterPack] = None,
+    ):
+        self.pipeline = pipeline
+        self.pack = pack
+        self.workers = max(1, workers)
+        self.output_dir = output_dir
+        self.output_options = output_options
+        self.default_deadline = default_deadline
+        self._write_lock = threading.Lock()
+        self._sessions: Dict[Tuple[str, str, str], DialogueSession] = {}
+        self._sessions_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.workers * 2)
+        self.failures = 0
+
+    def run(self, source: IO[str], sink: IO[str]) -> int:
+        """Process every line of `source`; returns the number of failed jobs."""
+        with ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="nyamanga-worker"
+        ) as pool:
+            for line_no, line in enumerate(source, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                self._slots.acquire()
+                received = time.monotonic()
+                future = pool.submit(self._handle_line, line, line_no, received, sink)
+                future.add_done_callback(lambda _: self._slots.release())
+        return self.failures
+
+    def _handle_line(self, line: str, line_no: int, received: float, sink: IO[str]) -> None:
+        started = time.monotonic()
+        job_id: Any = line_no
+        try:
+            job = json.loads(line)
+            if not isinstance(job, dict):
+                raise ValueError("Job must be a JSON object")
+            job_id = job.get("id", line_no)
+            result = self.run_job(job)
+            result.update(id=job_id, ok=True)
+        except Exception as exc:
+            result = {"id": job_id, "ok": False, "error": f"{type(exc).__name__}: {exc}"}
+        finished = time.monotonic()
+        timings = result.setdefault("timings", {})
+        timings["queued_s"] = round(started - received, 4)
+        timings["total_s"] = round(finished - started, 4)
+        self._emit(result, sink)
+
+    def run_job(self, job: Dict[str, Any], cancel: Optional[CancelToken] = None) -> Dict[str, Any]:
+        """
+        Run one job object and return its result fields (`outputs`, `text`,
+        `timings`). Cancelling `cancel` stops the job; errors propagate.
+        """
+        job_type = job.get("type", "localize")
+        if job_type not in JOB_TYPES:
+            raise ValueError(f"Unknown job type {job_type!r}; expected one of {JOB_TYPES}")
+        deadline = job.get("deadline", self.default_deadline)
+        token = CancelToken.with_timeout(float(deadline) if deadline is not None else None)
+        unlink = cancel.add_callback(token.cancel) if cancel is not None else None
+        try:
+            return self._run_job(job, job_type, token)
+        finally:
+            if unlink is not None:
+                unlink()
+
+    def _run_job(self, job: Dict[str, Any], job_type: str, cancel: CancelToken) -> Dict[str, Any]:
+        priority = _priority(job)
+        languages = _languages(job)
+        if job_type != "localize" and len(languages) > 1:
+            raise ValueError(f"{job_type} jobs take a single target_language")
+        embedder = self.pipeline.embedder_for(priority)
+        tone = job.get("tone") or "friendly manga voice"
+
+        if job_type == "rewrite":
+            started = time.monotonic()
+            if job.get("session"):
+                session = self._session(embedder, str(job["session"]), languages[0], tone)
+                dialogue = session.rewrite(job["text"], speaker=job.get("speaker"), cancel=cancel)
+            else:
+                dialogue = embedder.rewrite_dialogue(
+                    source_text=job["text"], target_language=languages[0], tone=tone, cancel=cancel
+                )
+            return {"text": dialogue.text, "timings": {"api_s": round(time.monotonic() - started, 4)}}
+
+        if not job.get("image"):
+            raise ValueError(f"{job_type} jobs need an image path")
+        image = Path(job["image"])
+        mask = Path(job["mask"]) if job.get("mask") else None
+        output = Path(job["output"]) if job.get("output") else None
+        options = self.output_options
+        if job.get("format"):
+            options = OutputOptions(format=job["format"], quality=int(job.get("quality", 90)))
+
+        extra: Dict[str, Any] = {}
+        started = time.monotonic()
+        if job_type == "embed":
+            embed = embedder.embed_text(
+                image_path=image,
+                text=job["text"],
+                bubble_hint=job.get("bubble_hint"),
+                mask_path=mask,
+                style_hint=job.get("style_hint"),
+                cancel=cancel,
+            )
+            images = {languages[0]: embed.image_b64}
+            texts = {languages[0]: job["text"]}
+        elif len(languages) > 1:
+            results = self.pipeline.localize_panel_multi(
+                image_path=image,
+                target_languages=languages,
+                source_text=job.get("text"),
+                tone=tone,
+                bubble_hint=job.get("bubble_hint"),
+                mask_path=mask,
+                style_hint=job.get("style_hint"),
+                cancel=cancel,
+                priority=priority,
+            )
+            images = {lang: r.edited_image_b64 for lang, r in results.items()}
+            texts = {lang: r.rewritten_text for lang, r in results.items()}
+            flagged = [lang for lang, r in results.items() if r.flagged]
+            if flagged:
+                extra["flagged"] = flagged
+        else:
+            panel = self.pipeline.localize_panel(
+                image_path=image,
+                source_text=job.get("text"),
+                target_language=languages[0],
+                tone=tone,
+                bubble_hint=job.get("bubble_hint"),
+                mask_path=mask,
+                style_hint=job.get("style_hint"),
+                cancel=cancel,
+                priority=priority,
+            )
+            images = {languages[0]: panel.edited_image_b64}
+            texts = {languages[0]: panel.rewritten_text}
+            if panel.skipped:
+                extra["skipped"] = True
+            if panel.flagged:
+                extra["flagged"] = [languages[0]]
+        api_done = time.monotonic()
+
+        if self.pack is not None:
+            packed = {
+                lang: self.pack.add_encoded(
+                    self.pipeline.images.encode(image_b64, options),
+                    image.name,
+                    lang,
+                    name=self._output_path(image, output, lang, len(images) > 1).name,
+                    params={"source": str(image), "text": texts[lang], **extra},
+                )
+                for lang, image_b64 in images.items()
+            }
+            outputs = {lang: entry.result().name for lang, entry in packed.items()}
+            extra["pack"] = str(self.pack.path)
+        else:
+            writes = {
+                lang: self.pipeline.images.write(
+                    image_b64, self._output_path(image, output, lang, len(images) > 1), options
+                )
+                for lang, image_b64 in images.items()
+            }
+            outputs = {lang: str(write.result()) for lang, write in writes.items()}
+        return {
+            **extra,
+            "outputs": outputs,
+            "text": texts,
+            "timings": {
+                "api_s": round(api_done - started, 4),
+                "write_s": round(time.monotonic() - api_done, 4),
+            },
+        }
+
+    def _session(
+        self, embedder: MangaEmbedder, name: str, language: str, tone: str
+    ) -> DialogueSession:
+        with self._sessions_lock:
+            key = (name, language, tone)
+            if key not in self._sessions:
+                self._sessions[key] = embedder.session(language, tone)
+            return self._sessions[key]
+
+    def _output_path(self, image: Path, output: Optional[Path], lang: str, multi: bool) -> Path:
+        if output is None:
+            output = localized_output_path(image, self.output_dir or image.parent)
+        return language_output_path(output, lang) if multi else output
+
+    def _emit(self, result: Dict[str, Any], sink: IO[str]) -> None:
+        line = json.dumps(result, ensure_ascii=False)
+        with self._write_lock:
+            if not result.get("ok"):
+                self.failures += 1
+            sink.write(line + "\n")
+            sink.flush()
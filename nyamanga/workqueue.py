@@ -0,0 +1,402 @@
+"""
+Durable SQLite work queue behind `nyamanga queue`.
+Any number of worker processes, on one machine or several sharing a
+filesystem, claim jobs from the same database file. A claim is a lease:
+workers heartbeat while a job runs, and a job whose lease expires (crashed
+or unplugged worker) goes back to the queue, up to `max_attempts` times.
+SQLite's own locking is the only coordination, so throughput scales by
+starting more `nyamanga queue work` processes.
+
+Jobs use the same JSON objects as `nyamanga worker`.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+import json
+import os
+from pathlib import Path
+import random
+import socket
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Union
+
+from .batch import ItemStatus
+from .cancel import CancelToken, Cancelled, DeadlineExceeded
+from .worker import JsonLinesWorker
+
+QUEUE_STATUSES = (ItemStatus.QUEUED, ItemStatus.RUNNING, ItemStatus.DONE, ItemStatus.FAILED)
+# Errors retrying won't fix: bad job objects and missing files.
+PERMANENT_ERRORS = (ValueError, KeyError, FileNotFoundError, IsADirectoryError, PermissionError)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    lease_owner TEXT,
+    lease_expires REAL,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+"""
+
+
+def default_owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+@dataclass
+class QueueJob:
+    id: int
+    payload: Dict[str, Any]
+    status: str
+    attempts: int
+    max_attempts: int
+    lease_owner: Optional[str] = None
+    lease_expires: Optional[float] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: Optional[float] = None
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "QueueJob":
+        return cls(
+            id=row["id"],
+            payload=json.loads(row["payload"]),
+            status=row["status"],
+            attempts=row["attempts"],
+            max_attempts=row["max_attempts"],
+            lease_owner=row["lease_owner"],
+            lease_expires=row["lease_expires"],
+            result=json.loads(row["result"]) if row["result"] else None,
+            error=row["error"],
+            created_at=row["created_at"],
+            started_at=row["started_at"],
+            finished_at=row["finished_at"],
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "attempts": self.attempts,
+            "max_attempts": self.max_attempts,
+            "lease_owner": self.lease_owner,
+            "job": self.payload,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class WorkQueue:
+    """
+    Job table in a SQLite file. Lease times use the wall clock because
+    workers on different machines compare them; keep clocks roughly in sync
+    and `lease_seconds` well above the heartbeat interval.
+    The default rollback journal is used (not WAL) so the file also works on
+    network filesystems.
+    """
+
+    def __init__(self, path: Union[str, Path], lease_seconds: float = 120.0):
+        self.path = Path(path)
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+        with self._transaction() as db:
+            # executescript() would commit early; run the statements one by one.
+            for statement in _SCHEMA.split(";"):
+                if statement.strip():
+                    db.execute(statement)
+
+    def _connect(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=60.0, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA busy_timeout = 60000")
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        # IMMEDIATE takes the write lock up front so two workers can never
+        # both read a job as queued and claim it.
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def close(self) -> None:
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+    def enqueue(self, jobs: Iterable[Dict[str, Any]], max_attempts: int = 3) -> List[int]:
+        now = time.time()
+        ids = []
+        with self._transaction() as db:
+            for job in jobs:
+                cursor = db.execute(
+                    "INSERT INTO jobs (payload, max_attempts, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (json.dumps(job, ensure_ascii=False), max(1, max_attempts), now, now),
+                )
+                ids.append(cursor.lastrowid)
+        return ids
+
+    def claim(self, owner: str, limit: int = 1) -> List[QueueJob]:
+        """Lease up to `limit` queued jobs to `owner`, oldest first."""
+        if limit <= 0:
+            return []
+        now = time.time()
+        with self._transaction() as db:
+            self._expire_leases(db, now)
+            rows = db.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' ORDER BY id LIMIT ?", (limit,)
+            ).fetchall()
+            ids = [row["id"] for row in rows]
+            if not ids:
+                return []
+            marks = ",".join("?" * len(ids))
+            db.execute(
+                f"UPDATE jobs SET status = 'running', lease_owner = ?, lease_expires = ?, "
+                f"attempts = attempts + 1, started_at = ?, updated_at = ? WHERE id IN ({marks})",
+                (owner, now + self.lease_seconds, now, now, *ids),
+            )
+            rows = db.execute(f"SELECT * FROM jobs WHERE id IN ({marks}) ORDER BY id", ids).fetchall()
+        return [QueueJob.from_row(row) for row in rows]
+
+    def heartbeat(self, owner: str, ids: Sequence[int]) -> Set[int]:
+        """Extend `owner`'s leases; returns the ids it no longer holds."""
+        if not ids:
+            return set()
+        now = time.time()
+        marks = ",".join("?" * len(ids))
+        with self._transaction() as db:
+            db.execute(
+                f"UPDATE jobs SET lease_expires = ?, updated_at = ? WHERE id IN ({marks}) "
+                "AND status = 'running' AND lease_owner = ?",
+                (now + self.lease_seconds, now, *ids, owner),
+            )
+            held = db.execute(
+                f"SELECT id FROM jobs WHERE id IN ({marks}) AND status = 'running' "
+                "AND lease_owner = ?",
+                (*ids, owner),
+            ).fetchall()
+        return set(ids) - {row["id"] for row in held}
+
+    def complete(self, owner: str, job_id: int, result: Dict[str, Any]) -> bool:
+        """Record a result; False if the lease was lost (the result is dropped)."""
+        return self._finish(
+            owner, job_id, "status = 'done', result = ?", (json.dumps(result, ensure_ascii=False),)
+        )
+
+    def fail(self, owner: str, job_id: int, error: str, retry: bool = True) -> bool:
+        """Requeue the job if `retry` and attempts remain, else mark it failed."""
+        return self._finish(
+            owner,
+            job_id,
+            "status = CASE WHEN ? AND attempts < max_attempts THEN 'queued' ELSE 'failed' END, "
+            "error = ?",
+            (1 if retry else 0, error),
+        )
+
+    def release(self, owner: str, job_id: int) -> bool:
+        """Hand a job back untouched (e.g. on shutdown) without using an attempt."""
+        return self._finish(owner, job_id, "status = 'queued', attempts = MAX(0, attempts - 1)", ())
+
+    def requeue(
+        self,
+        ids: Optional[Sequence[int]] = None,
+        statuses: Sequence[str] = (ItemStatus.FAILED.value,),
+    ) -> int:
+        """Put jobs (by id, or every job in `statuses`) back in the queue with fresh attempts."""
+        now = time.time()
+        query = (
+            "UPDATE jobs SET status = 'queued', attempts = 0, error = NULL, lease_owner = NULL, "
+            "lease_expires = NULL, updated_at = ? WHERE "
+        )
+        with self._transaction() as db:
+            if ids:
+                marks = ",".join("?" * len(ids))
+                cursor = db.execute(query + f"id IN ({marks})", (now, *ids))
+            else:
+                marks = ",".join("?" * len(statuses))
+                cursor = db.execute(query + f"status IN ({marks})", (now, *statuses))
+            return cursor.rowcount
+
+    def counts(self) -> Dict[str, int]:
+        with self._transaction() as db:
+            self._expire_leases(db, time.time())
+            rows = db.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        counts = {status.value: 0 for status in QUEUE_STATUSES}
+        counts.update({row["status"]: row["n"] for row in rows})
+        return counts
+
+    def jobs(self, status: Optional[str] = None, limit: int = 100) -> List[QueueJob]:
+        db = self._connect()
+        if status:
+            rows = db.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY id LIMIT ?", (status, limit)
+            ).fetchall()
+        else:
+            rows = db.execute("SELECT * FROM jobs ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return [QueueJob.from_row(row) for row in rows]
+
+    def get(self, job_id: int) -> Optional[QueueJob]:
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return QueueJob.from_row(row) if row else None
+
+    def _finish(self, owner: str, job_id: int, assignment: str, params: tuple) -> bool:
+        now = time.time()
+        with self._transaction() as db:
+            cursor = db.execute(
+                f"UPDATE jobs SET {assignment}, lease_owner = NULL, lease_expires = NULL, "
+                "finished_at = ?, updated_at = ? "
+                "WHERE id = ? AND status = 'running' AND lease_owner = ?",
+                (*params, now, now, job_id, owner),
+            )
+            return cursor.rowcount == 1
+
+    def _expire_leases(self, db: sqlite3.Connection, now: float) -> None:
+        # Caller holds the write transaction.
+        db.execute(
+            "UPDATE jobs SET status = CASE WHEN attempts < max_attempts THEN 'queued' "
+            "ELSE 'failed' END, "
+            "error = 'Lease expired (worker ' || lease_owner || ' stopped responding)', "
+            "lease_owner = NULL, lease_expires = NULL, updated_at = ? "
+            "WHERE status = 'running' AND lease_expires < ?",
+            (now, now),
+        )
+
+
+class QueueWorker:
+    """
+    Pulls jobs from a `WorkQueue` and runs `workers` of them at a time on a
+    `JsonLinesWorker`'s job runner. A heartbeat thread keeps the leases
+    alive; a job whose lease is lost is cancelled locally.
+    """
+
+    def __init__(
+        self,
+        queue: WorkQueue,
+        runner: JsonLinesWorker,
+        owner: Optional[str] = None,
+        poll_interval: float = 2.0,
+    ):
+        self.queue = queue
+        self.runner = runner
+        self.workers = runner.workers
+        self.owner = owner or default_owner()
+        self.poll_interval = poll_interval
+        self.processed = 0
+        self.failed = 0
+        self._active: Dict[int, CancelToken] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        # Set whenever a job finishes, so a full worker claims right away.
+        self._slot_freed = threading.Event()
+
+    def stop(self) -> None:
+        """Stop claiming; running jobs are cancelled and handed back."""
+        self._stop.set()
+        self._slot_freed.set()
+
+    def run(self, exit_when_empty: bool = False) -> int:
+        """Work until stopped (or the queue drains); returns jobs that failed here."""
+        heartbeat = threading.Thread(target=self._heartbeat, name="nyamanga-lease", daemon=True)
+        heartbeat.start()
+        pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="nyamanga-queue")
+        try:
+            while not self._stop.is_set():
+                self._slot_freed.clear()
+                with self._lock:
+                    free = self.workers - len(self._active)
+                claimed = self.queue.claim(self.owner, free) if free > 0 else []
+                for job in claimed:
+                    token = CancelToken()
+                    with self._lock:
+                        self._active[job.id] = token
+                    pool.submit(self._execute, job, token)
+                with self._lock:
+                    idle = not self._active
+                if exit_when_empty and idle and not claimed:
+                    if not self.queue.counts()[ItemStatus.RUNNING.value]:
+                        break
+                if free <= len(claimed):
+                    self._slot_freed.wait()
+                elif not claimed:
+                    # Jitter keeps many workers from polling in lockstep.
+                    self._stop.wait(self.poll_interval * random.uniform(0.5, 1.5))
+        except KeyboardInterrupt:
+            self._stop.set()
+        finally:
+            with self._lock:
+                tokens = list(self._active.values())
+            for token in tokens:
+                token.cancel()
+            pool.shutdown(wait=True)
+            self._stop.set()
+            heartbeat.join(timeout=1.0)
+        return self.failed
+
+    def _execute(self, job: QueueJob, token: CancelToken) -> None:
+        try:
+            result = self.runner.run_job(job.payload, cancel=token)
+        except Cancelled as exc:
+            if token.cancelled and not isinstance(exc, DeadlineExceeded):
+                # Lost lease or shutdown: someone else owns it, or it goes back.
+                self.queue.release(self.owner, job.id)
+            else:
+                self._count_failure()
+                self.queue.fail(self.owner, job.id, f"{type(exc).__name__}: {exc}", retry=True)
+        except Exception as exc:
+            self._count_failure()
+            self.queue.fail(
+                self.owner,
+                job.id,
+                f"{type(exc).__name__}: {exc}",
+                retry=not isinstance(exc, PERMANENT_ERRORS),
+            )
+        else:
+            if self.queue.complete(self.owner, job.id, result):
+                with self._lock:
+                    self.processed += 1
+        finally:
+            with self._lock:
+                self._active.pop(job.id, None)
+            self._slot_freed.set()
+
+    def _count_failure(self) -> None:
+        with self._lock:
+            self.failed += 1
+
+    def _heartbeat(self) -> None:
+        interval = max(1.0, self.queue.lease_seconds / 3)
+        while not self._stop.wait(interval):
+            with self._lock:
+                ids = list(self._active)
+            try:
+                lost = self.queue.heartbeat(self.owner, ids)
+            except sqlite3.Error:
+                continue  # try again next beat; the lease has slack
+            for job_id in lost:
+                with self._lock:
+                    token = self._active.get(job_id)
+                if token is not None:
+                    token.cancel()
@@ -0,0 +1,119 @@
+import base64
+import http.server
+import io
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+ImageDraw = pytest.importorskip("PIL.ImageDraw")
+
+
+def png_bytes(size=(64, 48), color="white") -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", size, color).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def draw_page(path: Path, text: bool = False, size=(600, 900)) -> Path:
+    """A page with framed panels and line art; `text` adds a lettered balloon."""
+    page = Image.new("L", size, 255)
+    draw = ImageDraw.Draw(page)
+    w, h = size
+    draw.rectangle((20, 20, w - 20, h // 2 - 10), outline=0, width=4)
+    draw.rectangle((20, h // 2 + 10, w - 20, h - 20), outline=0, width=4)
+    draw.line((60, h - 60, w - 60, h // 2 + 60), fill=0, width=3)
+    draw.ellipse((w - 260, h - 240, w - 80, h - 80), outline=0, width=3)
+    if text:
+        draw.ellipse((50, 50, 330, 230), fill=255, outline=0, width=3)
+        for row, line in enumerate(["WHAT ARE YOU", "DOING HERE?", "GET OUT!"]):
+            draw.text((90, 90 + row * 36), line, fill=0, font_size=24)
+    page.save(path)
+    return path
+
+
+class FakeApi:
+    """Minimal OpenAI-compatible server: canned chat replies, white edited images."""
+
+    def __init__(self) -> None:
+        self.calls: List[Dict[str, Any]] = []
+        self.edit_size = (64, 48)
+        self.chat_reply = "translated"
+        # Seconds to wait before replying.
+        self.delay = 0.0
+        api = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self) -> None:
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                api.calls.append({"path": self.path, "body": body})
+                time.sleep(api.delay)
+                if self.path.endswith("/chat/completions"):
+                    out = {
+                        "choices": [{"message": {"content": api.chat(json.loads(body))}}],
+                        "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+                    }
+                else:
+                    image = base64.b64encode(png_bytes(api.edit_size)).decode("ascii")
+                    out = {"data": [{"b64_json": image}]}
+                data = json.dumps(out).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/v1"
+        threading.Thread(
+            target=self.server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+        ).start()
+
+    def chat(self, payload: Dict[str, Any]) -> str:
+        messages = payload["messages"]
+        system = messages[0]["content"] if messages else ""
+        if isinstance(system, str) and "Extract every speech balloon" in system:
+            return json.dumps(
+                [{"text": "GET OUT!", "position": "top left", "box": [80, 50, 560, 260]}]
+            )
+        if isinstance(system, str) and "arrays of translations" in system:
+            count = len(json.loads(messages[-1]["content"]))
+            return json.dumps({"zh": [f"zh-{i}" for i in range(count)]})
+        return self.chat_reply
+
+    def paths(self) -> List[str]:
+        return [call["path"].rsplit("/", 1)[-1] for call in self.calls]
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def fake_api():
+    api = FakeApi()
+    yield api
+    api.close()
+
+
+@pytest.fixture
+def api_env(monkeypatch, fake_api):
+    """Point `ApiConfig.from_env` at the fake server, with no stray settings."""
+    import os
+
+    for name in list(os.environ):
+        if name.startswith(("NYAMANGA_", "EPHONE_", "OPENAI_")):
+            monkeypatch.delenv(name)
+    monkeypatch.setenv("NYAMANGA_API_KEY", "test-key")
+    monkeypatch.setenv("NYAMANGA_BASE_URL", fake_api.url)
+    monkeypatch.setenv("NYAMANGA_HISTORY", "")
+    return fake_api
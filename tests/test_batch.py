@@ -0,0 +1,177 @@
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from nyamanga.batch import BatchQueue, ItemStatus
+from nyamanga.config import ApiConfig
+from nyamanga.pack import ChapterPack
+from nyamanga.pipeline import PanelResult, TypesettingPipeline
+
+from conftest import draw_page
+
+
+class CancelledInFlight(TypesettingPipeline):
+    """Returns a result after the item was cancelled mid-request."""
+
+    queue = None
+
+    def localize_panel(self, image_path, **options):
+        self.queue.cancel(self.queue.items[0])
+        return PanelResult("", "aGk=", {}, {})
+
+    def save_result(self, result, path, options=None):
+        raise AssertionError("a cancelled item must not be written")
+
+
+@pytest.mark.parametrize("packed", [False, True])
+def test_item_cancelled_in_flight_is_not_saved(api_env, tmp_path, packed):
+    page = draw_page(tmp_path / "page.png")
+    pipeline = CancelledInFlight(ApiConfig.from_env())
+    pack = ChapterPack(tmp_path / "ch.nyapack") if packed else None
+    queue = BatchQueue(pipeline, workers=1, output_dir=tmp_path / "out", pack=pack)
+    pipeline.queue = queue
+
+    (item,) = queue.enqueue([page])
+    queue.start()
+    item._future.result(timeout=5)
+
+    assert item.status == ItemStatus.CANCELLED
+    assert item.result is None
+    assert not (tmp_path / "out").exists()
+    if pack is not None:
+        assert len(pack) == 0
+    pipeline.close()
+
+
+class Timed(TypesettingPipeline):
+    """Takes `delay` seconds per item and records when each one ran."""
+
+    delay = 0.1
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.spans = {}
+
+    def localize_panel(self, image_path, **options):
+        started = time.monotonic()
+        time.sleep(self.delay)
+        self.spans[image_path.name] = (started, time.monotonic())
+        return PanelResult("", "aGk=", {}, {})
+
+
+def _overlap(spans):
+    """Most intervals open at once."""
+    events = sorted([(start, 1) for start, _ in spans] + [(end, -1) for _, end in spans])
+    running = peak = 0
+    for _, step in events:
+        running += step
+        peak = max(peak, running)
+    return peak
+
+
+def test_set_workers_moves_waiting_items_to_the_new_pool(api_env, tmp_path):
+    pipeline = Timed(ApiConfig.from_env())
+    queue = BatchQueue(pipeline, workers=3)
+    items = queue.enqueue([tmp_path / f"p{i}.png" for i in range(9)])
+    queue.start()
+    time.sleep(0.03)
+    first = {item.image_path.name for item in items if item.status == ItemStatus.RUNNING}
+    queue.set_workers(1)
+
+    deadline = time.monotonic() + 10
+    while queue.busy and time.monotonic() < deadline:
+        time.sleep(0.02)
+
+    assert [item.status for item in items] == [ItemStatus.DONE] * 9
+    rest = [span for name, span in pipeline.spans.items() if name not in first]
+    # Everything that was still waiting ran one at a time on the resized pool.
+    assert len(rest) == 6 and _overlap(rest) == 1
+    queue.shutdown()
+    pipeline.close()
+
+
+class SlowWrite(TypesettingPipeline):
+    """Hands back write futures that the test settles by hand."""
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.writes = []
+
+    def localize_panel(self, image_path, **options):
+        return PanelResult(f"attempt {len(self.writes)}", "aGk=", {}, {})
+
+    def save_result(self, result, path, options=None):
+        write = Future()
+        self.writes.append(write)
+        return write
+
+
+def test_stale_write_does_not_settle_a_retried_item(api_env, tmp_path):
+    page = draw_page(tmp_path / "page.png")
+    pipeline = SlowWrite(ApiConfig.from_env())
+    queue = BatchQueue(pipeline, workers=1, output_dir=tmp_path / "out")
+
+    (item,) = queue.enqueue([page])
+    queue.start()
+    item._future.result(timeout=5)
+    queue.cancel(item)
+    assert queue.retry(item)
+    item._future.result(timeout=5)
+    stale, fresh = pipeline.writes
+
+    stale.set_result(tmp_path / "out" / "stale.png")
+    assert item.status == ItemStatus.RUNNING
+    fresh.set_result(tmp_path / "out" / "fresh.png")
+    assert item.status == ItemStatus.DONE
+    assert item.output_path.name == "fresh.png"
+    assert item.result.rewritten_text == "attempt 1"
+    pipeline.close()
+
+
+class Gated(TypesettingPipeline):
+    """Blocks the first item until `gate` is set."""
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.started = threading.Event()
+        self.gate = threading.Event()
+
+    def localize_panel(self, image_path, **options):
+        if not self.started.is_set():
+            self.started.set()
+            assert self.gate.wait(5)
+        return PanelResult("", "aGk=", {}, {})
+
+
+class TrackedPack(ChapterPack):
+    closed = False
+
+    def close(self):
+        self.closed = True
+        super().close()
+
+
+def test_running_items_finish_into_the_pack_they_started_with(api_env, tmp_path):
+    pages = [draw_page(tmp_path / f"p{n}.png") for n in range(2)]
+    pipeline = Gated(ApiConfig.from_env())
+    first = TrackedPack(tmp_path / "a.nyapack")
+    queue = BatchQueue(pipeline, workers=1, pack=first)
+    running, waiting = queue.enqueue(pages)
+    queue.start()
+    assert pipeline.started.wait(5)
+
+    second = TrackedPack(tmp_path / "b.nyapack")
+    queue.set_pack(second)
+    assert not first.closed
+    pipeline.gate.set()
+    deadline = time.monotonic() + 5
+    while not (first.closed and waiting.status == ItemStatus.DONE):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    assert running.output_path == first.path and ("p0.png", "zh") in first
+    assert waiting.output_path == second.path and ("p1.png", "zh") in second
+    assert first.closed and not second.closed
+    pipeline.close()
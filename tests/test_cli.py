@@ -0,0 +1,41 @@
+import json
+
+from nyamanga.cli import main
+
+from conftest import draw_page
+
+
+def test_localize_without_text_passes_textless_page_through(api_env, tmp_path, capsys):
+    page = draw_page(tmp_path / "page.png")
+    output = tmp_path / "out.png"
+
+    code = main(["localize", str(page), "--triage", "skip", "--output", str(output)])
+
+    assert code == 0
+    assert "passed through unchanged" in capsys.readouterr().out
+    assert output.read_bytes() == page.read_bytes()
+    assert api_env.calls == []
+
+
+def test_plan_runs_without_an_api_key(api_env, monkeypatch, tmp_path, capsys):
+    monkeypatch.delenv("NYAMANGA_API_KEY")
+    page = draw_page(tmp_path / "page.png", text=True)
+
+    code = main(["plan", str(page), "--json"])
+
+    assert code == 0
+    assert json.loads(capsys.readouterr().out)["jobs"] == 1
+    assert api_env.calls == []
+
+
+def test_localize_without_text_in_phased_auto_mode(api_env, tmp_path, capsys):
+    page = draw_page(tmp_path / "page.png", text=True)
+    output = tmp_path / "out.png"
+
+    code = main(["localize", str(page), "--auto-mode", "phased", "--output", str(output)])
+
+    assert code == 0
+    assert "Rewritten text: zh-0" in capsys.readouterr().out
+    assert output.exists()
+    # Extraction and translation chat calls, then one edit that only typesets.
+    assert api_env.paths() == ["completions", "completions", "edits"]
@@ -0,0 +1,63 @@
+import threading
+import time
+
+import pytest
+
+from nyamanga.cancel import Cancelled, CancelToken, DeadlineExceeded
+from nyamanga.client import NyaMangaClient
+from nyamanga.config import ApiConfig
+
+
+def _request_threads():
+    return [thread for thread in threading.enumerate() if thread.name == "nyamanga-http"]
+
+
+def test_cancel_aborts_the_request_in_flight(api_env):
+    api_env.delay = 5.0
+    token = CancelToken()
+    threading.Timer(0.2, token.cancel).start()
+
+    with NyaMangaClient(ApiConfig.from_env()) as client:
+        started = time.monotonic()
+        with pytest.raises(Cancelled):
+            client.chat_completion([{"role": "user", "content": "hi"}], cancel=token)
+        assert time.monotonic() - started < 2.0
+
+        # The helper thread's connection was shut down, so it ends long before the reply.
+        deadline = time.monotonic() + 2.0
+        while _request_threads() and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert not _request_threads()
+
+
+def test_deadline_cuts_a_slow_request_short(api_env):
+    api_env.delay = 5.0
+    token = CancelToken.with_timeout(0.3)
+
+    with NyaMangaClient(ApiConfig.from_env()) as client:
+        started = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            client.chat_completion([{"role": "user", "content": "hi"}], cancel=token)
+        assert time.monotonic() - started < 2.0
+
+
+def test_expired_token_sends_nothing(api_env):
+    token = CancelToken(deadline=time.monotonic() - 1)
+    late = []
+    token.add_callback(lambda: late.append(True))
+
+    with NyaMangaClient(ApiConfig.from_env()) as client:
+        with pytest.raises(DeadlineExceeded):
+            client.chat_completion([{"role": "user", "content": "hi"}], cancel=token)
+    assert api_env.calls == []
+    assert token.remaining() == 0.0 and token.timeout_for(30) == 0.0
+    token.cancel()
+    token.cancel()
+    assert late == [True]
+
+
+def test_streaming_chat_is_rejected(api_env):
+    with NyaMangaClient(ApiConfig.from_env()) as client:
+        with pytest.raises(ValueError, match="stream"):
+            client.chat_completion([{"role": "user", "content": "hi"}], stream=True)
+    assert api_env.calls == []
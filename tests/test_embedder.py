@@ -0,0 +1,66 @@
+import json
+
+from nyamanga.client import NyaMangaClient
+from nyamanga.config import ApiConfig
+from nyamanga.embedder import DialogueSession, MangaEmbedder
+
+
+def test_session_prompt_only_grows_at_the_end(api_env):
+    api_env.chat_reply = json.dumps({"lines": ["健二来了"], "terms": {"Kenji": "健二"}})
+    embedder = MangaEmbedder(NyaMangaClient(ApiConfig.from_env()))
+    session = embedder.session(target_language="zh", speakers={"Aya": "calm"})
+
+    session.rewrite("Kenji is here.", speaker="Aya")
+    before = session.system_prompt()
+    assert "Kenji => 健二" in before
+
+    session.rewrite("Hey!", speaker="Kenji")
+    after = session.system_prompt()
+
+    assert after != before
+    assert after.startswith(before)
+    assert after.endswith("- Character: Kenji")
+
+
+def _session(**kwargs):
+    embedder = MangaEmbedder(NyaMangaClient(ApiConfig.from_env()))
+    return DialogueSession(embedder, target_language="zh", **kwargs)
+
+
+def _user_messages(api):
+    return [json.loads(call["body"])["messages"][1]["content"] for call in api.calls]
+
+
+def test_session_sends_a_page_in_one_call_with_recent_context(api_env):
+    api_env.chat_reply = json.dumps({"lines": ["一", "二"]})
+    session = _session(context_lines=2)
+
+    session.rewrite_lines(["One.", "Two."], ["Aya", None])
+    session.rewrite("Three.")
+
+    first, second = _user_messages(api_env)
+    assert "Recent lines" not in first
+    assert "1. Aya: One.\n2. Two." in first
+    assert "Aya: One. => 一\nTwo. => 二" in second
+    assert session.stats()["calls"] == 2
+
+
+def test_lines_missing_from_the_reply_fall_back_to_their_own_call(api_env):
+    api_env.chat_reply = json.dumps({"lines": ["一"]})
+    session = _session()
+
+    results = session.rewrite_lines(["One.", "Two."])
+
+    assert results[0].text == "一"
+    assert len(api_env.calls) == 2
+    assert "Two." in json.loads(api_env.calls[1]["body"])["messages"][-1]["content"]
+
+
+def test_glossary_stops_growing_at_its_cap(api_env):
+    terms = {f"Name{n}": f"名{n}" for n in range(5)}
+    api_env.chat_reply = json.dumps({"lines": ["好"], "terms": terms})
+    session = _session(glossary={"Aya": "彩"}, max_glossary=3)
+
+    session.rewrite("Hi.")
+
+    assert list(session.glossary) == ["Aya", "Name0", "Name1"]
@@ -0,0 +1,79 @@
+import base64
+import io
+import os
+
+import pytest
+from PIL import Image
+
+from nyamanga.client import UploadFile
+from nyamanga.imaging import ImageWorkerPool, OutputOptions, encode_image_bytes, write_output
+from nyamanga.triage import reassemble
+
+from conftest import png_bytes
+
+np = pytest.importorskip("numpy")
+
+
+def _noise_png(size) -> bytes:
+    pixels = np.random.default_rng(0).integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _blocks():
+    return {name for name in os.listdir("/dev/shm") if name.startswith("psm_")}
+
+
+@pytest.mark.skipif(not os.path.isdir("/dev/shm"), reason="needs POSIX shared memory")
+def test_pool_results_come_back_intact_without_leaking_blocks():
+    page = _noise_png((600, 400))
+    patch = base64.b64encode(png_bytes((100, 100), "red")).decode("ascii")
+    before = _blocks()
+    pool = ImageWorkerPool(workers=1, max_dimension=300)
+    try:
+        prepared, _ = pool.prepare(UploadFile("page.png", page))
+        with Image.open(io.BytesIO(prepared.data)) as img:
+            assert img.size == (300, 200)
+        local = reassemble(page, [((0, 0, 100, 100), patch)])
+        assert len(local) > 64 * 1024  # large enough to come back through a block
+        assert pool.analyze(reassemble, page, [((0, 0, 100, 100), patch)]) == local
+        options = OutputOptions(format="png", compress_level=0)
+        expected = encode_image_bytes(base64.b64decode(local), options)
+        assert pool.encode(local, options).result() == expected
+    finally:
+        pool.close()
+    assert _blocks() <= before
+
+
+def test_default_output_passes_bytes_through_untouched():
+    data = png_bytes((40, 30), "white")
+
+    assert encode_image_bytes(data, OutputOptions()) == (data, "png")
+
+
+@pytest.mark.parametrize("fmt, magic", [("jpeg", b"\xff\xd8\xff"), ("webp", b"RIFF")])
+def test_reencoding_changes_format_and_caps_the_longest_side(fmt, magic):
+    data, written = encode_image_bytes(
+        png_bytes((400, 200), "red"), OutputOptions(format=fmt, max_dimension=100)
+    )
+
+    assert written == fmt and data.startswith(magic)
+    with Image.open(io.BytesIO(data)) as img:
+        assert img.size == (100, 50)
+
+
+def test_unknown_output_format_is_rejected():
+    with pytest.raises(ValueError):
+        OutputOptions(format="bmp")
+
+
+def test_written_suffix_follows_the_encoded_format(tmp_path):
+    image_b64 = base64.b64encode(png_bytes((20, 20), "blue"))
+
+    webp = write_output(image_b64, tmp_path / "out.png", OutputOptions(format="webp"))
+    jpeg = write_output(image_b64, tmp_path / "sub" / "b.JPEG", OutputOptions(format="jpeg"))
+
+    assert webp == tmp_path / "out.webp" and webp.read_bytes()[8:12] == b"WEBP"
+    assert jpeg == tmp_path / "sub" / "b.JPEG" and jpeg.exists()
+    assert not (tmp_path / "out.png").exists()
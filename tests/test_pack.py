@@ -0,0 +1,91 @@
+import json
+import threading
+import zipfile
+from concurrent.futures import Future
+
+import pytest
+
+from nyamanga.pack import ChapterPack
+
+
+def test_appends_survive_reopening(tmp_path):
+    with ChapterPack(tmp_path / "ch.nyapack") as pack:
+        pack.add("p1.png", b"one", "en")
+        pack.add("p2.png", b"two", "en")
+        pack.add("p1.png", b"one again", "en")
+
+    with ChapterPack(tmp_path / "ch.nyapack", readonly=True) as pack:
+        assert [entry.page for entry in pack.entries()] == ["p1.png", "p2.png"]
+        assert bytes(pack.read("p1.png", "en")) == b"one again"
+        assert bytes(pack.read("p2.png", "en")) == b"two"
+        with pytest.raises(PermissionError):
+            pack.add("p3.png", b"three", "en")
+
+
+def test_index_cut_short_by_a_crash_is_skipped(tmp_path):
+    with ChapterPack(tmp_path / "ch.nyapack") as pack:
+        pack.add("p1.png", b"one", "en")
+    index = tmp_path / "ch.nyapack" / "index.jsonl"
+    line = json.dumps({"page": "p2.png", "language": "en", "offset": 3})
+    with index.open("a", encoding="utf-8") as fh:
+        fh.write(line[: len(line) // 2])
+
+    with ChapterPack(tmp_path / "ch.nyapack") as pack:
+        assert pack.get("p2.png", "en") is None
+        pack.add("p3.png", b"three", "en")
+    with ChapterPack(tmp_path / "ch.nyapack", readonly=True) as pack:
+        assert [entry.page for entry in pack.entries()] == ["p1.png", "p3.png"]
+        assert bytes(pack.read("p3.png", "en")) == b"three"
+
+
+def test_concurrent_encoded_adds_all_land(tmp_path):
+    pack = ChapterPack(tmp_path / "ch.nyapack")
+    encoded = [Future() for _ in range(40)]
+    packed = [
+        pack.add_encoded(fut, f"p{n}.png", "en", params={"n": n})
+        for n, fut in enumerate(encoded)
+    ]
+    threads = [
+        threading.Thread(target=fut.set_result, args=((f"page {n}".encode(), "png"),))
+        for n, fut in enumerate(encoded)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    entries = [fut.result(timeout=5) for fut in packed]
+    assert len(pack) == 40
+    for n, entry in enumerate(entries):
+        assert entry.params == {"n": n}
+        assert bytes(pack.view(entry)) == f"page {n}".encode()
+    pack.close()
+
+
+def test_failed_encode_fails_the_add(tmp_path):
+    pack = ChapterPack(tmp_path / "ch.nyapack")
+    encoded = Future()
+    packed = pack.add_encoded(encoded, "p1.png", "en")
+    encoded.set_exception(OSError("disk full"))
+    with pytest.raises(OSError):
+        packed.result(timeout=5)
+    assert len(pack) == 0
+
+
+def test_export_cbz_orders_pages_naturally(tmp_path):
+    with ChapterPack(tmp_path / "ch.nyapack") as pack:
+        for n in (10, 2, 1):
+            pack.add(f"p{n}.png", f"page {n}".encode(), "en", fmt="png")
+        pack.add("p1.png", b"autre", "fr", fmt="png")
+
+        with pytest.raises(ValueError):
+            pack.export_cbz(tmp_path / "ch.cbz")
+        path = pack.export_cbz(tmp_path / "ch.cbz", "en")
+
+    with zipfile.ZipFile(path) as archive:
+        assert archive.namelist() == ["001.png", "002.png", "003.png"]
+        assert [archive.read(name) for name in archive.namelist()] == [
+            b"page 1",
+            b"page 2",
+            b"page 10",
+        ]
@@ -0,0 +1,89 @@
+import base64
+import io
+
+import pytest
+from PIL import Image
+
+from nyamanga.phash import PhashIndex, perceptual_hash
+
+from conftest import draw_page, png_bytes
+
+pytest.importorskip("numpy")
+
+
+def _encoded(path, size=None, fmt="PNG", quality=90):
+    with Image.open(path) as img:
+        img = img.convert("RGB")
+        if size is not None:
+            img = img.resize(size, Image.LANCZOS)
+        buf = io.BytesIO()
+        img.save(buf, format=fmt, quality=quality)
+    return buf.getvalue()
+
+
+def _distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+def test_hash_survives_rescaling_and_recompression(tmp_path):
+    page = draw_page(tmp_path / "page.png")
+    lettered = draw_page(tmp_path / "lettered.png", text=True)
+
+    original, size = perceptual_hash(page.read_bytes())
+    smaller, small_size = perceptual_hash(_encoded(page, (300, 450), "JPEG", quality=60))
+    other, _ = perceptual_hash(lettered.read_bytes())
+
+    assert size == (600, 900) and small_size == (300, 450)
+    assert _distance(original, smaller) <= 4
+    assert _distance(original, other) > 6
+
+
+def test_lookup_respects_threshold_and_key():
+    index = PhashIndex(threshold=6)
+    index.add(0b1111, "key", (64, 48), base64.b64encode(png_bytes()).decode(), "hi", "p1")
+
+    entry, distance = index.lookup(0b1111 ^ 0b111 << 20, "key")
+    assert entry.source == "p1" and distance == 3
+    assert index.lookup(0b1111 ^ 0b1111111 << 20, "key") is None
+    assert index.lookup(0b1111, "other key") is None
+
+
+def test_reused_image_is_rescaled_to_the_new_input():
+    index = PhashIndex()
+    index.add(1, "key", (100, 50), base64.b64encode(png_bytes((200, 100))).decode())
+    entry, _ = index.lookup(1, "key")
+
+    same = index.image_b64(entry, (100, 50))
+    half = index.image_b64(entry, (50, 25))
+
+    assert Image.open(io.BytesIO(base64.b64decode(same))).size == (200, 100)
+    assert Image.open(io.BytesIO(base64.b64decode(half))).size == (100, 50)
+
+
+def test_persisted_index_reloads_and_skips_a_torn_line(tmp_path):
+    data = png_bytes((32, 32), "red")
+    index = PhashIndex(directory=tmp_path)
+    index.add(7, "key", (32, 32), base64.b64encode(data).decode(), "text", "p7")
+    with (tmp_path / "index.jsonl").open("a", encoding="utf-8") as fh:
+        fh.write('{"phash": "00000000000000')
+
+    reloaded = PhashIndex(directory=tmp_path)
+    entry, distance = reloaded.lookup(7, "key")
+    assert len(reloaded) == 1 and distance == 0
+    assert entry.rewritten_text == "text"
+    assert base64.b64decode(reloaded.image_b64(entry)) == data
+
+
+def test_index_keeps_only_the_newest_entries(tmp_path):
+    image = base64.b64encode(png_bytes()).decode()
+    index = PhashIndex(directory=tmp_path, max_entries=4)
+    for n in range(1, 101):
+        # Far-apart hashes so each lookup can only match its own entry.
+        index.add(n * 0x0101010101010101, "key", (64, 48), image, source=f"p{n}")
+
+    assert len(index) == 4
+    assert index.lookup(0x0101010101010101, "key") is None
+    assert index.lookup(100 * 0x0101010101010101, "key")[0].source == "p100"
+    reloaded = PhashIndex(directory=tmp_path, max_entries=4)
+    assert [entry.source for entry in reloaded._entries] == ["p97", "p98", "p99", "p100"]
+    assert len(list(tmp_path.iterdir())) == 5  # four images plus the index
@@ -0,0 +1,72 @@
+import base64
+import dataclasses
+import json
+
+from nyamanga.config import ApiConfig
+from nyamanga.pipeline import TypesettingPipeline
+
+from conftest import draw_page
+
+
+def test_skipped_page_keeps_original_bytes_when_uploads_are_downscaled(api_env, tmp_path):
+    page = draw_page(tmp_path / "page.png", size=(1200, 1800))
+    config = dataclasses.replace(
+        ApiConfig.from_env(), triage="skip", max_upload_dimension=512
+    )
+
+    with TypesettingPipeline(config) as pipeline:
+        result = pipeline.localize_panel(page)
+
+    assert result.skipped
+    assert base64.b64decode(result.edited_image_b64) == page.read_bytes()
+    assert api_env.calls == []
+
+
+def test_latency_history_is_only_written_when_configured(api_env, monkeypatch, tmp_path):
+    monkeypatch.delenv("NYAMANGA_HISTORY")
+    monkeypatch.setenv("HOME", str(tmp_path / "home"))
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    with TypesettingPipeline(ApiConfig.from_env()) as pipeline:
+        pipeline.embedder.rewrite_dialogue("hello", "zh", "plain")
+    assert pipeline.config.history_path is None
+    assert not (tmp_path / "home").exists() and not (tmp_path / "cache").exists()
+
+    history = tmp_path / "latency.json"
+    monkeypatch.setenv("NYAMANGA_HISTORY", str(history))
+    with TypesettingPipeline(ApiConfig.from_env()) as pipeline:
+        pipeline.embedder.rewrite_dialogue("hello", "zh", "plain")
+    assert list(json.loads(history.read_text())) == ["chat/completions"]
+
+
+def test_skipped_pages_are_not_offered_for_reuse(api_env, tmp_path):
+    page = draw_page(tmp_path / "page.png")
+    config = dataclasses.replace(ApiConfig.from_env(), triage="skip", dedupe_threshold=6)
+
+    with TypesettingPipeline(config) as pipeline:
+        assert pipeline.localize_panel(page).skipped
+        assert len(pipeline.dedupe) == 0
+
+
+def test_multi_language_run_translates_once_and_edits_per_language(api_env, tmp_path):
+    page = draw_page(tmp_path / "page.png", text=True)
+    api_env.chat_reply = json.dumps({"zh": "你好", "en": "hello"})
+
+    with TypesettingPipeline(ApiConfig.from_env()) as pipeline:
+        results = pipeline.localize_panel_multi(page, ["zh", "en", "zh"], source_text="hi")
+
+    assert list(results) == ["zh", "en"]
+    assert [results[lang].rewritten_text for lang in results] == ["你好", "hello"]
+    assert sorted(api_env.paths()) == ["completions", "edits", "edits"]
+
+
+def test_languages_missing_from_the_reply_are_translated_on_their_own(api_env, tmp_path):
+    page = draw_page(tmp_path / "page.png", text=True)
+    api_env.chat_reply = json.dumps({"zh": "你好"})
+
+    with TypesettingPipeline(ApiConfig.from_env()) as pipeline:
+        results = pipeline.localize_panel_multi(page, ["zh", "ko"], source_text="hi")
+
+    assert results["zh"].rewritten_text == "你好"
+    # The fallback call gets the same canned reply.
+    assert results["ko"].rewritten_text == api_env.chat_reply
+    assert api_env.paths().count("completions") == 2
@@ -0,0 +1,83 @@
+import dataclasses
+
+from nyamanga.config import ApiConfig
+from nyamanga.pipeline import TypesettingPipeline
+from nyamanga.planner import CHAT, EDIT, Planner
+from nyamanga.resilience import LatencyHistory
+
+from conftest import draw_page
+
+
+def _history(tmp_path, chat=2.0, edit=10.0):
+    history = LatencyHistory(tmp_path / "latency.json")
+    history.add(CHAT, [chat] * 5)
+    history.add(EDIT, [edit] * 5)
+    return history
+
+
+def _plan(jobs, history=None, workers=1, **config):
+    config = dataclasses.replace(ApiConfig.from_env(), **config)
+    with TypesettingPipeline(config) as pipeline:
+        return Planner(pipeline, workers=workers, history=history).plan(jobs)
+
+
+def test_estimates_requests_bytes_and_time_from_recorded_latency(api_env, tmp_path):
+    page = draw_page(tmp_path / "page.png", text=True)
+
+    plan = _plan(
+        [{"image": str(page), "text": "hello", "target_language": "zh,en"}],
+        history=_history(tmp_path),
+    )
+
+    assert plan.requests == {CHAT: 1, EDIT: 2}
+    assert plan.pages[0].upload_bytes > 2 * page.stat().st_size
+    assert plan.pages[0].outputs == [
+        str(tmp_path / "page_localized_zh.png"),
+        str(tmp_path / "page_localized_en.png"),
+    ]
+    # One chat call then the edits in parallel: the page's own latency wins
+    # over 22 request-seconds spread across its two edit slots.
+    assert plan.estimated_seconds == 12.0
+    assert plan.assumed == []
+    assert api_env.calls == []
+
+
+def test_textless_and_near_duplicate_pages_need_no_requests(api_env, tmp_path):
+    blank = draw_page(tmp_path / "blank.png")
+    first = draw_page(tmp_path / "first.png", text=True)
+    copy = draw_page(tmp_path / "copy.png", text=True)
+
+    plan = _plan(
+        [{"image": str(blank)}, {"image": str(first)}, {"image": str(copy)}],
+        triage="skip",
+        dedupe_threshold=4,
+    )
+
+    skipped, needed, reused = plan.pages
+    assert skipped.skipped and not skipped.needs_api
+    assert needed.requests == {EDIT: 1}
+    assert reused.reused == ["zh"] and not reused.needs_api
+    assert plan.to_dict()["needs_api"] == 1
+
+
+def test_warns_about_failures_overwrites_budget_and_assumed_latency(api_env, tmp_path):
+    page = draw_page(tmp_path / "page.png", text=True)
+    (tmp_path / "page_localized.png").write_bytes(b"old")
+
+    plan = _plan(
+        [
+            {"image": str(page), "text": "hi"},
+            {"image": str(tmp_path / "missing.png"), "text": "hi"},
+            {"type": "embed", "text": "hi"},
+        ],
+        budget_requests=1,
+    )
+
+    assert plan.pages[1].error.startswith("FileNotFoundError")
+    assert plan.pages[2].error == "ValueError: embed jobs need an image path"
+    warnings = plan.warnings()
+    assert warnings[0].startswith("2 job(s) would fail before any request")
+    assert "1 output file(s) already exist" in warnings[1]
+    assert "exceed the request budget (1)" in warnings[2]
+    assert "using rough defaults" in warnings[3]
+    assert "Warning: " in plan.summary()
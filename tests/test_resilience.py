@@ -0,0 +1,41 @@
+import time
+
+import pytest
+
+from nyamanga.resilience import CircuitBreaker, CircuitOpen
+
+
+def test_open_breaker_reports_remaining_cooldown():
+    breaker = CircuitBreaker(failure_threshold=1, reset_after=30.0)
+    breaker.record_failure()
+
+    with pytest.raises(CircuitOpen, match=r"retrying in (29|30)s"):
+        breaker.before_call("images/edits")
+
+
+def test_half_open_breaker_reports_probe_in_progress():
+    breaker = CircuitBreaker(failure_threshold=1, reset_after=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+
+    breaker.before_call("images/edits")  # admitted as the probe
+    with pytest.raises(CircuitOpen, match="probe request is in progress"):
+        breaker.before_call("images/edits")
+
+    breaker.record_success()
+    breaker.before_call("images/edits")
+
+
+def test_only_the_probe_frees_the_half_open_slot():
+    breaker = CircuitBreaker(failure_threshold=1, reset_after=0.05)
+    assert breaker.before_call() is False  # admitted while closed
+    breaker.record_failure()
+    time.sleep(0.06)
+
+    assert breaker.before_call() is True
+    breaker.release()  # the call admitted earlier is cancelled
+    with pytest.raises(CircuitOpen, match="probe request is in progress"):
+        breaker.before_call()
+
+    breaker.release(probe=True)
+    assert breaker.before_call() is True
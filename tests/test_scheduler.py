@@ -0,0 +1,118 @@
+import threading
+import time
+
+import pytest
+
+from nyamanga.cancel import Cancelled, CancelToken
+from nyamanga.scheduler import Budget, BudgetExceeded, Priority, Scheduler
+
+
+def _acquire_later(scheduler, priority, admitted, **kwargs):
+    """Start a thread that takes a slot and appends `priority` once admitted."""
+
+    def take():
+        try:
+            scheduler.acquire(priority, **kwargs)
+        except Exception as exc:
+            admitted.append(exc)
+            return
+        admitted.append(priority)
+
+    thread = threading.Thread(target=take)
+    thread.start()
+    return thread
+
+
+def _wait_for_waiters(scheduler, count):
+    deadline = time.monotonic() + 5
+    while sum(scheduler.stats()["waiting"].values()) < count:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_interactive_calls_overtake_queued_batch_calls():
+    scheduler = Scheduler(max_concurrency=1)
+    scheduler.acquire(Priority.BATCH)
+    admitted = []
+    batch = _acquire_later(scheduler, Priority.BATCH, admitted)
+    _wait_for_waiters(scheduler, 1)
+    interactive = _acquire_later(scheduler, Priority.INTERACTIVE, admitted)
+    _wait_for_waiters(scheduler, 2)
+
+    scheduler.release(Priority.BATCH)
+    interactive.join(5)
+    assert admitted == [Priority.INTERACTIVE]
+    scheduler.release(Priority.INTERACTIVE)
+    batch.join(5)
+    assert admitted == [Priority.INTERACTIVE, Priority.BATCH]
+
+
+def test_batch_slots_shrink_as_the_budget_runs_low():
+    budget = Budget(max_requests=1000)
+    scheduler = Scheduler(max_concurrency=8, budget=budget, throttle_below=0.5, pause_below=0.1)
+    assert scheduler.batch_limit() == 8
+    budget.requests = 700
+    assert scheduler.batch_limit() == 4
+    budget.requests = 890
+    assert scheduler.batch_limit() == 1
+
+    scheduler.acquire(Priority.BATCH)
+    admitted = []
+    waiting = _acquire_later(scheduler, Priority.BATCH, admitted)
+    _wait_for_waiters(scheduler, 1)
+    # Interactive work still gets the free slots.
+    scheduler.acquire(Priority.INTERACTIVE)
+    assert admitted == []
+    scheduler.release(Priority.BATCH)
+    waiting.join(5)
+    assert admitted == [Priority.BATCH]
+
+
+def test_paused_batch_waits_for_resume_or_cancel():
+    scheduler = Scheduler(max_concurrency=2)
+    scheduler.pause_batch()
+    admitted = []
+    token = CancelToken()
+    cancelled = _acquire_later(scheduler, Priority.BATCH, admitted, cancel=token)
+    resumed = _acquire_later(scheduler, Priority.BATCH, admitted)
+    _wait_for_waiters(scheduler, 2)
+
+    token.cancel()
+    cancelled.join(5)
+    assert len(admitted) == 1 and isinstance(admitted[0], Cancelled)
+    scheduler.resume_batch()
+    resumed.join(5)
+    assert admitted[1] == Priority.BATCH
+
+
+def test_spent_budgets_raise_instead_of_waiting():
+    budget = Budget(max_requests=10, requests=9)
+    scheduler = Scheduler(max_concurrency=2, budget=budget, pause_below=0.2)
+    with pytest.raises(BudgetExceeded, match="interactive"):
+        scheduler.acquire(Priority.BATCH)
+
+    scheduler.acquire(Priority.INTERACTIVE)
+    scheduler.release(Priority.INTERACTIVE)
+    with pytest.raises(BudgetExceeded, match="Global budget exhausted"):
+        scheduler.acquire(Priority.INTERACTIVE)
+
+    job = Budget(max_tokens=100)
+    scheduler.set_budget(Budget())
+    scheduler.record({"usage": {"prompt_tokens": 60, "completion_tokens": 40}}, job)
+    with pytest.raises(BudgetExceeded, match="Job budget exhausted"):
+        scheduler.acquire(Priority.BATCH, budget=job)
+
+
+def test_waiting_batch_call_fails_when_interactive_work_spends_the_budget():
+    budget = Budget(max_requests=10)
+    scheduler = Scheduler(max_concurrency=1, budget=budget, pause_below=0.2)
+    scheduler.acquire(Priority.INTERACTIVE)
+    admitted = []
+    waiting = _acquire_later(scheduler, Priority.BATCH, admitted)
+    _wait_for_waiters(scheduler, 1)
+
+    budget.requests = 9
+    scheduler.release(Priority.INTERACTIVE)
+    waiting.join(5)
+    assert not waiting.is_alive()
+    assert len(admitted) == 1 and isinstance(admitted[0], BudgetExceeded)
@@ -0,0 +1,88 @@
+import base64
+import threading
+
+import pytest
+import requests
+
+from nyamanga.config import ApiConfig
+from nyamanga.pipeline import TypesettingPipeline
+from nyamanga.server import JobManager, make_server
+
+from conftest import png_bytes
+
+
+@pytest.fixture
+def make_manager(api_env):
+    managers = []
+
+    def make(**kwargs):
+        manager = JobManager(TypesettingPipeline(ApiConfig.from_env()), workers=1, **kwargs)
+        managers.append(manager)
+        return manager
+
+    yield make
+    for manager in managers:
+        manager.shutdown()
+        manager.pipeline.close()
+
+
+def test_image_paths_are_refused_without_an_upload_root(make_manager, tmp_path):
+    page = tmp_path / "page.png"
+    page.write_bytes(png_bytes())
+
+    with pytest.raises(ValueError, match="image_path"):
+        make_manager().submit({"image_path": str(page)})
+
+
+def test_image_paths_must_stay_inside_the_upload_root(make_manager, tmp_path):
+    root = tmp_path / "uploads"
+    root.mkdir()
+    (root / "page.png").write_bytes(png_bytes())
+    (tmp_path / "secret.png").write_bytes(png_bytes())
+    manager = make_manager(upload_root=root)
+
+    for path in ("../secret.png", str(tmp_path / "secret.png")):
+        with pytest.raises(ValueError, match="upload root"):
+            manager.submit({"image_path": path})
+    assert manager.submit({"image_path": "page.png"}).image.data == png_bytes()
+
+
+@pytest.mark.parametrize(
+    "budget", [{"max_requests": -1}, {"max_tokens": "10"}, {"max_requests": True}, []]
+)
+def test_budget_limits_must_be_non_negative_numbers(make_manager, budget):
+    image = base64.b64encode(png_bytes()).decode("ascii")
+
+    with pytest.raises(ValueError, match="budget"):
+        make_manager().submit({"image_b64": image, "budget": budget})
+
+
+@pytest.mark.parametrize("deadline", [float("nan"), float("inf"), -5, 0, "soon", True])
+def test_deadline_must_be_a_finite_positive_number(make_manager, deadline):
+    with pytest.raises(ValueError, match="deadline"):
+        make_manager().submit({"type": "rewrite", "source_text": "hi", "deadline": deadline})
+
+
+@pytest.mark.parametrize("field", ["source_text", "target_language", "tone"])
+def test_forwarded_fields_must_be_strings(make_manager, field):
+    payload = {"type": "rewrite", "source_text": "hi", field: ["not", "a", "string"]}
+
+    with pytest.raises(ValueError, match=f"{field} must be a string"):
+        make_manager().submit(payload)
+
+
+def test_bad_payloads_get_a_400(make_manager):
+    server = make_server(make_manager(), port=0)
+    threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}).start()
+    try:
+        resp = requests.post(
+            f"http://127.0.0.1:{server.server_port}/jobs",
+            data=b'{"type": "rewrite", "source_text": "hi", "deadline": NaN}',
+            timeout=5,
+        )
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert resp.status_code == 400
+    assert "deadline" in resp.json()["error"]
@@ -0,0 +1,83 @@
+import json
+import threading
+
+import pytest
+
+from nyamanga.cli import main
+from nyamanga.tracing import Tracer
+
+from conftest import draw_page
+
+
+def _spans(trace, phase="X"):
+    return [event for event in trace["traceEvents"] if event["ph"] == phase]
+
+
+def test_span_records_args_set_inside_the_block_and_errors():
+    tracer = Tracer()
+    with tracer.span("save", "image", page="p1") as args:
+        args["bytes"] = 1024
+    with pytest.raises(KeyError):
+        with tracer.span("parse", "client"):
+            raise KeyError("choices")
+
+    save, parse = _spans(tracer.to_chrome())
+    assert (save["name"], save["cat"]) == ("save", "image")
+    assert save["args"] == {"page": "p1", "bytes": 1024}
+    assert parse["args"] == {"error": "KeyError"}
+    assert save["dur"] >= 0 and parse["ts"] >= save["ts"]
+
+
+def test_disabled_tracer_records_nothing():
+    tracer = Tracer(enabled=False)
+    with tracer.span("save") as args:
+        args["bytes"] = 1
+    tracer.record_async("encode", "image", tracer.now(), tracer.now())
+
+    assert tracer.count == 0
+
+
+def test_each_thread_gets_its_own_named_lane():
+    tracer = Tracer()
+
+    def work():
+        with tracer.span("edit"):
+            pass
+
+    threads = [threading.Thread(target=work, name=f"worker-{n}") for n in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    trace = tracer.to_chrome()
+    lanes = {event["tid"] for event in _spans(trace)}
+    names = {event["tid"]: event["args"]["name"] for event in _spans(trace, "M") if "tid" in event}
+    assert len(lanes) == 3
+    assert sorted(names[lane] for lane in lanes) == ["worker-0", "worker-1", "worker-2"]
+
+
+def test_events_past_the_cap_are_dropped_and_counted():
+    tracer = Tracer(max_events=3)
+    for _ in range(2):
+        tracer.record_async("encode", "image", tracer.now(), tracer.now())
+
+    trace = tracer.to_chrome()
+    assert [event["ph"] for event in trace["traceEvents"] if event["ph"] != "M"] == ["b", "e"]
+    assert trace["otherData"]["dropped_events"] == 2
+
+
+def test_cli_trace_covers_pipeline_and_client_phases(api_env, tmp_path):
+    page = draw_page(tmp_path / "page.png", text=True)
+    trace_path = tmp_path / "trace.json"
+    output = tmp_path / "out.png"
+
+    code = main(["localize", str(page), "hi", "--output", str(output), "--trace", str(trace_path)])
+
+    assert code == 0
+    spans = _spans(json.loads(trace_path.read_text()))
+    names = {event["name"] for event in spans}
+    assert {"localize_panel", "request", "send"} <= names
+    outer = next(event for event in spans if event["name"] == "localize_panel")
+    for request in (event for event in spans if event["name"] == "request"):
+        assert outer["ts"] <= request["ts"] <= outer["ts"] + outer["dur"]
@@ -0,0 +1,61 @@
+import dataclasses
+
+from nyamanga.config import ApiConfig
+from nyamanga.pipeline import TypesettingPipeline
+from nyamanga.translations import TranslationCache
+
+from conftest import draw_page
+
+
+def test_lines_are_keyed_by_language_tone_and_model():
+    cache = TranslationCache()
+    cache.put("GET OUT!", "zh", "plain", "m1", "出去！")
+
+    assert cache.get("  GET OUT!\n", "zh", "plain", "m1") == "出去！"
+    assert cache.get("GET OUT!", "en", "plain", "m1") is None
+    assert cache.get("GET OUT!", "zh", "polite", "m1") is None
+    assert cache.get("GET OUT!", "zh", "plain", "m2") is None
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 3}
+
+
+def test_least_recently_used_lines_are_evicted_first():
+    cache = TranslationCache(max_entries=2)
+    cache.put("a", "zh", "t", "m", "A")
+    cache.put("b", "zh", "t", "m", "B")
+    cache.get("a", "zh", "t", "m")
+    cache.put("c", "zh", "t", "m", "C")
+
+    assert len(cache) == 2
+    assert cache.get("b", "zh", "t", "m") is None
+    assert cache.get("a", "zh", "t", "m") == "A"
+
+
+def test_cache_file_reloads_with_the_latest_translation(tmp_path):
+    path = tmp_path / "cache" / "lines.jsonl"
+    cache = TranslationCache(path)
+    cache.put("hi", "zh", "t", "m", "嗨")
+    cache.put("hi", "zh", "t", "m", "你好")
+    cache.put("hi", "zh", "t", "m", "你好")  # unchanged: not written again
+    with path.open("a", encoding="utf-8") as fh:
+        fh.write('{"key": "torn')
+
+    reloaded = TranslationCache(path)
+    assert reloaded.get("hi", "zh", "t", "m") == "你好"
+    assert len(path.read_text(encoding="utf-8").splitlines()) == 3
+
+
+def test_phased_runs_reuse_cached_translations(api_env, tmp_path):
+    page = draw_page(tmp_path / "page.png", text=True)
+    config = dataclasses.replace(
+        ApiConfig.from_env(),
+        auto_mode="phased",
+        translation_cache=str(tmp_path / "lines.jsonl"),
+    )
+
+    for _ in range(2):
+        with TypesettingPipeline(config) as pipeline:
+            assert pipeline.localize_panel(page).rewritten_text == "zh-0"
+
+    chats = [call["body"] for call in api_env.calls if call["path"].endswith("/chat/completions")]
+    assert sum(b"arrays of translations" in body for body in chats) == 1
+    assert sum(b"Extract every speech balloon" in body for body in chats) == 2
@@ -0,0 +1,72 @@
+from collections import deque
+
+import pytest
+
+from nyamanga.triage import _components, triage_page
+
+from conftest import draw_page
+
+np = pytest.importorskip("numpy")
+
+
+def _flood_fill(binary):
+    """Reference 8-connected labelling, one pixel at a time."""
+    h, w = binary.shape
+    seen = np.zeros_like(binary)
+    boxes = []
+    for y, x in zip(*np.nonzero(binary)):
+        if seen[y, x]:
+            continue
+        seen[y, x] = True
+        todo, pixels = deque([(y, x)]), []
+        while todo:
+            cy, cx = todo.popleft()
+            pixels.append((cy, cx))
+            for ny in range(max(0, cy - 1), min(h, cy + 2)):
+                for nx in range(max(0, cx - 1), min(w, cx + 2)):
+                    if binary[ny, nx] and not seen[ny, nx]:
+                        seen[ny, nx] = True
+                        todo.append((ny, nx))
+        ys, xs = zip(*pixels)
+        boxes.append((min(xs), min(ys), max(xs) + 1, max(ys) + 1, len(pixels)))
+    return sorted(boxes)
+
+
+@pytest.mark.parametrize("density", [0.2, 0.45, 0.6, 0.9])
+def test_components_match_a_flood_fill(density):
+    binary = np.random.default_rng(1).random((60, 80)) < density
+
+    assert sorted(map(tuple, _components(binary).tolist())) == _flood_fill(binary)
+
+
+def test_components_join_diagonals_and_spirals():
+    binary = np.zeros((9, 9), dtype=bool)
+    binary[0, 0:9] = binary[0:9, 8] = binary[8, 0:9] = binary[2:9, 0] = True
+    binary[2, 0:7] = binary[2:7, 6] = binary[6, 2:7] = binary[4:7, 2] = True
+    binary[4, 4] = True  # a dot inside the spiral, touching nothing
+
+    assert sorted(map(tuple, _components(binary).tolist())) == _flood_fill(binary)
+    assert len(_components(np.eye(5, dtype=bool))) == 1
+    assert len(_components(np.zeros((3, 3), dtype=bool))) == 0
+
+
+def test_line_art_without_lettering_has_no_text(tmp_path):
+    page = draw_page(tmp_path / "page.png").read_bytes()
+
+    triage = triage_page(page, split_panels=True)
+
+    assert not triage.has_text and triage.text_coverage() == 0.0
+    assert [panel.box for panel in triage.panels] == [(0, 0, 600, 900)]
+
+
+def test_lettering_is_found_and_only_its_panel_is_kept(tmp_path):
+    page = draw_page(tmp_path / "page.png", text=True).read_bytes()
+
+    whole, split = triage_page(page), triage_page(page, split_panels=True)
+
+    left, top, right, bottom = whole.text_regions[0]
+    assert 50 <= left < right <= 330 and 50 <= top < bottom <= 230
+    assert whole.text_coverage() == 1.0
+    assert [panel.has_text for panel in split.panels] == [True, False]
+    assert split.text_panels()[0].box[3] < 450
+    assert split.text_coverage() < 0.5
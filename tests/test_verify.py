@@ -0,0 +1,48 @@
+import base64
+import io
+
+from PIL import Image, ImageDraw
+
+from nyamanga.verify import repair, verify_edit
+
+
+def _png(image) -> bytes:
+    buf = io.BytesIO()
+    image.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def test_repair_restores_damage_around_a_bubble_but_keeps_the_bubble():
+    original = Image.new("RGB", (512, 512), "white")
+    ImageDraw.Draw(original).text((220, 240), "HELLO", fill="black")
+    bubble = (200, 220, 312, 280)
+
+    edited = original.copy()
+    draw = ImageDraw.Draw(edited)
+    # Art damaged all around the balloon, so the damage's bounding box covers it.
+    draw.rectangle((100, 100, 412, 412), fill="black")
+    draw.rectangle(bubble, fill="white")
+    draw.text((215, 240), "TRANSLATED", fill="red")
+
+    check = verify_edit(
+        _png(original),
+        base64.b64encode(_png(edited)).decode("ascii"),
+        [(210, 235, 300, 260)],
+        expect_text=True,
+    )
+    assert check.damaged and not check.missed
+    left, top, right, bottom = check.damaged[0]
+    assert left <= bubble[0] and top <= bubble[1] and right >= bubble[2] and bottom >= bubble[3]
+
+    repaired_b64 = repair(
+        _png(original),
+        base64.b64encode(_png(edited)).decode("ascii"),
+        check.cells,
+        keep=check.regions,
+    )
+    repaired = Image.open(io.BytesIO(base64.b64decode(repaired_b64))).convert("RGB")
+
+    assert repaired.crop(bubble).tobytes() == edited.crop(bubble).tobytes()
+    # Damage away from the balloon is back to the original art.
+    assert repaired.getpixel((120, 120)) == (255, 255, 255)
+    assert repaired.getpixel((400, 400)) == (255, 255, 255)
@@ -0,0 +1,85 @@
+import io
+import json
+
+import pytest
+
+from nyamanga.config import ApiConfig
+from nyamanga.pack import ChapterPack
+from nyamanga.pipeline import TypesettingPipeline
+from nyamanga.worker import JsonLinesWorker
+
+from conftest import draw_page
+
+
+def _run(jobs, workers=2, **kwargs):
+    source = io.StringIO("".join(json.dumps(job) + "\n" for job in jobs))
+    sink = io.StringIO()
+    with TypesettingPipeline(ApiConfig.from_env()) as pipeline:
+        failures = JsonLinesWorker(pipeline, workers=workers, **kwargs).run(source, sink)
+    results = {result["id"]: result for result in map(json.loads, sink.getvalue().splitlines())}
+    return failures, results
+
+
+@pytest.mark.parametrize(
+    "job, error",
+    [
+        ({"priority": "urgent"}, "ValueError: Unknown priority 'urgent'"),
+        ({"target_language": ","}, "ValueError: target_language names no language"),
+        ({"target_language": ["en", 3]}, "ValueError: target_language must be a string"),
+        (
+            {"target_language": "en,fr", "session": "ch1"},
+            "ValueError: rewrite jobs take a single target_language",
+        ),
+    ],
+)
+def test_bad_job_fields_are_rejected_before_any_call(api_env, job, error):
+    failures, results = _run([{"id": "bad", "type": "rewrite", "text": "hi", **job}])
+
+    assert failures == 1
+    assert results["bad"]["error"].startswith(error)
+    assert api_env.calls == []
+
+
+def test_localize_job_fans_out_to_one_file_per_language(api_env, tmp_path):
+    page = draw_page(tmp_path / "page.png", text=True)
+    job = {"id": 1, "image": str(page), "text": "hi", "target_language": "zh,en"}
+
+    failures, results = _run([{**job, "output": str(tmp_path / "out.png")}])
+
+    assert failures == 0
+    assert results[1]["outputs"] == {
+        "zh": str(tmp_path / "out_zh.png"),
+        "en": str(tmp_path / "out_en.png"),
+    }
+    assert set(results[1]["text"]) == {"zh", "en"}
+    assert all((tmp_path / name).exists() for name in ("out_zh.png", "out_en.png"))
+    assert set(results[1]["timings"]) >= {"api_s", "write_s", "queued_s", "total_s"}
+
+
+def test_pages_go_into_the_pack_when_one_is_given(api_env, tmp_path):
+    page = draw_page(tmp_path / "page.png", text=True)
+    pack = ChapterPack(tmp_path / "ch.nyapack")
+
+    failures, results = _run([{"id": 1, "image": str(page), "text": "hi"}], pack=pack)
+
+    assert failures == 0
+    assert results[1]["outputs"] == {"zh": "page_localized.png"}
+    assert results[1]["pack"] == str(pack.path)
+    assert pack.get("page.png", "zh").params["text"] == "translated"
+    assert not (tmp_path / "page_localized.png").exists()
+
+
+def test_rewrite_jobs_in_one_session_share_its_context(api_env):
+    api_env.chat_reply = json.dumps({"lines": ["好"]})
+    jobs = [
+        {"id": 1, "type": "rewrite", "text": "Okay.", "session": "ch1", "speaker": "Aya"},
+        {"id": 2, "type": "rewrite", "text": "Fine.", "session": "ch1"},
+        {"id": 3, "type": "rewrite", "text": "Sure.", "session": "ch2"},
+    ]
+
+    failures, results = _run(jobs, workers=1)
+
+    assert failures == 0
+    assert [results[n]["text"] for n in (1, 2, 3)] == ["好", "好", "好"]
+    prompts = [json.loads(call["body"])["messages"][0]["content"] for call in api_env.calls]
+    assert ["- Character: Aya" in prompt for prompt in prompts] == [True, True, False]
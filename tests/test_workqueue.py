@@ -0,0 +1,95 @@
+import threading
+import time
+
+from nyamanga.workqueue import QueueWorker, WorkQueue
+
+
+class Runner:
+    """Stands in for `JsonLinesWorker`: echoes each job after `delay` seconds."""
+
+    def __init__(self, workers=1, delay=0.0):
+        self.workers = workers
+        self.delay = delay
+
+    def run_job(self, job, cancel=None):
+        time.sleep(self.delay)
+        if job.get("fail"):
+            raise ValueError("bad job")
+        return {"text": job["text"]}
+
+
+def test_two_connections_never_claim_the_same_job(tmp_path):
+    path = tmp_path / "queue.db"
+    ids = WorkQueue(path).enqueue({"text": str(n)} for n in range(60))
+    claimed = {"a": [], "b": []}
+
+    def drain(owner):
+        queue = WorkQueue(path)
+        while True:
+            jobs = queue.claim(owner, limit=3)
+            if not jobs:
+                break
+            claimed[owner].extend(job.id for job in jobs)
+        queue.close()
+
+    threads = [threading.Thread(target=drain, args=(owner,)) for owner in claimed]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not set(claimed["a"]) & set(claimed["b"])
+    assert sorted(claimed["a"] + claimed["b"]) == ids
+
+
+def test_expired_lease_is_requeued_until_attempts_run_out(tmp_path):
+    queue = WorkQueue(tmp_path / "queue.db", lease_seconds=0.05)
+    (job_id,) = queue.enqueue([{"text": "hi"}], max_attempts=2)
+
+    assert [job.id for job in queue.claim("a")] == [job_id]
+    time.sleep(0.1)
+    assert queue.counts()["queued"] == 1
+    assert "Lease expired (worker a" in queue.get(job_id).error
+
+    (job,) = queue.claim("b")
+    assert job.attempts == 2
+    time.sleep(0.1)
+    assert queue.counts()["failed"] == 1
+    assert queue.claim("c") == []
+
+
+def test_stale_owner_cannot_finish_a_reclaimed_job(tmp_path):
+    queue = WorkQueue(tmp_path / "queue.db", lease_seconds=0.05)
+    (job_id,) = queue.enqueue([{"text": "hi"}])
+    queue.claim("a")
+    time.sleep(0.1)
+    queue.claim("b")
+
+    assert not queue.complete("a", job_id, {"text": "stale"})
+    assert not queue.fail("a", job_id, "stale")
+    assert queue.heartbeat("a", [job_id]) == {job_id}
+    assert queue.complete("b", job_id, {"text": "fresh"})
+    assert queue.get(job_id).result == {"text": "fresh"}
+
+
+def test_worker_exits_when_the_queue_drains(tmp_path):
+    queue = WorkQueue(tmp_path / "queue.db")
+    queue.enqueue([{"text": "a"}, {"text": "b", "fail": True}, {"text": "c"}])
+    worker = QueueWorker(queue, Runner(workers=2), owner="w", poll_interval=0.05)
+
+    assert worker.run(exit_when_empty=True) == 1
+    assert worker.processed == 2
+    assert queue.counts() == {"queued": 0, "running": 0, "done": 2, "failed": 1}
+
+
+def test_full_worker_claims_as_soon_as_a_job_finishes(tmp_path):
+    queue = WorkQueue(tmp_path / "queue.db")
+    queue.enqueue({"text": str(n)} for n in range(5))
+    # A long poll interval: only the finish signal can make this fast.
+    worker = QueueWorker(queue, Runner(workers=1, delay=0.02), owner="w", poll_interval=10.0)
+
+    started = time.monotonic()
+    worker.run(exit_when_empty=True)
+
+    assert worker.processed == 5
+    assert time.monotonic() - started < 2.0